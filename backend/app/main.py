@@ -1,21 +1,98 @@
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
+from fastapi.responses import PlainTextResponse
+from .database import engine
+from .migrations import upgrade
 from .routers import projects, chapters, entities, assistant
+from .services import metrics, profiling
+from .services.query_stats import instrument_engine, track_queries
+import logging
+import os
 import time
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("app.requests")
+
+# Debug mode: report per-request SQL statement counts in response headers
+DEBUG_QUERY_HEADERS = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+
+# Schema upgrades run when the server starts, not on import; set AUTO_MIGRATE=0 to run
+# `python -m app.migrations` as a separate deploy step instead
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1").lower() not in ("0", "false", "no")
+
+instrument_engine(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        # Create tables and add columns new models need
+        upgrade(engine)
+    yield
 
-app = FastAPI(title="Novel NER API")
+app = FastAPI(title="Novel NER API", lifespan=lifespan)
 
-# Request logging middleware
+def _handler_label(request: Request) -> str:
+    # Label by endpoint function, not raw path, to keep label cardinality bounded
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    return f"{endpoint.__module__.rsplit('.', 1)[-1]}.{endpoint.__name__}"
+
+# Request metrics middleware
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    metrics.http_requests_in_flight.inc()
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        with track_queries() as stats:
+            response = await call_next(request)
+        status = response.status_code
+        if DEBUG_QUERY_HEADERS:
+            response.headers["X-Query-Count"] = str(stats.count)
+            response.headers["X-Query-Time-Ms"] = f"{stats.total_time * 1000:.2f}"
+        return response
+    finally:
+        duration = time.perf_counter() - start_time
+        metrics.http_requests_in_flight.dec()
+        handler = _handler_label(request)
+        metrics.http_request_duration.observe(duration, method=request.method, handler=handler, status=status)
+        metrics.db_queries_per_request.observe(stats.count, handler=handler)
+        metrics.db_query_time_per_request.observe(stats.total_time, handler=handler)
+        logger.debug(f"{request.method} {request.url.path} - {status} ({duration:.3f}s, {stats.count} queries)")
+
+# On-demand profiling (no-op unless PROFILING_TOKEN is set and sent with the request)
 @app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    duration = time.time() - start_time
-    print(f"{request.method} {request.url.path} - {response.status_code} ({duration:.2f}s)")
+async def profile_requests(request: Request, call_next):
+    if not profiling.is_requested(request):
+        return await call_next(request)
+    profile = profiling.RequestProfile(f"{request.method} {request.url.path}")
+    profile.start()
+    try:
+        with track_queries(profile.queries):
+            response = await call_next(request)
+    except BaseException:
+        profile.stop()
+        raise
+    
+    # Keep sampling until the body is sent: a streamed answer does its work there.
+    # The id goes out with the headers; the report is there once the body is done
+    body = response.body_iterator
+    
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            profile.stop()
+            profile.save()
+    
+    response.body_iterator = profiled_body()
+    response.headers["X-Profile-Id"] = profile.profile_id
     return response
 
 # CORS
@@ -34,4 +111,17 @@ app.include_router(assistant.router, prefix="/api/assistant", tags=["assistant"]
 
 @app.get("/")
 def root():
-    return {"message": "Novel NER API is running"}
\ No newline at end of file
+    return {"message": "Novel NER API is running"}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+def get_profile_report(profile_id: str, request: Request):
+    if not profiling.is_requested(request):
+        raise HTTPException(status_code=404, detail="Not found")
+    report = profiling.load_report(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(report)
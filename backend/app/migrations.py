@@ -0,0 +1,146 @@
+"""Minimal schema upgrades for existing databases.
+
+`Base.metadata.create_all` creates missing tables but never alters existing
+ones, so columns and indexes added to a model later are added here. Only
+nullable columns are supported (a server default is carried over so
+existing rows get it), which is all this project adds; anything bigger
+deserves a real migration tool. Foreign keys whose ON DELETE rule changed
+are recreated; SQLite can't alter constraints, so the table is rebuilt.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint, Table
+
+from . import models  # Registers the model tables on Base
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine: Engine):
+    """ALTER TABLE ... ADD COLUMN for model columns the database doesn't have yet"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f"Can't add NOT NULL column {table.name}.{column.name} automatically")
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = ""
+                if column.server_default is not None and isinstance(column.server_default.arg, str):
+                    default = f" DEFAULT '{column.server_default.arg}'"
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}{default}"
+                ))
+                logger.info(f"✓ Added column {table.name}.{column.name}")
+
+
+def add_missing_indexes(engine: Engine):
+    """CREATE INDEX for model indexes the database doesn't have yet"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in present:
+                    index.create(connection)
+                    logger.info(f"✓ Added index {index.name}")
+
+
+def _ondelete(rule) -> str:
+    return (rule or "NO ACTION").upper()
+
+
+def _stale_foreign_keys(inspector, table: Table):
+    """(existing foreign key, model constraint) pairs whose ON DELETE rules differ"""
+    stale = []
+    for existing in inspector.get_foreign_keys(table.name):
+        for constraint in table.foreign_key_constraints:
+            if (list(constraint.column_keys) == existing["constrained_columns"]
+                    and constraint.referred_table.name == existing["referred_table"]):
+                if _ondelete(constraint.ondelete) != _ondelete(existing.get("options", {}).get("ondelete")):
+                    stale.append((existing, constraint))
+    return stale
+
+
+def _rebuild_sqlite_table(connection: Connection, table: Table):
+    """Recreate a table from the model, keeping its rows (SQLite's ALTER TABLE can't change constraints)"""
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    old_name = f"_old_{table.name}"
+    columns = [column["name"] for column in inspector.get_columns(table.name) if column["name"] in table.columns]
+    for index in inspector.get_indexes(table.name):
+        connection.execute(text(f"DROP INDEX {preparer.quote(index['name'])}"))
+    connection.execute(text(f"ALTER TABLE {preparer.quote(table.name)} RENAME TO {preparer.quote(old_name)}"))
+    table.create(connection)
+    column_list = ", ".join(preparer.quote(name) for name in columns)
+    connection.execute(text(
+        f"INSERT INTO {preparer.quote(table.name)} ({column_list}) SELECT {column_list} FROM {preparer.quote(old_name)}"
+    ))
+    connection.execute(text(f"DROP TABLE {preparer.quote(old_name)}"))
+
+
+def update_foreign_keys(engine: Engine):
+    """Bring existing foreign keys' ON DELETE rules in line with the models"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    stale = {
+        table.name: _stale_foreign_keys(inspector, table)
+        for table in Base.metadata.sorted_tables if table.name in existing_tables
+    }
+    stale = {name: keys for name, keys in stale.items() if keys}
+    if not stale:
+        return
+    
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            # Renaming must not rewrite other tables' references, and nothing is checked mid-rebuild
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+            connection.commit()
+            try:
+                with connection.begin():
+                    for name in stale:
+                        _rebuild_sqlite_table(connection, Base.metadata.tables[name])
+                        logger.info(f"✓ Rebuilt table {name} with ON DELETE rules")
+            finally:
+                connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+                connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+                connection.commit()
+        return
+    
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for name, keys in stale.items():
+            for existing, constraint in keys:
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(name)} DROP CONSTRAINT {preparer.quote(existing['name'])}"
+                ))
+                connection.execute(AddConstraint(constraint))
+                logger.info(f"✓ Updated foreign key {name}.{', '.join(existing['constrained_columns'])}")
+
+
+def upgrade(engine: Engine):
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    update_foreign_keys(engine)
+    add_missing_indexes(engine)
+
+
+if __name__ == "__main__":
+    from .database import engine
+    
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -13,47 +13,72 @@ class Project(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    chapters = relationship("Chapter", back_populates="project", cascade="all, delete-orphan")
-    entities = relationship("Entity", back_populates="project", cascade="all, delete-orphan")
+    # Children are removed by the database (ON DELETE CASCADE), not loaded and deleted one by one
+    chapters = relationship("Chapter", back_populates="project", cascade="all, delete-orphan", passive_deletes=True)
+    entities = relationship("Entity", back_populates="project", cascade="all, delete-orphan", passive_deletes=True)
 
 class ChapterVersion(Base):
     __tablename__ = "chapter_versions"
     
     id = Column(Integer, primary_key=True, index=True)
-    chapter_id = Column(Integer, ForeignKey("chapters.id"))
+    chapter_id = Column(Integer, ForeignKey("chapters.id", ondelete="CASCADE"))
     version_number = Column(Integer)
-    content = Column(Text)
+    content = Column(Text, nullable=True)  # Full text on keyframes, None on delta versions
     notes = Column(Text, nullable=True)
     word_count = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     created_by = Column(String, nullable=True)  # Future: user system
     change_summary = Column(String, nullable=True)  # "Added scene with Dumbledore"
+    content_hash = Column(String, nullable=True)  # sha256 of content + notes; None on old rows
+    keyframe_id = Column(Integer, ForeignKey("chapter_versions.id"), nullable=True)
+    delta = Column(LargeBinary, nullable=True)  # Compressed edits against the keyframe (see version_store)
     
     chapter = relationship("Chapter", back_populates="versions")
+    keyframe = relationship("ChapterVersion", remote_side=[id])
 
 
 class Chapter(Base):
     __tablename__ = "chapters"
     
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"))
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"))
     chapter_number = Column(Integer)
     title = Column(String, nullable=True)
     content = Column(Text)  # Changed from original_text
     notes = Column(Text, nullable=True)  # For your writing notes
     word_count = Column(Integer, default=0)
+    revision = Column(Integer, default=0, server_default="0")  # Bumped on every content change; PATCH edits apply against it
+    mentions_revision = Column(Integer, default=0, server_default="0")  # Bumped when its mentions or their entities change
+    ner_revision = Column(Integer, default=0)  # Content revision its mentions' offsets refer to (NULL: not recorded)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    versions = relationship("ChapterVersion", back_populates="chapter", cascade="all, delete-orphan")
+    versions = relationship("ChapterVersion", back_populates="chapter", cascade="all, delete-orphan", passive_deletes=True)
     
     project = relationship("Project", back_populates="chapters")
-    entity_mentions = relationship("EntityMention", back_populates="chapter", cascade="all, delete-orphan")
+    entity_mentions = relationship("EntityMention", back_populates="chapter", cascade="all, delete-orphan",
+                                   passive_deletes=True)
+    analysis = relationship("ChapterAnalysis", back_populates="chapter", uselist=False, passive_deletes=True)
+
+class ChapterAnalysis(Base):
+    __tablename__ = "chapter_analyses"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chapter_id = Column(Integer, ForeignKey("chapters.id", ondelete="CASCADE"), unique=True, index=True)
+    content_hash = Column(String)  # sha256 of the chapter content this analysis describes
+    sentences = Column(JSON, default=[])  # [[start, end], ...] character offsets
+    paragraphs = Column(JSON, default=[])  # [[start, end], ...]
+    entity_spans = Column(JSON, default=[])  # [[start, end, entity_id], ...]
+    fingerprint = Column(String)  # Hash of the spans; changes re-chunk the chapter
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    chapter = relationship("Chapter", back_populates="analysis")
 
 class Entity(Base):
     __tablename__ = "entities"
     
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"))
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"))
     name = Column(String, index=True)
     entity_type = Column(String)  # 'character', 'location', 'organization', 'item', 'concept'
     description = Column(Text, nullable=True)  # Character background, location details, etc.
@@ -63,18 +88,22 @@ class Entity(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     project = relationship("Project", back_populates="entities")
-    mentions = relationship("EntityMention", back_populates="entity", cascade="all, delete-orphan")
+    mentions = relationship("EntityMention", back_populates="entity", cascade="all, delete-orphan", passive_deletes=True)
 
 class EntityMention(Base):
     __tablename__ = "entity_mentions"
+    __table_args__ = (
+        Index("ix_entity_mentions_chapter_start", "chapter_id", "start_pos"),  # A chapter's mentions in text order
+        Index("ix_entity_mentions_chapter_entity", "chapter_id", "entity_id"),  # Covers per-chapter entity counts
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"))
-    chapter_id = Column(Integer, ForeignKey("chapters.id"))
+    entity_id = Column(Integer, ForeignKey("entities.id", ondelete="CASCADE"))
+    chapter_id = Column(Integer, ForeignKey("chapters.id", ondelete="CASCADE"))
     start_pos = Column(Integer)
     end_pos = Column(Integer)
-    context = Column(Text)  # Surrounding text
-    mentioned_as = Column(String)  # The exact text used
+    context = Column(Text)  # Surrounding text; NULL when derived from the chapter on read (services/mentions)
+    mentioned_as = Column(String)  # The exact text used; NULL likewise
     
     entity = relationship("Entity", back_populates="mentions")
     chapter = relationship("Chapter", back_populates="entity_mentions")
\ No newline at end of file
@@ -0,0 +1,15 @@
+import orjson
+from typing import Any, Iterable, Sequence
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson (handles datetimes natively)"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def rows_to_dicts(columns: Sequence[str], rows: Iterable[tuple]) -> list:
+    """Zip plain column tuples into dicts without touching ORM instances"""
+    return [dict(zip(columns, row)) for row in rows]
@@ -1,10 +1,19 @@
+import json
+import logging
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 from .. import models
 from ..database import get_db
-from ..services.ai_assistant import get_assistant
+from ..services.assistant_service import (
+    answer_question, knowledge_base_status, ready_assistant, release_assistant, start_knowledge_base_build,
+    stream_answer
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -15,25 +24,51 @@ class QuestionRequest(BaseModel):
 class AnswerResponse(BaseModel):
     answer: str
     sources: List[Dict]
+    cached: bool = False
+
+class KnowledgeBaseStatus(BaseModel):
+    status: str  # not_built, building, ready, failed or error
+    project_id: int
+    document_count: Optional[int] = None
+    kb_version: Optional[str] = None
+    error: Optional[str] = None
+    build: Optional[Dict] = None  # latest build job: state, done/total chunks, elapsed
 
-@router.post("/{project_id}/ask", response_model=AnswerResponse)
-def ask_question(
+def _building_response(project_id: int, rebuild: bool = False) -> JSONResponse:
+    """Start (or join) a background build and tell the client to poll /status"""
+    start_knowledge_base_build(project_id, rebuild=rebuild)
+    return JSONResponse(status_code=202, content=knowledge_base_status(project_id))
+
+@router.post("/{project_id}/ask", response_model=AnswerResponse,
+             responses={202: {"model": KnowledgeBaseStatus, "description": "Knowledge base is building"}})
+async def ask_question(
     project_id: int,
     request: QuestionRequest,
     db: Session = Depends(get_db)
 ):
-    """Ask the AI assistant a question about the story"""
-    # Check project exists
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    """Ask the AI assistant a question about the story.
+    
+    Returns 202 with the build status while the knowledge base is being built.
+    """
+    # Check project exists (sync DB work stays off the event loop)
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id).first()
+    )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
     try:
-        # Get or create assistant
-        assistant = get_assistant(project_id, db, rebuild=request.rebuild_kb)
+        if request.rebuild_kb:
+            return _building_response(project_id, rebuild=True)
+        assistant = ready_assistant(project_id)
+        if assistant is None:
+            return _building_response(project_id)
         
         # Ask question
-        result = assistant.ask(request.question, project.title)
+        try:
+            result = await answer_question(assistant, request.question, project.title)
+        finally:
+            release_assistant(assistant)
         
         return result
     except ValueError as e:
@@ -41,15 +76,79 @@ def ask_question(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
-@router.post("/{project_id}/rebuild-kb")
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/{project_id}/ask/stream",
+             responses={202: {"model": KnowledgeBaseStatus, "description": "Knowledge base is building"}})
+async def ask_question_stream(
+    project_id: int,
+    request: QuestionRequest,
+    db: Session = Depends(get_db)
+):
+    """Stream an answer as server-sent events: `sources` first, then `token` events, then `done`.
+    
+    Waits (without holding a thread) for a slot under the same limits as /ask.
+    """
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id).first()
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    try:
+        if request.rebuild_kb:
+            return _building_response(project_id, rebuild=True)
+        assistant = ready_assistant(project_id)
+        if assistant is None:
+            return _building_response(project_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    project_title = project.title
+    
+    async def events():
+        try:
+            async for chunk in stream_answer(assistant, request.question, project_title):
+                if 'sources' in chunk:
+                    yield _sse("sources", chunk['sources'])
+                else:
+                    yield _sse("token", {"text": chunk['token']})
+            yield _sse("done", {})
+        except Exception as e:
+            logger.exception("Streaming answer failed")
+            yield _sse("error", {"detail": f"Error: {str(e)}"})
+        finally:
+            release_assistant(assistant)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/{project_id}/rebuild-kb", status_code=202, response_model=KnowledgeBaseStatus)
 def rebuild_knowledge_base(project_id: int, db: Session = Depends(get_db)):
-    """Force rebuild of the knowledge base (call after major edits)"""
+    """Start a full rebuild of the knowledge base in the background (poll /status for progress)"""
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
     try:
-        assistant = get_assistant(project_id, db, rebuild=True)
-        return {"message": "Knowledge base rebuilt successfully"}
+        start_knowledge_base_build(project_id, rebuild=True)
+        return knowledge_base_status(project_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@router.get("/{project_id}/status", response_model=KnowledgeBaseStatus)
+def get_knowledge_base_status(project_id: int, db: Session = Depends(get_db)):
+    """Whether the assistant is ready, and progress of the latest knowledge base build"""
+    project = db.query(models.Project.id).filter(models.Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    return knowledge_base_status(project_id)
\ No newline at end of file
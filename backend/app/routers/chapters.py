@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import logging
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from .. import models, schemas
 from ..database import get_db
-from ..services.ner_service import process_chapter_ner
+from ..responses import FastJSONResponse
+from ..services.ner_service import schedule_chapter_ner
+from ..services.assistant_service import schedule_knowledge_base_sync
+from ..services.version_store import add_version, get_version, version_content
+from ..services.version_diff import diff_versions, elide
+from ..services.chapter_edits import apply_edits
+from ..services.annotations import chapter_annotations
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -14,14 +23,13 @@ def create_chapter(
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    print(f"\n📝 Creating new chapter in project {project_id}", flush=True)
+    logger.debug(f"📝 Creating new chapter in project {project_id}")
     
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
     word_count = len(chapter.content.split())
-    print(f"   Word count: {word_count}", flush=True)
     
     db_chapter = models.Chapter(
         **chapter.model_dump(),
@@ -32,13 +40,10 @@ def create_chapter(
     db.commit()
     db.refresh(db_chapter)
     
-    print(f"✓ Chapter created with ID: {db_chapter.id}", flush=True)
-    print(f"⏰ Scheduling NER background task...", flush=True)
+    logger.debug(f"✓ Chapter created with ID: {db_chapter.id} ({word_count} words)")
     
     # Run NER in background (English)
-    background_tasks.add_task(process_chapter_ner, db_chapter.id, 'en')
-    
-    print(f"✓ Background task scheduled", flush=True)
+    schedule_chapter_ner(background_tasks, db_chapter.id, 'en')
     
     return db_chapter
 
@@ -62,37 +67,100 @@ def update_chapter(
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    print(f"\n📝 Updating chapter {chapter_id}", flush=True)
-    
     db_chapter = db.query(models.Chapter).filter(models.Chapter.id == chapter_id).first()
     if not db_chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
     
     update_data = chapter.model_dump(exclude_unset=True)
+    base_revision = update_data.pop('base_revision', None)
+    if base_revision is not None and base_revision != (db_chapter.revision or 0):
+        raise HTTPException(status_code=409, detail={
+            "message": "Chapter was changed since that revision",
+            "revision": db_chapter.revision or 0
+        })
     
     # Recalculate word count if content changed
     if 'content' in update_data:
         update_data['word_count'] = len(update_data['content'].split())
-        print(f"   Content changed, new word count: {update_data['word_count']}", flush=True)
-        print(f"⏰ Scheduling NER background task...", flush=True)
-        # Re-run NER if content changed
-        background_tasks.add_task(process_chapter_ner, chapter_id, 'en')
-        print(f"✓ Background task scheduled", flush=True)
+        update_data['revision'] = (db_chapter.revision or 0) + 1
+        logger.debug(f"📝 Chapter {chapter_id} content changed, new word count: {update_data['word_count']}")
     
     for key, value in update_data.items():
         setattr(db_chapter, key, value)
     
     db.commit()
     db.refresh(db_chapter)
+    
+    if 'content' in update_data:
+        # Re-run NER if content changed (it syncs the knowledge base when done)
+        schedule_chapter_ner(background_tasks, chapter_id, 'en')
+    elif update_data:
+        schedule_knowledge_base_sync(background_tasks, db_chapter.project_id)
     return db_chapter
 
+@router.patch("/{chapter_id}", response_model=schemas.ChapterPatchResult)
+def patch_chapter(
+    chapter_id: int,
+    patch: schemas.ChapterPatch,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """Apply range edits to the chapter content at `base_revision`.
+    
+    Fails with 409 (and the current revision) if the chapter has changed
+    since; the client should reload or resend its full text with PUT.
+    """
+    current = db.query(
+        models.Chapter.content, models.Chapter.word_count, models.Chapter.revision
+    ).filter(models.Chapter.id == chapter_id).first()
+    if not current:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    
+    revision = current.revision or 0
+    if patch.base_revision != revision:
+        raise HTTPException(status_code=409, detail={
+            "message": "Chapter was changed since that revision",
+            "revision": revision
+        })
+    
+    try:
+        content, word_delta = apply_edits(current.content or "", patch.edits)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    word_count = (current.word_count or 0) + word_delta
+    
+    # Conditional on the revision, so a concurrent save between the read and here loses cleanly
+    updated = db.query(models.Chapter).filter(
+        models.Chapter.id == chapter_id,
+        models.Chapter.revision == current.revision
+    ).update({
+        models.Chapter.content: content,
+        models.Chapter.word_count: word_count,
+        models.Chapter.revision: revision + 1
+    }, synchronize_session=False)
+    if not updated:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Chapter was changed since that revision")
+    db.commit()
+    
+    logger.debug(f"📝 Chapter {chapter_id} patched to revision {revision + 1} ({len(patch.edits)} edits, {word_delta:+d} words)")
+    schedule_chapter_ner(background_tasks, chapter_id, 'en')
+    
+    return {"id": chapter_id, "revision": revision + 1, "word_count": word_count, "length": len(content)}
+
 @router.delete("/{chapter_id}")
-def delete_chapter(chapter_id: int, db: Session = Depends(get_db)):
+def delete_chapter(
+    chapter_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
     chapter = db.query(models.Chapter).filter(models.Chapter.id == chapter_id).first()
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
+    project_id = chapter.project_id
     db.delete(chapter)
     db.commit()
+    schedule_knowledge_base_sync(background_tasks, project_id)
     return {"message": "Chapter deleted"}
 
 @router.get("/{chapter_id}/versions")
@@ -115,10 +183,8 @@ def get_chapter_versions(chapter_id: int, db: Session = Depends(get_db)):
 
 @router.get("/version/{version_id}")
 def get_version_content(version_id: int, db: Session = Depends(get_db)):
-    """Get full content of a specific version"""
-    version = db.query(models.ChapterVersion).filter(
-        models.ChapterVersion.id == version_id
-    ).first()
+    """Get full content of a specific version (rebuilt from its keyframe if stored as a delta)"""
+    version = get_version(db, version_id)
     
     if not version:
         raise HTTPException(status_code=404, detail="Version not found")
@@ -126,13 +192,45 @@ def get_version_content(version_id: int, db: Session = Depends(get_db)):
     return {
         'id': version.id,
         'version_number': version.version_number,
-        'content': version.content,
+        'content': version_content(version),
         'notes': version.notes,
         'word_count': version.word_count,
         'created_at': version.created_at,
         'change_summary': version.change_summary
     }
 
+@router.get("/{chapter_id}/diff")
+def get_version_diff(
+    chapter_id: int,
+    from_version: int = Query(..., alias="from", description="Version id to diff from"),
+    to_version: int = Query(..., alias="to", description="Version id to diff to"),
+    context: Optional[int] = Query(None, ge=0, description="Characters of unchanged text to keep around each change"),
+    db: Session = Depends(get_db)
+):
+    """Paragraph-then-word diff between two versions of a chapter.
+    
+    `ops` is a list of ["=", text], ["-", text] and ["+", text]; with `context`,
+    long unchanged runs are cut down and ["…", characters skipped] marks the gap.
+    """
+    diff = diff_versions(db, chapter_id, from_version, to_version)
+    if diff is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    if context is not None:
+        diff = {**diff, "ops": elide(diff["ops"], context)}
+    return diff
+
+@router.get("/{chapter_id}/annotations")
+def get_chapter_annotations(chapter_id: int, db: Session = Depends(get_db)):
+    """Every entity mention in the chapter for highlighting, in text order.
+    
+    `starts`, `ends` and `entity` are parallel arrays; `entity` indexes into
+    `entities` ({id, name, entity_type}). Offsets are from the last NER run.
+    """
+    annotations = chapter_annotations(db, chapter_id)
+    if annotations is None:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    return FastJSONResponse(content=annotations)
+
 @router.post("/{chapter_id}/create-version")
 def create_version(
     chapter_id: int,
@@ -144,31 +242,20 @@ def create_version(
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
     
-    # Get current highest version number
-    max_version = db.query(function.max(models.ChapterVersion.version_number)).filter(
-        models.ChapterVersion.chapter_id == chapter_id
-    ).scalar() or 0
-    
-    # Create new version
-    version = models.ChapterVersion(
-        chapter_id=chapter_id,
-        version_number=max_version + 1,
-        content=chapter.content,
-        notes=chapter.notes,
-        word_count=chapter.word_count,
-        change_summary=change_summary
-    )
+    version, created = add_version(db, chapter, change_summary)
+    if not created:
+        return {"message": "No changes since the latest version", "version_number": version.version_number}
     
-    db.add(version)
+    version_number = version.version_number
     db.commit()
-    db.refresh(version)
     
-    return {"message": "Version created", "version_number": version.version_number}
+    return {"message": "Version created", "version_number": version_number}
 
 @router.post("/{chapter_id}/restore-version/{version_id}")
 def restore_version(
     chapter_id: int,
     version_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Restore chapter to a previous version"""
@@ -176,34 +263,23 @@ def restore_version(
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
     
-    version = db.query(models.ChapterVersion).filter(
-        models.ChapterVersion.id == version_id,
-        models.ChapterVersion.chapter_id == chapter_id
-    ).first()
+    version = get_version(db, version_id)
     
-    if not version:
+    if not version or version.chapter_id != chapter_id:
         raise HTTPException(status_code=404, detail="Version not found")
     
-    # Save current state as a new version before restoring
-    max_version = db.query(function.max(models.ChapterVersion.version_number)).filter(
-        models.ChapterVersion.chapter_id == chapter_id
-    ).scalar() or 0
-    
-    backup_version = models.ChapterVersion(
-        chapter_id=chapter_id,
-        version_number=max_version + 1,
-        content=chapter.content,
-        notes=chapter.notes,
-        word_count=chapter.word_count,
-        change_summary=f"Auto-backup before restoring to v{version.version_number}"
-    )
-    db.add(backup_version)
+    # Save current state as a new version before restoring (skipped if the latest version already has it)
+    add_version(db, chapter, f"Auto-backup before restoring to v{version.version_number}")
     
     # Restore the old version
-    chapter.content = version.content
+    chapter.content = version_content(version)
     chapter.notes = version.notes
     chapter.word_count = version.word_count
+    chapter.revision = (chapter.revision or 0) + 1
     
     db.commit()
     
+    # Mentions and the knowledge base refer to the old text
+    schedule_chapter_ner(background_tasks, chapter_id, 'en')
+    
     return {"message": f"Restored to version {version.version_number}"}
\ No newline at end of file
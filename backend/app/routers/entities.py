@@ -1,21 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func, asc
+from sqlalchemy import func, asc, or_
 from typing import List, Optional
 from .. import models, schemas
 from ..database import get_db
+from ..responses import FastJSONResponse, rows_to_dicts
+from ..services.assistant_service import schedule_knowledge_base_sync
+from ..services.annotations import touch_chapters
+from ..services.mentions import fill_mention_text, offsets_current
+from ..services.timeline import entity_timeline
 
 router = APIRouter()
 
+ENTITY_LIST_COLUMNS = (
+    'id', 'name', 'entity_type', 'description', 'aliases',
+    'mention_count', 'first_appearance', 'last_appearance'
+)
+
 @router.get("/{project_id}", response_model=List[schemas.EntityResponse])
 def list_entities(
     project_id: int,
     entity_type: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    # Fixed query with explicit select_from and join conditions
+    # Select plain columns only - no ORM instances, no per-row Pydantic validation
     query = db.query(
-        models.Entity,
+        models.Entity.id,
+        models.Entity.name,
+        models.Entity.entity_type,
+        models.Entity.description,
+        models.Entity.aliases,
         func.count(models.EntityMention.id).label('mention_count'),
         func.min(models.Chapter.chapter_number).label('first_appearance'),
         func.max(models.Chapter.chapter_number).label('last_appearance')
@@ -32,48 +46,60 @@ def list_entities(
     
     results = query.group_by(models.Entity.id).all()
     
-    return [
-        {
-            **entity.__dict__,
-            'mention_count': count or 0,
-            'first_appearance': first,
-            'last_appearance': last
-        }
-        for entity, count, first, last in results
-    ]
+    entities = rows_to_dicts(ENTITY_LIST_COLUMNS, results)
+    for entity in entities:
+        entity['aliases'] = entity['aliases'] or []
+    return FastJSONResponse(content=entities)
 
 @router.get("/{entity_id}/mentions")
 def get_entity_mentions(entity_id: int, db: Session = Depends(get_db)):
-    mentions = db.query(models.EntityMention).join(
+    # Pull chapter columns in the same query instead of lazy-loading m.chapter per row
+    mentions = db.query(
+        models.EntityMention.chapter_id,
+        models.Chapter.chapter_number,
+        models.Chapter.title,
+        models.EntityMention.context,
+        models.EntityMention.mentioned_as,
+        models.EntityMention.start_pos,
+        models.EntityMention.end_pos
+    ).join(
         models.Chapter,
         models.EntityMention.chapter_id == models.Chapter.id
     ).filter(
-        models.EntityMention.entity_id == entity_id
-    ).order_by(asc(models.Chapter.chapter_number)).all()
+        models.EntityMention.entity_id == entity_id,
+        # Compact rows of a chapter edited since NER ran would point at the wrong text
+        or_(models.EntityMention.context.isnot(None), offsets_current())
+    ).order_by(asc(models.Chapter.chapter_number), asc(models.EntityMention.start_pos)).all()
     
-    return [
+    # Compact rows carry only offsets; their text is sliced from the chapters in one more query
+    return fill_mention_text(db, [
         {
-            "chapter_id": m.chapter_id,
-            "chapter_number": m.chapter.chapter_number,
-            "chapter_title": m.chapter.title,
-            "context": m.context,
-            "mentioned_as": m.mentioned_as,
-            "position": m.start_pos
+            "chapter_id": chapter_id,
+            "chapter_number": chapter_number,
+            "chapter_title": chapter_title,
+            "context": context,
+            "mentioned_as": mentioned_as,
+            "position": start_pos,
+            "end_position": end_pos
         }
-        for m in mentions
-    ]
+        for chapter_id, chapter_number, chapter_title, context, mentioned_as, start_pos, end_pos in mentions
+    ])
 
 @router.put("/{entity_id}", response_model=schemas.EntityResponse)
 def update_entity(
     entity_id: int,
     entity: schemas.EntityUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     db_entity = db.query(models.Entity).filter(models.Entity.id == entity_id).first()
     if not db_entity:
         raise HTTPException(status_code=404, detail="Entity not found")
     
-    for key, value in entity.model_dump(exclude_unset=True).items():
+    changes = entity.model_dump(exclude_unset=True)
+    if any(key in changes and changes[key] != getattr(db_entity, key) for key in ('name', 'entity_type')):
+        touch_chapters(db, [entity_id])  # Annotations carry the name and type
+    for key, value in changes.items():
         setattr(db_entity, key, value)
     
     db.commit()
@@ -84,27 +110,46 @@ def update_entity(
         models.EntityMention.entity_id == entity_id
     ).scalar() or 0
     
-    return {**db_entity.__dict__, 'mention_count': mention_count}
+    schedule_knowledge_base_sync(background_tasks, db_entity.project_id)
+    
+    return {
+        'id': db_entity.id,
+        'name': db_entity.name,
+        'entity_type': db_entity.entity_type,
+        'description': db_entity.description,
+        'aliases': db_entity.aliases or [],
+        'mention_count': mention_count
+    }
 
 @router.delete("/{entity_id}")
-def delete_entity(entity_id: int, db: Session = Depends(get_db)):
+def delete_entity(
+    entity_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
     entity = db.query(models.Entity).filter(models.Entity.id == entity_id).first()
     if not entity:
         raise HTTPException(status_code=404, detail="Entity not found")
+    project_id = entity.project_id
+    touch_chapters(db, [entity_id])
     db.delete(entity)
     db.commit()
+    schedule_knowledge_base_sync(background_tasks, project_id)
     return {"message": "Entity deleted"}
 
 @router.post("/merge")
 def merge_entities(
     keep_id: int,
     merge_ids: List[int],
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Merge multiple entities into one"""
     from ..services.entity_resolver import EntityResolver
     
-    EntityResolver.merge_entities(db, keep_id, merge_ids)
+    project_id = EntityResolver.merge_entities(db, keep_id, merge_ids)
+    if project_id is not None:
+        schedule_knowledge_base_sync(background_tasks, project_id)
     return {"message": f"Merged {len(merge_ids)} entities into entity {keep_id}"}
 
 @router.get("/duplicates/{project_id}")
@@ -116,6 +161,11 @@ def find_duplicate_entities(project_id: int, db: Session = Depends(get_db)):
         models.Entity.project_id == project_id
     ).all()
     
+    # Compare in memory against the already-loaded entities (one query total)
+    entities_by_type = {}
+    for entity in entities:
+        entities_by_type.setdefault(entity.entity_type, []).append(entity)
+    
     duplicates = []
     checked = set()
     
@@ -123,8 +173,8 @@ def find_duplicate_entities(project_id: int, db: Session = Depends(get_db)):
         if entity.id in checked:
             continue
         
-        similar = EntityResolver.find_similar_entities(
-            db, project_id, entity.name, entity.entity_type, threshold=0.7
+        similar = EntityResolver.rank_similar(
+            entity.name, entities_by_type[entity.entity_type], threshold=0.7
         )
         
         if len(similar) > 1:  # Found duplicates
@@ -140,25 +190,55 @@ def find_duplicate_entities(project_id: int, db: Session = Depends(get_db)):
     
     return duplicates
 
+@router.get("/{project_id}/timeline")
+def get_entity_timeline(
+    project_id: int,
+    top: Optional[int] = Query(None, ge=1, description="Keep only the N most mentioned entities"),
+    from_chapter: Optional[int] = Query(None, description="First chapter number (inclusive)"),
+    to_chapter: Optional[int] = Query(None, description="Last chapter number (inclusive)"),
+    format: str = Query("dense", pattern="^(dense|sparse)$"),
+    db: Session = Depends(get_db)
+):
+    """Mention counts per entity and chapter, for the appearance heatmap.
+    
+    Dense: `counts[i][j]` is entity i's mentions in chapter j. Sparse: the
+    non-zero cells as parallel `entity`, `chapter` and `counts` arrays.
+    """
+    timeline = entity_timeline(db, project_id, top=top, from_chapter=from_chapter,
+                               to_chapter=to_chapter, sparse=format == "sparse")
+    return FastJSONResponse(content=timeline)
+
 @router.get("/{project_id}/relationships")
 def get_entity_relationships(project_id: int, db: Session = Depends(get_db)):
     """Get entities that appear together in chapters"""
-    from sqlalchemy import and_, func
+    from sqlalchemy import and_
+    from sqlalchemy.orm import aliased
+    
+    first = aliased(models.EntityMention)
+    second = aliased(models.EntityMention)
     
     # Find entities that appear in the same chapters
     relationships = db.query(
-        models.EntityMention.entity_id.label('entity_1'),
-        models.EntityMention.entity_id.label('entity_2'),
-        func.count(models.EntityMention.chapter_id).label('co_occurrences')
+        first.entity_id.label('entity_1'),
+        second.entity_id.label('entity_2'),
+        func.count(func.distinct(first.chapter_id)).label('co_occurrences')
     ).join(
-        models.EntityMention,
+        second,
         and_(
-            models.EntityMention.chapter_id == models.EntityMention.chapter_id,
-            models.EntityMention.entity_id < models.EntityMention.entity_id
+            first.chapter_id == second.chapter_id,
+            first.entity_id < second.entity_id
         )
-    ).group_by('entity_1', 'entity_2').all()
+    ).join(
+        models.Chapter,
+        first.chapter_id == models.Chapter.id
+    ).filter(
+        models.Chapter.project_id == project_id
+    ).group_by(first.entity_id, second.entity_id).all()
     
-    return relationships
+    return [
+        {'entity_1': entity_1, 'entity_2': entity_2, 'co_occurrences': count}
+        for entity_1, entity_2, count in relationships
+    ]
 
 @router.get("/{project_id}/export")
 def export_project(project_id: int, format: str = "json", db: Session = Depends(get_db)):
@@ -1,34 +1,55 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from typing import List
 from .. import models, schemas
 from ..database import get_db
+from ..responses import FastJSONResponse, rows_to_dicts
+from ..services.assistant_service import start_knowledge_base_build
+from ..services import project_delete
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.post("/", response_model=schemas.ProjectResponse)
-def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)):
+def create_project(project: schemas.ProjectCreate, build_kb: bool = False, db: Session = Depends(get_db)):
     # project is Pydantic schema - use model_dump()
     db_project = models.Project(**project.model_dump())
     db.add(db_project)
     db.commit()
     db.refresh(db_project)
+    
+    if build_kb:
+        # Have the assistant ready by the first question; runs off the request
+        try:
+            start_knowledge_base_build(db_project.id)
+        except ValueError as e:
+            logger.warning(f"⚠ Not building knowledge base for project {db_project.id}: {e}")
     # db_project is SQLAlchemy model - use __dict__
     return {**db_project.__dict__, 'chapter_count': 0}
 
+PROJECT_LIST_COLUMNS = (
+    'id', 'title', 'description', 'is_own_writing',
+    'created_at', 'updated_at', 'chapter_count'
+)
+
 @router.get("/", response_model=List[schemas.ProjectResponse])
 def list_projects(db: Session = Depends(get_db)):
+    # Plain column tuples encoded straight to JSON - skips ORM state and re-validation
     projects = db.query(
-        models.Project,
+        models.Project.id,
+        models.Project.title,
+        models.Project.description,
+        models.Project.is_own_writing,
+        models.Project.created_at,
+        models.Project.updated_at,
         func.count(models.Chapter.id).label('chapter_count')
     ).outerjoin(models.Chapter).group_by(models.Project.id).all()
     
-    # project is SQLAlchemy model - use __dict__
-    return [
-        {**project.__dict__, 'chapter_count': count}
-        for project, count in projects
-    ]
+    return FastJSONResponse(content=rows_to_dicts(PROJECT_LIST_COLUMNS, projects))
 
 @router.get("/{project_id}", response_model=schemas.ProjectResponse)
 def get_project(project_id: int, db: Session = Depends(get_db)):
@@ -48,9 +69,29 @@ def get_project(project_id: int, db: Session = Depends(get_db)):
 
 @router.delete("/{project_id}")
 def delete_project(project_id: int, db: Session = Depends(get_db)):
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
-    if not project:
+    """Delete a project with everything in it; large projects are deleted in the background (202)"""
+    result = db.query(
+        models.Project.id,
+        func.coalesce(func.sum(models.Chapter.word_count), 0)
+    ).outerjoin(models.Chapter).filter(
+        models.Project.id == project_id
+    ).group_by(models.Project.id).first()
+    
+    if not result:
         raise HTTPException(status_code=404, detail="Project not found")
-    db.delete(project)
-    db.commit()
-    return {"message": "Project deleted"}
\ No newline at end of file
+    
+    _, words = result
+    if words > project_delete.BACKGROUND_WORDS:
+        job = project_delete.start_project_delete(project_id)
+        return JSONResponse(status_code=202, content={"message": "Deleting project", "deletion": job.to_dict()})
+    
+    project_delete.delete_project(db, project_id)
+    return {"message": "Project deleted"}
+
+@router.get("/{project_id}/deletion")
+def get_project_deletion(project_id: int):
+    """Progress of a background project deletion"""
+    job = project_delete.project_delete_job(project_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No deletion for this project")
+    return job.to_dict()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
@@ -26,6 +26,22 @@ class ChapterUpdate(BaseModel):
     title: Optional[str] = None
     content: Optional[str] = None
     notes: Optional[str] = None
+    base_revision: Optional[int] = None  # If given, the update fails with 409 unless it matches
+
+class ChapterEdit(BaseModel):
+    offset: int = Field(ge=0)  # Character (code point) offset into the text as left by the previous edit
+    delete: int = Field(0, ge=0)  # Characters removed at offset
+    insert: str = ""  # Text inserted at offset
+
+class ChapterPatch(BaseModel):
+    base_revision: int
+    edits: List[ChapterEdit]
+
+class ChapterPatchResult(BaseModel):
+    id: int
+    revision: int
+    word_count: int
+    length: int  # Characters in the updated content, for the client to check its copy
 
 class ChapterResponse(BaseModel):
     id: int
@@ -35,6 +51,7 @@ class ChapterResponse(BaseModel):
     content: str
     notes: Optional[str]
     word_count: int
+    revision: int = 0
     created_at: datetime
     updated_at: Optional[datetime]
     
@@ -1,83 +1,182 @@
-from typing import Dict, List
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from pathlib import Path
 from .. import models
+from . import metrics
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+from .answer_cache import answer_cache
+from .assistant_service import ProgressCallback, project_vector_dir
+from .entity_retrieval import EntityRetriever
+from .ai_backends import create_embeddings, create_llm
+from .context_packing import estimate_tokens, pack_context
+from .numpy_vectorstore import NumpyVectorStore
+from .chapter_analysis import current_analyses, sentence_chunks
+import hashlib
+import logging
 import os
+import re
+import time
 
 # Modern imports - all current as of 2024
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_anthropic import ChatAnthropic
-from langchain_voyageai import VoyageAIEmbeddings
 from langchain_chroma import Chroma  # Modern Chroma import
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+ANSWER_PROMPT = PromptTemplate(
+    template="""You are Claude, an AI assistant helping an author understand their story "{project_title}". 
+
+Based on the following context from the story, please answer the question thoughtfully and specifically.
+
+Key guidelines:
+- Reference specific chapter numbers when possible
+- Quote relevant passages if helpful
+- If the answer isn't in the context, say so honestly
+- Be concise but thorough
+
+Context from the story:
+{context}
+
+Question: {question}
+
+Answer:""",
+    input_variables=["context", "question", "project_title"]
+)
+
+# Bump when chunking changes so existing knowledge bases are re-chunked on their next sync
+CHUNK_FORMAT = 2  # 2: chunks carry start_index
+
+def _content_hash(doc: Document, analysis: str = "") -> str:
+    metadata = {k: v for k, v in sorted(doc.metadata.items()) if k not in ('source_key', 'content_hash')}
+    # Chapters chunked from an NER analysis also change when the analysis does
+    prefix = f"{CHUNK_FORMAT}:{analysis}" if analysis else f"{CHUNK_FORMAT}"
+    return hashlib.sha256(f"{prefix}\n{metadata}\n{doc.page_content}".encode("utf-8")).hexdigest()
+
+# Chunks per add_documents call; progress is reported after each batch
+EMBED_BATCH_SIZE = 64
+
+# Retrieval: RETRIEVAL_K documents per question, of which up to ENTITY_PASSAGES
+# come from mentions of entities named in the question (0 disables that stage)
+RETRIEVAL_K = 6
+MMR_FETCH_K = 20
+MMR_LAMBDA = 0.7
+ENTITY_PASSAGES = int(os.getenv("ENTITY_PASSAGES", "4"))
+
+# chroma: one Chroma collection per project; numpy: memory-mapped matrix with exact search
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma").lower()
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float16")  # numpy store: float16 or int8
+
+CHUNK_SIZE = 800  # Optimized for Voyage-2
+CHUNK_OVERLAP = 200
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    # Split documents into chunks (optimized chunk size for Voyage)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""],
+        add_start_index=True  # Offsets let overlapping chunks be merged when building the prompt
+    )
 
 class StoryAssistant:
-    """RAG-based assistant using Claude + Voyage AI with modern langchain"""
+    """RAG-based assistant using Claude + Voyage AI with modern langchain.
+    
+    Embeddings and LLM come from the configured backends (see ai_backends)
+    unless passed in.
+    """
     
-    def __init__(self, anthropic_api_key: str, voyage_api_key: str, project_id: int):
+    def __init__(self, project_id: int, embeddings: Optional[Embeddings] = None,
+                 llm: Optional[BaseChatModel] = None, embedding_model: Optional[str] = None):
         self.project_id = project_id
         
-        # Voyage AI for embeddings
-        self.embeddings = VoyageAIEmbeddings(
-            voyage_api_key=voyage_api_key,
-            model="voyage-2",
-            batch_size=8  # Optimize batch processing
-        )
+        if embeddings is None:
+            embeddings, embedding_model, cacheable = create_embeddings()
+            # Reuse vectors for chunks embedded before (any project, any rebuild)
+            if cacheable and os.getenv("EMBEDDING_CACHE", "1").lower() not in ("0", "false", "no"):
+                embeddings = CachedEmbeddings(embeddings, embedding_model, get_embedding_cache())
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model or "custom"
         
-        # Claude for LLM
-        self.llm = ChatAnthropic(
-            model="claude-3-5-haiku-20241022",  # Latest Haiku model
-            anthropic_api_key=anthropic_api_key,
-            temperature=0.3,
-            max_tokens=4096  # Increased for longer responses
-        )
+        self.llm = llm if llm is not None else create_llm()
         
         # Persistent directory for this project
-        self.persist_dir = Path("./vector_db") / f"project_{project_id}"
+        self.persist_dir = project_vector_dir(project_id)
         self.persist_dir.mkdir(parents=True, exist_ok=True)
         
         self.vectorstore = None
+        self.kb_version = None  # Fingerprint of indexed content; keys the answer cache
+        self.entity_retriever = EntityRetriever(max_passages=ENTITY_PASSAGES) if ENTITY_PASSAGES > 0 else None
     
-    def build_knowledge_base(self, db: Session, project_id: int, force_rebuild: bool = False):
-        """Build vector database from all chapters and entities"""
+    def build_knowledge_base(self, db: Session, project_id: int, force_rebuild: bool = False,
+                             progress: Optional[ProgressCallback] = None):
+        """Open the project's vector collection and sync it with the database.
         
-        # Check if we already have a persisted vector store
-        if not force_rebuild and (self.persist_dir / "chroma.sqlite3").exists():
-            print(f"✓ Loading existing knowledge base for project {project_id}", flush=True)
-            try:
-                self.vectorstore = Chroma(
-                    persist_directory=str(self.persist_dir),
-                    embedding_function=self.embeddings
-                )
-                return 0  # Already loaded
-            except Exception as e:
-                print(f"⚠ Could not load existing KB: {e}. Rebuilding...", flush=True)
-                force_rebuild = True
+        Returns the number of chunks embedded (0 when nothing changed).
+        """
+        # Vectors from different models can't share a collection
+        collection_name = f"project_{project_id}"
+        if self.embedding_model != "voyage-2":
+            collection_name += "_" + re.sub(r"[^a-zA-Z0-9_-]", "_", self.embedding_model)
+        if VECTOR_STORE == "numpy":
+            self.vectorstore = NumpyVectorStore(
+                self.persist_dir / f"numpy_{collection_name}",
+                self.embeddings,
+                quantization=VECTOR_QUANTIZATION
+            )
+        else:
+            self.vectorstore = Chroma(
+                collection_name=collection_name[:63],
+                embedding_function=self.embeddings,
+                persist_directory=str(self.persist_dir)
+            )
         
-        print(f"🔨 Building new knowledge base for project {project_id}...", flush=True)
+        if force_rebuild:
+            logger.info(f"🔨 Rebuilding knowledge base for project {project_id} from scratch...")
+            self.vectorstore.reset_collection()
         
+        return self.sync_knowledge_base(db, project_id, progress)
+    
+    def _source_documents(self, db: Session, project_id: int,
+                          analyses: Optional[Dict[int, models.ChapterAnalysis]] = None) -> Dict[str, Document]:
+        """Current chapters, notes and entities as documents, by source key.
+        
+        Chapter analyses that are still current are added to `analyses` if given.
+        """
         # Get all chapters
         chapters = db.query(models.Chapter).filter(
             models.Chapter.project_id == project_id
         ).order_by(models.Chapter.chapter_number).all()
         
+        chapter_analyses = current_analyses(db, chapters)
+        if analyses is not None:
+            analyses.update(chapter_analyses)
+        
         # Get all entities
         entities = db.query(models.Entity).filter(
             models.Entity.project_id == project_id
         ).all()
         
-        if not chapters:
-            print(f"⚠ No chapters found for project {project_id}", flush=True)
-            return 0
+        # Mention counts in one grouped query rather than len(entity.mentions) per entity
+        mention_counts = dict(
+            db.query(models.EntityMention.entity_id, func.count(models.EntityMention.id))
+            .join(models.Entity, models.EntityMention.entity_id == models.Entity.id)
+            .filter(models.Entity.project_id == project_id)
+            .group_by(models.EntityMention.entity_id)
+            .all()
+        )
         
-        documents = []
+        sources = {}
         
         # Add chapter content
         for chapter in chapters:
-            doc = Document(
+            sources[f"chapter:{chapter.id}"] = Document(
                 page_content=chapter.content,
                 metadata={
                     'type': 'chapter',
@@ -87,11 +186,10 @@ class StoryAssistant:
                     'source': f"Chapter {chapter.chapter_number}"
                 }
             )
-            documents.append(doc)
             
             # Also add chapter notes if they exist
             if chapter.notes:
-                doc_notes = Document(
+                sources[f"notes:{chapter.id}"] = Document(
                     page_content=f"Author's notes for Chapter {chapter.chapter_number}: {chapter.notes}",
                     metadata={
                         'type': 'notes',
@@ -100,7 +198,6 @@ class StoryAssistant:
                         'source': f"Notes for Chapter {chapter.chapter_number}"
                     }
                 )
-                documents.append(doc_notes)
         
         # Add entity information
         for entity in entities:
@@ -111,10 +208,10 @@ class StoryAssistant:
                 entity_text += f". Also known as: {', '.join(entity.aliases)}"
             
             # Get mention count
-            mention_count = len(entity.mentions)
+            mention_count = mention_counts.get(entity.id, 0)
             entity_text += f". Appears {mention_count} times in the story."
             
-            doc = Document(
+            sources[f"entity:{entity.id}"] = Document(
                 page_content=entity_text,
                 metadata={
                     'type': 'entity',
@@ -124,104 +221,194 @@ class StoryAssistant:
                     'source': f"Entity: {entity.name}"
                 }
             )
-            documents.append(doc)
-        
-        # Split documents into chunks (optimized chunk size for Voyage)
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,  # Optimized for Voyage-2
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        splits = text_splitter.split_documents(documents)
         
-        print(f"   Creating {len(splits)} embeddings...", flush=True)
-        
-        # Create vector store with persistence (modern API)
-        self.vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
-            persist_directory=str(self.persist_dir),
-            collection_name=f"project_{project_id}"
-        )
+        # Hash covers text and metadata, so a renamed chapter is re-indexed too
+        for source_key, doc in sources.items():
+            analysis = chapter_analyses.get(doc.metadata['chapter_id']) if doc.metadata['type'] == 'chapter' else None
+            doc.metadata['source_key'] = source_key
+            doc.metadata['content_hash'] = _content_hash(doc, analysis.fingerprint if analysis else "")
         
-        print(f"✓ Knowledge base built: {len(splits)} chunks", flush=True)
-        return len(splits)
+        return sources
     
-    def ask(self, question: str, project_title: str) -> Dict[str, any]:
-        """Ask a question about the story using modern LCEL chain"""
+    def sync_knowledge_base(self, db: Session, project_id: int,
+                            progress: Optional[ProgressCallback] = None) -> int:
+        """Re-embed only sources whose content hash changed; drop removed ones"""
         if not self.vectorstore:
-            raise ValueError("Knowledge base not built. Call build_knowledge_base first.")
+            raise ValueError("Knowledge base not opened. Call build_knowledge_base first.")
         
-        # Modern prompt template
-        template = """You are Claude, an AI assistant helping an author understand their story "{project_title}". 
-
-Based on the following context from the story, please answer the question thoughtfully and specifically.
-
-Key guidelines:
-- Reference specific chapter numbers when possible
-- Quote relevant passages if helpful
-- If the answer isn't in the context, say so honestly
-- Be concise but thorough
-
-Context from the story:
-{context}
-
-Question: {question}
-
-Answer:"""
+        analyses: Dict[int, models.ChapterAnalysis] = {}
+        sources = self._source_documents(db, project_id, analyses)
+        if self.entity_retriever:
+            self.entity_retriever.load(db, project_id, {
+                doc.metadata['entity_id']: doc for doc in sources.values() if doc.metadata['type'] == 'entity'
+            })
+        kb_version = hashlib.sha256("\n".join(
+            f"{key}:{doc.metadata['content_hash']}" for key, doc in sorted(sources.items())
+        ).encode("utf-8")).hexdigest()[:16]
         
-        prompt = PromptTemplate(
-            template=template,
-            input_variables=["context", "question", "project_title"]
-        )
+        # What the collection currently holds: source_key -> (content_hash, chunk ids)
+        existing = self.vectorstore.get(include=["metadatas"])
+        indexed: Dict[str, tuple] = {}
+        stale_ids = []
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+            metadata = metadata or {}
+            source_key = metadata.get('source_key')
+            if source_key is None:
+                stale_ids.append(chunk_id)  # Legacy chunk from a full build without keys
+                continue
+            content_hash, ids = indexed.setdefault(source_key, (metadata.get('content_hash'), []))
+            ids.append(chunk_id)
         
-        # Create retriever with MMR (Maximum Marginal Relevance) for diversity
-        retriever = self.vectorstore.as_retriever(
-            search_type="mmr",  # Better diversity than pure similarity
-            search_kwargs={
-                "k": 6,  # Retrieve more documents
-                "fetch_k": 20,  # Consider more candidates
-                "lambda_mult": 0.7  # Balance relevance vs diversity
-            }
-        )
+        changed = []
+        for source_key, doc in sources.items():
+            current = indexed.get(source_key)
+            if current and current[0] == doc.metadata['content_hash']:
+                continue
+            changed.append(doc)
+            if current:
+                stale_ids.extend(current[1])
+        for source_key, (_, ids) in indexed.items():
+            if source_key not in sources:
+                stale_ids.extend(ids)
         
-        # Format documents helper
-        def format_docs(docs):
-            formatted = []
-            for i, doc in enumerate(docs, 1):
-                source = doc.metadata.get('source', 'Unknown')
-                formatted.append(f"[Source {i}: {source}]\n{doc.page_content}")
-            return "\n\n".join(formatted)
-        
-        # Modern LCEL chain with parallel execution
-        rag_chain = (
-            RunnableParallel(
-                {
-                    "context": retriever | format_docs,
-                    "question": RunnablePassthrough(),
-                    "project_title": lambda x: project_title
-                }
-            )
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        if stale_ids:
+            self.vectorstore.delete(ids=stale_ids)
         
-        # Get answer
+        if not changed:
+            self._set_kb_version(project_id, kb_version)
+            logger.info(f"✓ Knowledge base for project {project_id} is up to date")
+            return 0
+        
+        text_splitter = make_text_splitter()
+        entity_ids = {doc.metadata['entity_id'] for doc in sources.values() if doc.metadata['type'] == 'entity'}
+        splits = []
+        ids = []
+        for doc in changed:
+            analysis = analyses.get(doc.metadata['chapter_id']) if doc.metadata['type'] == 'chapter' else None
+            if analysis:
+                chunks = sentence_chunks(doc, analysis, CHUNK_SIZE, CHUNK_OVERLAP, text_splitter, entity_ids)
+            else:
+                chunks = text_splitter.split_documents([doc])
+            for i, chunk in enumerate(chunks):
+                splits.append(chunk)
+                ids.append(f"{doc.metadata['source_key']}:{i}")
+        
+        logger.info(f"   Embedding {len(splits)} chunks from {len(changed)} changed sources...")
+        end = 0
         try:
-            answer = rag_chain.invoke(question)
-        except Exception as e:
-            print(f"Error in RAG chain: {e}", flush=True)
+            for start in range(0, len(splits), EMBED_BATCH_SIZE):
+                end = start + EMBED_BATCH_SIZE
+                self.vectorstore.add_documents(splits[start:end], ids=ids[start:end])
+                if progress:
+                    progress(min(end, len(splits)), len(splits))
+        except Exception:
+            # Chunks carry their source's new hash: a source left half-written would look
+            # synced from then on, so drop what this run wrote and let the next sync redo it
+            self.vectorstore.delete(ids=ids[:end])
+            self._set_kb_version(project_id, None)
             raise
+        self._set_kb_version(project_id, kb_version)
         
-        # Get source documents for citation
-        source_docs = retriever.invoke(question)
+        logger.info(f"✓ Knowledge base synced: {len(splits)} chunks updated, {len(stale_ids)} removed")
+        return len(splits)
+    
+    def _set_kb_version(self, project_id: int, kb_version: Optional[str]):
+        """Record what the collection now holds; answers cached for anything else are dropped"""
+        if kb_version is None or kb_version != self.kb_version:
+            answer_cache.invalidate(project_id)
+        self.kb_version = kb_version
+    
+    def _entity_documents(self, question: str) -> List[Document]:
+        if not self.entity_retriever:
+            return []
+        return self.entity_retriever.retrieve(question, RETRIEVAL_K)
+    
+    @staticmethod
+    def _merge_retrieved(entity_docs: List[Document], vector_docs: List[Document]) -> List[Document]:
+        """Entity passages first, then vector hits not already covered"""
+        seen = {doc.metadata.get('entity_id') for doc in entity_docs if doc.metadata.get('type') == 'entity'}
+        docs = list(entity_docs)
+        for doc in vector_docs:
+            if doc.metadata.get('type') == 'entity' and doc.metadata.get('entity_id') in seen:
+                continue
+            docs.append(doc)
+        metrics.assistant_retrieved_documents.inc(len(entity_docs), source="entity")
+        metrics.assistant_retrieved_documents.inc(len(docs) - len(entity_docs), source="vector")
+        return docs[:RETRIEVAL_K]
+    
+    def _mmr_kwargs(self, k: int) -> Dict[str, any]:
+        if not self.vectorstore:
+            raise ValueError("Knowledge base not built. Call build_knowledge_base first.")
+        # MMR (Maximum Marginal Relevance) for diversity; over-fetch so duplicates can be dropped
+        return {"k": k, "fetch_k": max(MMR_FETCH_K, k), "lambda_mult": MMR_LAMBDA}
+    
+    def retrieve(self, question: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        """Run retrieval once; the same documents feed the prompt and the citations.
         
+        Entities named in the question are looked up by their mentions first;
+        vector search only fills the remaining slots. Pass the question
+        embedding if it was already computed.
+        """
+        start_time = time.perf_counter()
+        entity_docs = self._entity_documents(question)
+        vector_docs = []
+        remaining = RETRIEVAL_K - len(entity_docs)
+        if remaining > 0:
+            search_kwargs = self._mmr_kwargs(remaining + len(entity_docs))
+            if embedding is None:
+                vector_docs = self.vectorstore.max_marginal_relevance_search(question, **search_kwargs)
+            else:
+                vector_docs = self.vectorstore.max_marginal_relevance_search_by_vector(embedding, **search_kwargs)
+        metrics.assistant_retrieval_duration.observe(time.perf_counter() - start_time)
+        return self._merge_retrieved(entity_docs, vector_docs)
+    
+    async def aretrieve(self, question: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        """Async retrieval; pass the question embedding if it was already computed"""
+        start_time = time.perf_counter()
+        entity_docs = await run_in_threadpool(self._entity_documents, question)
+        vector_docs = []
+        remaining = RETRIEVAL_K - len(entity_docs)
+        if remaining > 0:
+            search_kwargs = self._mmr_kwargs(remaining + len(entity_docs))
+            if embedding is None:
+                vector_docs = await self.vectorstore.amax_marginal_relevance_search(question, **search_kwargs)
+            else:
+                vector_docs = await self.vectorstore.amax_marginal_relevance_search_by_vector(
+                    embedding, **search_kwargs
+                )
+        metrics.assistant_retrieval_duration.observe(time.perf_counter() - start_time)
+        return self._merge_retrieved(entity_docs, vector_docs)
+    
+    @staticmethod
+    def _context_documents(docs: List[Document]) -> List[Document]:
+        """Merge overlapping chunks and fit them into the context token budget"""
+        packed = pack_context(docs)
+        metrics.assistant_context_tokens.observe(sum(estimate_tokens(doc.page_content) for doc in packed))
+        return packed
+    
+    def _answer_chain(self):
+        # Modern LCEL chain
+        return ANSWER_PROMPT | self.llm | StrOutputParser()
+    
+    @staticmethod
+    def _chain_input(question: str, project_title: str, docs: List[Document]) -> Dict[str, str]:
+        formatted = []
+        for i, doc in enumerate(docs, 1):
+            source = doc.metadata.get('source', 'Unknown')
+            formatted.append(f"[Source {i}: {source}]\n{doc.page_content}")
+        return {
+            "context": "\n\n".join(formatted),
+            "question": question,
+            "project_title": project_title
+        }
+    
+    @staticmethod
+    def format_sources(docs: List[Document]) -> List[Dict]:
+        """Citation payload for the top unique retrieved documents"""
         sources = []
         seen_sources = set()
         
-        for doc in source_docs[:4]:  # Limit to top 4 unique sources
+        for doc in docs[:4]:  # Limit to top 4 unique sources
             source_key = (
                 doc.metadata.get('type'),
                 doc.metadata.get('chapter_number'),
@@ -246,19 +433,98 @@ Answer:"""
             
             sources.append(source_info)
         
+        return sources
+    
+    def ask(self, question: str, project_title: str) -> Dict[str, any]:
+        """Ask a question about the story using modern LCEL chain"""
+        source_docs = self._context_documents(self.retrieve(question))
+        
+        # Get answer
+        start_time = time.perf_counter()
+        try:
+            answer = self._answer_chain().invoke(
+                self._chain_input(question, project_title, source_docs)
+            )
+        except Exception as e:
+            logger.error(f"Error in RAG chain: {e}")
+            raise
+        finally:
+            metrics.assistant_llm_duration.observe(time.perf_counter() - start_time)
+        
+        return {
+            'answer': answer,
+            'sources': self.format_sources(source_docs)
+        }
+    
+    async def aask(self, question: str, project_title: str,
+                   embedding: Optional[List[float]] = None) -> Dict[str, any]:
+        """Async variant of ask; doesn't hold a threadpool worker while the LLM runs"""
+        source_docs = self._context_documents(await self.aretrieve(question, embedding))
+        
+        start_time = time.perf_counter()
+        try:
+            answer = await self._answer_chain().ainvoke(
+                self._chain_input(question, project_title, source_docs)
+            )
+        except Exception as e:
+            logger.error(f"Error in RAG chain: {e}")
+            raise
+        finally:
+            metrics.assistant_llm_duration.observe(time.perf_counter() - start_time)
+        
         return {
             'answer': answer,
-            'sources': sources
+            'sources': self.format_sources(source_docs)
         }
     
+    def ask_stream(self, question: str, project_title: str,
+                   embedding: Optional[List[float]] = None) -> Iterator[Dict[str, any]]:
+        """Yield {'sources': [...]} right after retrieval, then {'token': str} chunks"""
+        source_docs = self._context_documents(self.retrieve(question, embedding))
+        yield {'sources': self.format_sources(source_docs)}
+        
+        start_time = time.perf_counter()
+        try:
+            for token in self._answer_chain().stream(
+                self._chain_input(question, project_title, source_docs)
+            ):
+                if token:
+                    yield {'token': token}
+        except Exception as e:
+            logger.error(f"Error in RAG chain: {e}")
+            raise
+        finally:
+            metrics.assistant_llm_duration.observe(time.perf_counter() - start_time)
+    
+    async def astream(self, question: str, project_title: str,
+                      embedding: Optional[List[float]] = None) -> AsyncIterator[Dict[str, any]]:
+        """Async variant of ask_stream; doesn't hold a threadpool worker while tokens arrive"""
+        source_docs = self._context_documents(await self.aretrieve(question, embedding))
+        yield {'sources': self.format_sources(source_docs)}
+        
+        start_time = time.perf_counter()
+        try:
+            async for token in self._answer_chain().astream(
+                self._chain_input(question, project_title, source_docs)
+            ):
+                if token:
+                    yield {'token': token}
+        except Exception as e:
+            logger.error(f"Error in RAG chain: {e}")
+            raise
+        finally:
+            metrics.assistant_llm_duration.observe(time.perf_counter() - start_time)
+    
     def get_statistics(self) -> Dict[str, any]:
         """Get statistics about the knowledge base"""
         if not self.vectorstore:
             return {"status": "not_built"}
         
         try:
-            collection = self.vectorstore._collection
-            count = collection.count()
+            if isinstance(self.vectorstore, NumpyVectorStore):
+                count = self.vectorstore.count()
+            else:
+                count = self.vectorstore._collection.count()
             
             return {
                 "status": "ready",
@@ -268,38 +534,16 @@ Answer:"""
         except Exception as e:
             return {"status": "error", "error": str(e)}
 
-# Global cache of assistants (one per project)
-_assistant_cache: Dict[int, StoryAssistant] = {}
-
-def get_assistant(project_id: int, db: Session, rebuild: bool = False) -> StoryAssistant:
-    """Get or create assistant for a project"""
-    anthropic_key = os.getenv("ANTHROPIC_API_KEY")
-    voyage_key = os.getenv("VOYAGE_API_KEY")
-    
-    if not anthropic_key:
-        raise ValueError("ANTHROPIC_API_KEY not set in environment. Get one at https://console.anthropic.com/")
-    if not voyage_key:
-        raise ValueError("VOYAGE_API_KEY not set in environment. Get one at https://dash.voyageai.com/")
-    
-    if rebuild or project_id not in _assistant_cache:
-        assistant = StoryAssistant(
-            anthropic_api_key=anthropic_key,
-            voyage_api_key=voyage_key,
-            project_id=project_id
-        )
-        chunks = assistant.build_knowledge_base(db, project_id, force_rebuild=rebuild)
-        _assistant_cache[project_id] = assistant
-        if chunks > 0:
-            print(f"✓ Built knowledge base for project {project_id}: {chunks} chunks", flush=True)
-        else:
-            print(f"✓ Loaded existing knowledge base for project {project_id}", flush=True)
-    
-    return _assistant_cache[project_id]
-
-def clear_cache(project_id: int = None):
-    """Clear assistant cache (useful for memory management)"""
-    global _assistant_cache
-    if project_id:
-        _assistant_cache.pop(project_id, None)
-    else:
-        _assistant_cache.clear()
\ No newline at end of file
+    def close(self):
+        """Release the vector store client (called when evicted from the cache)"""
+        if isinstance(self.vectorstore, NumpyVectorStore):
+            self.vectorstore.close()
+            self.vectorstore = None
+            return
+        client = getattr(self.vectorstore, "_client", None)
+        if client is not None and hasattr(client, "close"):
+            try:
+                client.close()
+            except Exception as e:
+                logger.debug(f"Closing vector store client failed: {e}")
+        self.vectorstore = None
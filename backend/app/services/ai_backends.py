@@ -0,0 +1,209 @@
+"""Embedding and LLM backends for the assistant, selected by configuration.
+
+    EMBEDDING_BACKEND = voyage (default) | local | hashing
+    LLM_BACKEND       = anthropic (default) | stub
+
+`hashing` and `stub` need no network or API keys, so the whole RAG pipeline
+can run offline for tests and benchmarks.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_TOKEN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words feature hashing; similar texts get similar vectors"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers model on CPU (optional dependency)"""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError(
+                "EMBEDDING_BACKEND=local needs sentence-transformers: pip install sentence-transformers"
+            )
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, batch_size=32, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class StubChatModel(BaseChatModel):
+    """Offline LLM: waits `latency` seconds, then echoes what it was given.
+
+    Streaming yields one word per `token_latency` seconds.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    @staticmethod
+    def _reply(messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        question = re.search(r"Question:\s*(.*)", prompt)
+        sources = len(re.findall(r"\[Source \d+:", prompt))
+        asked = question.group(1).strip() if question else prompt[-80:]
+        return f"Stub answer to \"{asked}\" from {sources} sources ({len(prompt)} prompt characters)."
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+# Environment each backend needs before it can be created
+_REQUIRED_ENV = {
+    "voyage": ("VOYAGE_API_KEY", "https://dash.voyageai.com/"),
+    "anthropic": ("ANTHROPIC_API_KEY", "https://console.anthropic.com/"),
+}
+
+
+def _require_env(name: str, hint: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise ValueError(f"{name} not set in environment. Get one at {hint}")
+    return value
+
+
+def _voyage_embeddings():
+    from langchain_voyageai import VoyageAIEmbeddings
+    embeddings = VoyageAIEmbeddings(
+        voyage_api_key=_require_env(*_REQUIRED_ENV["voyage"]),
+        model="voyage-2",
+        batch_size=8  # Optimize batch processing
+    )
+    return embeddings, "voyage-2"
+
+
+def _local_embeddings():
+    model_name = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    return LocalEmbeddings(model_name), f"local:{model_name}"
+
+
+def _hashing_embeddings():
+    dim = int(os.getenv("HASHING_EMBEDDING_DIM", "384"))
+    return HashingEmbeddings(dim), f"hashing-{dim}"
+
+
+# name -> (factory returning (embeddings, model id), whether to use the embedding cache)
+EMBEDDING_BACKENDS: Dict[str, Tuple[Callable[[], Tuple[Embeddings, str]], bool]] = {
+    "voyage": (_voyage_embeddings, True),
+    "local": (_local_embeddings, True),
+    "hashing": (_hashing_embeddings, False),  # Cheaper to recompute than to look up
+}
+
+
+def _anthropic_llm():
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(
+        model="claude-3-5-haiku-20241022",  # Latest Haiku model
+        anthropic_api_key=_require_env(*_REQUIRED_ENV["anthropic"]),
+        temperature=0.3,
+        max_tokens=4096  # Increased for longer responses
+    )
+
+
+def _stub_llm():
+    return StubChatModel(
+        latency=float(os.getenv("STUB_LLM_LATENCY_MS", "0")) / 1000,
+        token_latency=float(os.getenv("STUB_LLM_TOKEN_LATENCY_MS", "0")) / 1000
+    )
+
+
+LLM_BACKENDS: Dict[str, Callable[[], BaseChatModel]] = {
+    "anthropic": _anthropic_llm,
+    "stub": _stub_llm,
+}
+
+
+def embedding_backend_name() -> str:
+    return os.getenv("EMBEDDING_BACKEND", "voyage").lower()
+
+
+def llm_backend_name() -> str:
+    return os.getenv("LLM_BACKEND", "anthropic").lower()
+
+
+def check_backends():
+    """Raise ValueError if a configured backend is unknown or missing its API key"""
+    embedding, llm = embedding_backend_name(), llm_backend_name()
+    if embedding not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{embedding}' (choose from {', '.join(EMBEDDING_BACKENDS)})")
+    if llm not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{llm}' (choose from {', '.join(LLM_BACKENDS)})")
+    # LLM key first, as before backends were configurable
+    for name in (llm, embedding):
+        if name in _REQUIRED_ENV:
+            _require_env(*_REQUIRED_ENV[name])
+
+
+def create_embeddings(name: Optional[str] = None) -> Tuple[Embeddings, str, bool]:
+    """(embeddings, model id, cacheable) for the configured or named backend"""
+    factory, cacheable = EMBEDDING_BACKENDS[name or embedding_backend_name()]
+    embeddings, model_id = factory()
+    return embeddings, model_id, cacheable
+
+
+def create_llm(name: Optional[str] = None) -> BaseChatModel:
+    return LLM_BACKENDS[name or llm_backend_name()]()
@@ -0,0 +1,85 @@
+"""Entity spans of a chapter, packed for highlighting and cached per revision.
+
+The payload is columnar: `starts`, `ends` and `entity` are parallel
+arrays in text order, `entity` indexing into a small `entities` list, so
+a chapter's few thousand mentions cost a few numbers each instead of an
+object apiece. Entries are keyed by the chapter's revision (its content)
+and mentions_revision, which NER runs, merges, deletes and renames of its
+entities bump; an entry is never updated in place, only superseded. A
+chapter edited since NER last ran has no spans until the next run.
+"""
+import os
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from . import metrics
+from .lru_cache import LRUCache
+
+ANNOTATION_CACHE_SIZE = int(os.getenv("CHAPTER_ANNOTATION_CACHE_SIZE", "256"))
+
+annotation_cache = LRUCache(ANNOTATION_CACHE_SIZE)
+
+
+def touch_chapters(db: Session, entity_ids: Iterable[int]):
+    """Bump mentions_revision of every chapter mentioning these entities; the caller commits"""
+    chapter_ids = db.query(models.EntityMention.chapter_id).filter(
+        models.EntityMention.entity_id.in_(list(entity_ids))
+    )
+    db.query(models.Chapter).filter(models.Chapter.id.in_(chapter_ids.scalar_subquery())).update(
+        {models.Chapter.mentions_revision: models.Chapter.mentions_revision + 1}, synchronize_session=False
+    )
+
+
+def pack_annotations(rows) -> Dict:
+    """Columnar spans from (start, end, entity id, name, type) rows in text order"""
+    starts, ends, indexes = [], [], []
+    entities, index_of = [], {}
+    for start, end, entity_id, name, entity_type in rows:
+        index = index_of.get(entity_id)
+        if index is None:
+            index = index_of[entity_id] = len(entities)
+            entities.append({"id": entity_id, "name": name, "entity_type": entity_type})
+        starts.append(start)
+        ends.append(end)
+        indexes.append(index)
+    return {"starts": starts, "ends": ends, "entity": indexes, "entities": entities}
+
+
+def chapter_annotations(db: Session, chapter_id: int) -> Optional[Dict]:
+    """Packed entity spans of a chapter; None if it doesn't exist.
+
+    One query on a cache hit (the chapter's revisions), two on a miss.
+    """
+    chapter = db.query(
+        models.Chapter.revision, models.Chapter.mentions_revision, models.Chapter.ner_revision,
+        models.Chapter.created_at
+    ).filter(models.Chapter.id == chapter_id).first()
+    if chapter is None:
+        return None
+    revision, mentions_revision, ner_revision, created_at = chapter
+    if ner_revision is not None and ner_revision != (revision or 0):
+        # Edited since NER ran: the stored offsets point into the old text
+        return {"chapter_id": chapter_id, "revision": revision or 0, **pack_annotations([])}
+
+    # created_at tells a new chapter apart from a deleted one whose id SQLite reused
+    key = (chapter_id, str(created_at), revision or 0, mentions_revision or 0)
+    result = annotation_cache.get(key)
+    metrics.chapter_annotation_cache_requests.inc(result=("hit" if result is not None else "miss"))
+    if result is None:
+        # Walks ix_entity_mentions_chapter_start: this chapter's rows, already in text order
+        rows = db.query(
+            models.EntityMention.start_pos,
+            models.EntityMention.end_pos,
+            models.EntityMention.entity_id,
+            models.Entity.name,
+            models.Entity.entity_type
+        ).join(
+            models.Entity, models.EntityMention.entity_id == models.Entity.id
+        ).filter(
+            models.EntityMention.chapter_id == chapter_id
+        ).order_by(models.EntityMention.start_pos).all()
+        result = {"chapter_id": chapter_id, "revision": revision or 0, **pack_annotations(rows)}
+        annotation_cache.put(key, result)
+    return result
@@ -0,0 +1,115 @@
+"""Assistant answer cache keyed by project, knowledge-base version and question"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip(" ?!.")
+
+
+class _Entry:
+    __slots__ = ("result", "created_at", "embedding")
+
+    def __init__(self, result: Dict, embedding: Optional[np.ndarray]):
+        self.result = result
+        self.created_at = time.monotonic()
+        self.embedding = embedding
+
+
+class AnswerCache:
+    """LRU + TTL cache of answers.
+
+    Entries are keyed by (project_id, kb_version, normalized question), so an
+    answer is never served against a different knowledge base. With a
+    similarity threshold > 0, a miss can fall back to the closest cached
+    question (cosine similarity of question embeddings) for the same version.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[int, str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def similarity_enabled(self) -> bool:
+        return self.similarity_threshold > 0
+
+    def _live(self, key, entry) -> bool:
+        if time.monotonic() - entry.created_at > self.ttl:
+            del self._entries[key]
+            return False
+        return True
+
+    def get(self, project_id: int, kb_version: str, question: str,
+            embedding: Optional[List[float]] = None) -> Optional[Dict]:
+        key = (project_id, kb_version, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._live(key, entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.result
+
+            if embedding is not None and self.similarity_enabled:
+                match = self._most_similar(project_id, kb_version, np.asarray(embedding, dtype=np.float32))
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.hits += 1
+                    return self._entries[match].result
+
+            self.misses += 1
+            return None
+
+    def _most_similar(self, project_id: int, kb_version: str, query: np.ndarray):
+        candidates = [
+            (key, entry) for key, entry in list(self._entries.items())
+            if key[0] == project_id and key[1] == kb_version
+            and entry.embedding is not None and self._live(key, entry)
+        ]
+        if not candidates:
+            return None
+        matrix = np.stack([entry.embedding for _, entry in candidates])
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.similarity_threshold else None
+
+    def put(self, project_id: int, kb_version: str, question: str, result: Dict,
+            embedding: Optional[List[float]] = None):
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+        key = (project_id, kb_version, normalize_question(question))
+        with self._lock:
+            self._entries[key] = _Entry(result, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, project_id: Optional[int] = None):
+        with self._lock:
+            if project_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == project_id]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+)
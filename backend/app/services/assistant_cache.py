@@ -0,0 +1,207 @@
+"""Bounded, thread-safe cache of per-project assistants"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+
+class _Slot(Generic[T]):
+    __slots__ = ("value", "last_used")
+
+    def __init__(self, value: T):
+        self.value = value
+        self.last_used = time.monotonic()
+
+
+class AssistantCache(Generic[T]):
+    """LRU cache with idle-time eviction and one build lock per key.
+
+    Only one thread builds a given key at a time; others wait on its lock and
+    then reuse the result. Evicted values are passed to `on_evict` (outside
+    the cache lock) so they can release clients and file handles. A value
+    taken with `acquire` is in use until `release`; if it is evicted
+    meanwhile, `on_evict` runs when its last user releases it instead.
+    """
+
+    def __init__(self, max_entries: int, idle_ttl: float, on_evict: Optional[Callable[[T], None]] = None):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self._slots: "OrderedDict[Hashable, _Slot[T]]" = OrderedDict()
+        self._build_locks: Dict[Hashable, threading.Lock] = {}
+        self._users: Dict[int, int] = {}  # id(value) -> acquired and not yet released
+        self._retired: Dict[int, T] = {}  # Evicted while in use; on_evict waits for the last release
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+
+    def _lookup(self, key: Hashable) -> Optional[T]:
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        slot.last_used = time.monotonic()
+        self._slots.move_to_end(key)
+        return slot.value
+
+    def _collect_evictions(self) -> list:
+        """Pop idle and over-capacity slots; caller holds the lock"""
+        evicted = []
+        cutoff = time.monotonic() - self.idle_ttl
+        for key in [k for k, slot in self._slots.items() if slot.last_used < cutoff]:
+            evicted.append(self._slots.pop(key).value)
+        while len(self._slots) > self.max_entries:
+            evicted.append(self._slots.popitem(last=False)[1].value)
+        self.evictions += len(evicted)
+        if evicted:
+            metrics.assistant_cache_evictions.inc(len(evicted))
+        return evicted
+
+    def _dispose(self, values: list):
+        """on_evict for evicted values nobody is using; the rest wait for their last release"""
+        if not self.on_evict:
+            return
+        with self._lock:
+            idle = []
+            for value in values:
+                if self._users.get(id(value)):
+                    self._retired[id(value)] = value
+                else:
+                    idle.append(value)
+        for value in idle:
+            self.on_evict(value)
+
+    def build_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def get_or_build(self, key: Hashable, build: Callable[[], T], rebuild: bool = False) -> T:
+        if not rebuild:
+            with self._lock:
+                evicted = self._collect_evictions()
+                value = self._lookup(key)
+                if value is not None:
+                    self.hits += 1
+            self._dispose(evicted)
+            if value is not None:
+                metrics.assistant_cache_requests.inc(result="hit")
+                return value
+
+        with self.build_lock(key):
+            if not rebuild:
+                # Another request may have finished building while we waited
+                with self._lock:
+                    value = self._lookup(key)
+                    if value is not None:
+                        self.hits += 1
+                if value is not None:
+                    metrics.assistant_cache_requests.inc(result="hit")
+                    return value
+
+            metrics.assistant_cache_requests.inc(result="miss")
+            start_time = time.perf_counter()
+            value = build()
+            duration = time.perf_counter() - start_time
+            metrics.assistant_build_duration.observe(duration)
+
+            with self._lock:
+                self.misses += 1
+                self.builds += 1
+                self.build_seconds += duration
+                previous = self._slots.pop(key, None)
+                self._slots[key] = _Slot(value)
+                evicted = self._collect_evictions()
+                metrics.assistant_cache_size.set(len(self._slots))
+            if previous is not None and previous.value is not value:
+                evicted.append(previous.value)
+            self._dispose(evicted)
+            return value
+
+    def get(self, key: Hashable) -> Optional[T]:
+        """Cached value without building; only hits are counted (a build counts the miss)"""
+        with self._lock:
+            evicted = self._collect_evictions()
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+        self._dispose(evicted)
+        if value is not None:
+            metrics.assistant_cache_requests.inc(result="hit")
+        return value
+
+    def acquire(self, key: Hashable, touch: bool = True) -> Optional[T]:
+        """Like get, but the value stays open until passed to release, even if evicted.
+        
+        With touch=False it is taken like peek: no hit, no LRU move, no eviction pass.
+        """
+        evicted = []
+        with self._lock:
+            if touch:
+                evicted = self._collect_evictions()
+                value = self._lookup(key)
+            else:
+                slot = self._slots.get(key)
+                value = slot.value if slot else None
+            if value is not None:
+                if touch:
+                    self.hits += 1
+                self._users[id(value)] = self._users.get(id(value), 0) + 1
+        self._dispose(evicted)
+        if value is not None and touch:
+            metrics.assistant_cache_requests.inc(result="hit")
+        return value
+
+    def release(self, value: T):
+        """End one use of an acquired value; closes it if it was evicted meanwhile"""
+        with self._lock:
+            users = self._users.get(id(value), 0) - 1
+            if users > 0:
+                self._users[id(value)] = users
+                return
+            self._users.pop(id(value), None)
+            retired = self._retired.pop(id(value), None)
+        if retired is not None and self.on_evict:
+            self.on_evict(retired)
+
+    def peek(self, key: Hashable) -> Optional[T]:
+        """Cached value without counting a hit or building"""
+        with self._lock:
+            slot = self._slots.get(key)
+            return slot.value if slot else None
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            slot = self._slots.pop(key, None)
+            metrics.assistant_cache_size.set(len(self._slots))
+        if slot is not None:
+            self._dispose([slot.value])
+
+    def clear(self):
+        with self._lock:
+            values = [slot.value for slot in self._slots.values()]
+            self._slots.clear()
+            metrics.assistant_cache_size.set(0)
+        self._dispose(values)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._slots
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            size = len(self._slots)
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "builds": self.builds,
+            "build_seconds": round(self.build_seconds, 3),
+        }
@@ -0,0 +1,330 @@
+"""Assistant lifecycle for request handlers: cached assistants per project,
+background knowledge base builds and syncs, and answering with the answer
+cache and concurrency limits in front.
+
+Kept apart from ai_assistant (StoryAssistant and the LangChain, Chroma and
+model client stack) so importing the API doesn't load any of that; it is
+imported on first use.
+
+With several worker processes each has its own cached assistants. Whoever
+syncs a knowledge base (under a per-project file lock) writes its kb_version
+next to the vector store; a worker whose cached assistant has a different
+version drops it and reopens the store before answering from it.
+"""
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from . import metrics
+from .answer_cache import answer_cache, normalize_question
+from .assistant_cache import AssistantCache
+from .concurrency import ConcurrencyLimiter, InflightCoalescer
+from .jobs import Job, JobRegistry
+from .query_stats import track_queries
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+if TYPE_CHECKING:
+    from .ai_assistant import StoryAssistant
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], None]  # (chunks embedded, total chunks)
+
+def project_vector_dir(project_id: int) -> Path:
+    """Where a project's vector store is persisted"""
+    return Path("./vector_db") / f"project_{project_id}"
+
+@contextmanager
+def _project_file_lock(project_id: int):
+    """Serialize knowledge base writes for a project across worker processes"""
+    if fcntl is None:
+        yield
+        return
+    project_dir = project_vector_dir(project_id)
+    project_dir.mkdir(parents=True, exist_ok=True)
+    with open(project_dir / ".lock", "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+def published_kb_version(project_id: int) -> Optional[str]:
+    """kb_version of the project's store as last synced by any worker"""
+    try:
+        return (project_vector_dir(project_id) / "kb_version").read_text().strip() or None
+    except OSError:
+        return None
+
+def _publish_kb_version(assistant: "StoryAssistant"):
+    path = project_vector_dir(assistant.project_id) / "kb_version"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"kb_version.{os.getpid()}")
+    temporary.write_text(assistant.kb_version or "")
+    os.replace(temporary, path)
+
+def _failed_since_published(project_id: int, job: Optional[Job]) -> bool:
+    """Whether the latest build failed after the store's version was last published"""
+    if job is None or job.state != "failed":
+        return False
+    try:
+        published_at = (project_vector_dir(project_id) / "kb_version").stat().st_mtime
+    except OSError:
+        return True
+    return (job.finished_at or 0) > published_at
+
+def _drop_if_stale(project_id: int, assistant: "StoryAssistant") -> bool:
+    """Evict a cached assistant whose store another worker has changed since.
+    
+    Requests still answering from it keep it open; it is closed when the last
+    of them releases it.
+    """
+    published = published_kb_version(project_id)
+    if published is None or published == assistant.kb_version:
+        return False
+    logger.info(f"🔄 Knowledge base for project {project_id} changed in another worker, reopening")
+    _assistant_cache.pop(project_id)
+    answer_cache.invalidate(project_id)
+    return True
+
+def check_backends():
+    """Raise ValueError if the configured embedding/LLM backends can't be used"""
+    from .ai_backends import check_backends as check
+    check()
+
+# Bounded cache of assistants (one per project)
+_assistant_cache: "AssistantCache[StoryAssistant]" = AssistantCache(
+    max_entries=int(os.getenv("ASSISTANT_CACHE_SIZE", "32")),
+    idle_ttl=float(os.getenv("ASSISTANT_CACHE_IDLE_SECONDS", "1800")),
+    on_evict=lambda assistant: assistant.close()
+)
+
+def get_assistant(project_id: int, db: Session, rebuild: bool = False,
+                  progress: Optional[ProgressCallback] = None) -> "StoryAssistant":
+    """Get or create assistant for a project (only one build per project runs at a time).
+    
+    Blocks while the knowledge base is opened and synced; request handlers
+    should use ready_assistant / start_knowledge_base_build instead.
+    """
+    check_backends()
+    
+    def build():
+        from .ai_assistant import StoryAssistant
+        
+        assistant = StoryAssistant(project_id=project_id)
+        with track_queries() as stats, _project_file_lock(project_id):
+            chunks = assistant.build_knowledge_base(db, project_id, force_rebuild=rebuild, progress=progress)
+            _publish_kb_version(assistant)
+        logger.debug(f"Knowledge base load for project {project_id}: {stats.count} queries")
+        if chunks > 0:
+            logger.info(f"✓ Built knowledge base for project {project_id}: {chunks} chunks")
+        else:
+            logger.info(f"✓ Loaded existing knowledge base for project {project_id}")
+        return assistant
+    
+    return _assistant_cache.get_or_build(project_id, build, rebuild=rebuild)
+
+# Knowledge base builds run here, off the request path
+_build_jobs = JobRegistry(max_workers=int(os.getenv("KB_BUILD_WORKERS", "2")), name="kb-build")
+
+def ready_assistant(project_id: int) -> Optional["StoryAssistant"]:
+    """The project's assistant if its knowledge base is loaded (and current), without building.
+    
+    The caller has it in use until it passes it to release_assistant; eviction
+    meanwhile takes it out of the cache but leaves it open.
+    """
+    assistant = _assistant_cache.acquire(project_id)
+    if assistant is not None and _drop_if_stale(project_id, assistant):
+        release_assistant(assistant)
+        return None
+    return assistant
+
+def release_assistant(assistant: "StoryAssistant"):
+    """Done answering with an assistant from ready_assistant"""
+    _assistant_cache.release(assistant)
+
+def start_knowledge_base_build(project_id: int, rebuild: bool = False) -> Job:
+    """Open (or rebuild) the project's knowledge base in the background.
+    
+    Returns the running job if one is already in progress for the project.
+    Raises ValueError if the API keys are missing.
+    """
+    check_backends()
+    
+    def run(job: Job):
+        db = SessionLocal()
+        try:
+            get_assistant(project_id, db, rebuild=rebuild, progress=job.report)
+        finally:
+            db.close()
+    
+    return _build_jobs.submit(project_id, run)
+
+def knowledge_base_status(project_id: int) -> Dict[str, any]:
+    """Readiness of the project's knowledge base plus progress of its latest build.
+    
+    Answers the same in every worker: builds are seen through the shared job
+    state, and a store another worker built and published counts as ready
+    (this worker opens it on the next ask).
+    """
+    job = _build_jobs.get(project_id)
+    assistant = _assistant_cache.peek(project_id)
+    published = published_kb_version(project_id)
+    
+    if job is not None and job.active:
+        status = {"status": "building", "project_id": project_id}
+    elif assistant is not None:
+        status = assistant.get_statistics()
+        status["kb_version"] = assistant.kb_version
+    elif published is not None and not _failed_since_published(project_id, job):
+        status = {"status": "ready", "project_id": project_id, "kb_version": published}
+    elif job is not None and job.state == "failed":
+        status = {"status": "failed", "project_id": project_id, "error": job.error}
+    else:
+        status = {"status": "not_built", "project_id": project_id}
+    
+    status.setdefault("project_id", project_id)
+    status["build"] = job.to_dict() if job is not None else None
+    return status
+
+# Limits for concurrent assistant calls (global and per project)
+_ask_limiter = ConcurrencyLimiter(
+    global_limit=int(os.getenv("ASSISTANT_MAX_CONCURRENCY", "8")),
+    per_key_limit=int(os.getenv("ASSISTANT_MAX_CONCURRENCY_PER_PROJECT", "2"))
+)
+_inflight_questions = InflightCoalescer()
+
+async def answer_question(assistant: "StoryAssistant", question: str, project_title: str) -> Dict[str, any]:
+    """Answer asynchronously: answer cache first, then under the concurrency limits,
+    sharing identical in-flight questions"""
+    project_id = assistant.project_id
+    kb_version = assistant.kb_version
+    
+    cached = answer_cache.get(project_id, kb_version, question)
+    embedding = None
+    if cached is None and answer_cache.similarity_enabled:
+        embedding = await assistant.embeddings.aembed_query(question)
+        cached = answer_cache.get(project_id, kb_version, question, embedding)
+    if cached is not None:
+        return {**cached, 'cached': True}
+    
+    async def run():
+        async with _ask_limiter.limit(project_id):
+            metrics.assistant_requests_in_flight.inc()
+            try:
+                result = await assistant.aask(question, project_title, embedding)
+            finally:
+                metrics.assistant_requests_in_flight.dec()
+        answer_cache.put(project_id, kb_version, question, result, embedding)
+        return result
+    
+    # Only calls answering from the same store version share a result
+    key = (project_id, kb_version, normalize_question(question))
+    result, coalesced = await _inflight_questions.run(key, run)
+    if coalesced:
+        metrics.assistant_coalesced_requests.inc()
+    return result
+
+async def stream_answer(assistant: "StoryAssistant", question: str,
+                        project_title: str) -> AsyncIterator[Dict[str, any]]:
+    """astream with the answer cache in front and under the same concurrency limits as
+    answer_question; a cached answer arrives as one token"""
+    project_id = assistant.project_id
+    kb_version = assistant.kb_version
+    
+    cached = answer_cache.get(project_id, kb_version, question)
+    embedding = None
+    if cached is None and answer_cache.similarity_enabled:
+        embedding = await assistant.embeddings.aembed_query(question)
+        cached = answer_cache.get(project_id, kb_version, question, embedding)
+    if cached is not None:
+        yield {'sources': cached['sources']}
+        yield {'token': cached['answer']}
+        return
+    
+    sources = []
+    tokens = []
+    async with _ask_limiter.limit(project_id):
+        metrics.assistant_requests_in_flight.inc()
+        try:
+            async for chunk in assistant.astream(question, project_title, embedding):
+                if 'sources' in chunk:
+                    sources = chunk['sources']
+                else:
+                    tokens.append(chunk['token'])
+                yield chunk
+        finally:
+            metrics.assistant_requests_in_flight.dec()
+    answer_cache.put(project_id, kb_version, question, {'answer': "".join(tokens), 'sources': sources}, embedding)
+
+def sync_project_knowledge_base(project_id: int):
+    """Bring an existing knowledge base up to date after edits (e.g. when NER finishes).
+    
+    Projects that never built a knowledge base are skipped; they build on first ask.
+    The cached assistant is held while syncing, so eviction meanwhile doesn't close it.
+    """
+    assistant = _assistant_cache.acquire(project_id, touch=False)
+    held = assistant
+    project_dir = project_vector_dir(project_id)
+    persisted = project_dir.exists() and any(project_dir.iterdir())
+    if assistant is None and not persisted:
+        return
+    
+    db = SessionLocal()
+    try:
+        with track_queries() as stats:
+            if assistant is not None:
+                # Serialize with builds of the same project, in this process and others
+                with _assistant_cache.build_lock(project_id), _project_file_lock(project_id):
+                    if _drop_if_stale(project_id, assistant):
+                        assistant = None
+                    else:
+                        assistant.sync_knowledge_base(db, project_id)
+                        _publish_kb_version(assistant)
+            if assistant is None:
+                get_assistant(project_id, db)  # Opening it runs the sync
+        logger.debug(f"Knowledge base sync for project {project_id}: {stats.count} queries")
+    except Exception as e:
+        logger.warning(f"⚠ Knowledge base sync failed for project {project_id}: {e}")
+    finally:
+        db.close()
+        if held is not None:
+            release_assistant(held)
+
+def schedule_knowledge_base_sync(background_tasks: BackgroundTasks, project_id: int):
+    """Queue an incremental knowledge base sync to run after the response"""
+    background_tasks.add_task(sync_project_knowledge_base, project_id)
+
+def clear_cache(project_id: int = None):
+    """Clear assistant cache (useful for memory management)"""
+    if project_id:
+        _assistant_cache.pop(project_id)
+        _build_jobs.forget(project_id)
+    else:
+        _assistant_cache.clear()
+    answer_cache.invalidate(project_id)
+
+# How long a project delete waits for its cancelled knowledge base build to stop
+BUILD_CANCEL_TIMEOUT = 30.0
+
+def drop_knowledge_base(project_id: int):
+    """Forget a deleted project's assistant and cached answers and remove its vector store files.
+    
+    A build still running for the project (in any worker) is cancelled first:
+    it would otherwise recreate the files after they are removed.
+    """
+    if not _build_jobs.cancel(project_id, timeout=BUILD_CANCEL_TIMEOUT):
+        logger.warning(f"⚠ Knowledge base build for deleted project {project_id} did not stop in time")
+    clear_cache(project_id)
+    shutil.rmtree(project_vector_dir(project_id), ignore_errors=True)
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""Per-chapter analysis shared by NER and the knowledge base.
+
+NER already runs spaCy over each chapter, so it stores what it learned:
+sentence and paragraph boundaries and the resolved entity spans, keyed by
+a hash of the content they describe. The knowledge-base builder reads
+them back to cut chunks on sentence boundaries and tag each chunk with the
+entities it contains, without a second NLP pass. Chapters without a
+current analysis (never processed, or edited since) fall back to the
+character splitter.
+"""
+import bisect
+import hashlib
+import json
+import re
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from . import text_diff
+
+if TYPE_CHECKING:  # NER saves analyses without needing LangChain loaded
+    from langchain_core.documents import Document
+    from langchain_text_splitters import TextSplitter
+
+_MARKUP = re.compile(r"(?:<[^>]*>|\s)+")  # Tags and whitespace around a paragraph's text
+
+Span = Tuple[int, int]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def paragraph_spans(text: str) -> List[Span]:
+    """(start, end) of each paragraph's text, without the tags and whitespace around it.
+
+    Content may be plain text or the editor's HTML; paragraphs end where
+    text_diff's do (newlines, block-level closing tags and <br>).
+    """
+    spans = []
+    for start, end in text_diff.paragraphs(text, 0, len(text)):
+        match = _MARKUP.match(text, start, end)
+        if match:
+            start = match.end()
+        for match in _MARKUP.finditer(text, start, end):
+            if match.end() == end:
+                end = match.start()
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+
+def sentence_spans(doc) -> List[Span]:
+    """Sentence offsets from a parsed spaCy Doc; empty if the pipeline doesn't set them"""
+    if not doc.has_annotation("SENT_START"):
+        return []
+    return [(sent.start_char, sent.end_char) for sent in doc.sents if sent.text.strip()]
+
+
+def save_analysis(db: Session, chapter_id: int, content: str, doc,
+                  entity_spans: Iterable[Tuple[int, int, int]]) -> models.ChapterAnalysis:
+    """Store (or replace) the analysis of `content`; the caller commits"""
+    sentences = [list(span) for span in sentence_spans(doc)]
+    paragraphs = [list(span) for span in paragraph_spans(content)]
+    entities = sorted(list(span) for span in set(map(tuple, entity_spans)))
+    fingerprint = hashlib.sha256(
+        json.dumps([sentences, paragraphs, entities], separators=(",", ":")).encode("utf-8")
+    ).hexdigest()[:16]
+
+    analysis = db.query(models.ChapterAnalysis).filter(
+        models.ChapterAnalysis.chapter_id == chapter_id
+    ).first()
+    if analysis is None:
+        analysis = models.ChapterAnalysis(chapter_id=chapter_id)
+        db.add(analysis)
+    analysis.content_hash = content_hash(content)
+    analysis.sentences = sentences
+    analysis.paragraphs = paragraphs
+    analysis.entity_spans = entities
+    analysis.fingerprint = fingerprint
+    return analysis
+
+
+def current_analyses(db: Session, chapters: List[models.Chapter]) -> Dict[int, models.ChapterAnalysis]:
+    """Analyses that still match their chapter's content, by chapter id (one query)"""
+    if not chapters:
+        return {}
+    hashes = {chapter.id: content_hash(chapter.content or "") for chapter in chapters}
+    analyses = db.query(models.ChapterAnalysis).filter(
+        models.ChapterAnalysis.chapter_id.in_(list(hashes))
+    ).all()
+    return {
+        analysis.chapter_id: analysis for analysis in analyses
+        if analysis.sentences and analysis.content_hash == hashes[analysis.chapter_id]
+    }
+
+
+def _units(text: str, sentences: List[Span], chunk_size: int, splitter: "TextSplitter") -> List[Span]:
+    """Sentences, with any longer than a chunk split further by the fallback splitter"""
+    units = []
+    for start, end in sentences:
+        if end - start <= chunk_size:
+            units.append((start, end))
+            continue
+        offset = start
+        for piece in splitter.split_text(text[start:end]):
+            position = text.find(piece, offset, end)
+            if position == -1:
+                continue
+            units.append((position, position + len(piece)))
+            offset = position + 1
+    return units
+
+
+def _starts_paragraph(paragraph_starts: List[int], previous_end: int, end: int) -> bool:
+    """Whether a paragraph's text begins after the previous unit and before this one ends.
+
+    In HTML a sentence may start on the tags before the paragraph's text,
+    so its offset need not equal the paragraph's.
+    """
+    index = bisect.bisect_left(paragraph_starts, previous_end)
+    return index < len(paragraph_starts) and paragraph_starts[index] < end
+
+
+def sentence_chunks(doc: "Document", analysis: models.ChapterAnalysis, chunk_size: int, chunk_overlap: int,
+                    splitter: "TextSplitter", entity_ids: Optional[set] = None) -> List["Document"]:
+    """Split a chapter document into whole sentences of at most `chunk_size` characters.
+
+    Chunks prefer to end at a paragraph break once they are half full, and
+    repeat up to `chunk_overlap` characters of trailing sentences from the
+    previous chunk. Metadata gains start_index and the ids of entities with
+    a span in the chunk (restricted to `entity_ids` when given).
+    """
+    from langchain_core.documents import Document
+
+    text = doc.page_content
+    units = _units(text, [tuple(span) for span in analysis.sentences], chunk_size, splitter)
+    paragraph_starts = sorted(start for start, _ in analysis.paragraphs or [])
+    spans = analysis.entity_spans or []
+
+    chunks = []
+    first = 0
+    while first < len(units):
+        last = first
+        while last + 1 < len(units):
+            next_start, next_end = units[last + 1]
+            if next_end - units[first][0] > chunk_size:
+                break
+            if (_starts_paragraph(paragraph_starts, units[last][1], next_end)
+                    and units[last][1] - units[first][0] >= chunk_size // 2):
+                break
+            last += 1
+
+        start, end = units[first][0], units[last][1]
+        metadata = {**doc.metadata, "start_index": start}
+        ids = sorted({
+            entity_id for span_start, span_end, entity_id in spans
+            if span_start < end and span_end > start and (entity_ids is None or entity_id in entity_ids)
+        })
+        if ids:
+            metadata["entity_ids"] = ids
+        chunks.append(Document(page_content=text[start:end], metadata=metadata))
+
+        if last + 1 >= len(units):
+            break
+        # Step back over trailing sentences that fit in the overlap, always moving forward
+        following = last + 1
+        while following - 1 > first and end - units[following - 1][0] <= chunk_overlap:
+            following -= 1
+        first = following
+    return chunks
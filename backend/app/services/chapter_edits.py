@@ -0,0 +1,37 @@
+"""Range edits (offset, delete, insert) applied to chapter text.
+
+Autosaves send only what changed instead of the whole chapter, and the
+word count is adjusted by re-counting just the words each edit touches.
+Counting matches `len(content.split())`, which the full-content paths use.
+"""
+from typing import Iterable, Tuple
+
+from .. import schemas
+
+
+def _word_bounds(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Widen [start, end) to whole words, so words cut by the edit are counted whole"""
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    return start, end
+
+
+def apply_edits(text: str, edits: Iterable[schemas.ChapterEdit]) -> Tuple[str, int]:
+    """Apply edits in order; returns (new text, change in word count).
+
+    Each edit's offset refers to the text as left by the previous edit.
+    Raises ValueError if an edit reaches past the end of the text.
+    """
+    word_delta = 0
+    for edit in edits:
+        end = edit.offset + edit.delete
+        if end > len(text):
+            raise ValueError(f"Edit at {edit.offset} deleting {edit.delete} is past the end of the text ({len(text)})")
+        start, stop = _word_bounds(text, edit.offset, end)
+        old_words = len(text[start:stop].split())
+        text = text[:edit.offset] + edit.insert + text[end:]
+        new_words = len(text[start:stop - edit.delete + len(edit.insert)].split())
+        word_delta += new_words - old_words
+    return text, word_delta
@@ -0,0 +1,56 @@
+"""Async concurrency limits and in-flight request coalescing"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class ConcurrencyLimiter:
+    """A global semaphore plus one semaphore per key (e.g. per project)"""
+
+    def __init__(self, global_limit: int, per_key_limit: int):
+        self.global_limit = global_limit
+        self.per_key_limit = per_key_limit
+        self._loop = None
+        self._global = None
+        self._per_key: Dict[Hashable, asyncio.Semaphore] = {}
+
+    def _semaphores(self, key: Hashable):
+        # Semaphores belong to one event loop; start fresh if the loop changed
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._global = asyncio.Semaphore(self.global_limit)
+            self._per_key = {}
+        per_key = self._per_key.get(key)
+        if per_key is None:
+            per_key = self._per_key[key] = asyncio.Semaphore(self.per_key_limit)
+        return per_key, self._global
+
+    @asynccontextmanager
+    async def limit(self, key: Hashable):
+        per_key, global_ = self._semaphores(key)
+        # Take the narrower per-key slot first so one busy project can't hold global slots while queued
+        async with per_key:
+            async with global_:
+                yield
+
+
+class InflightCoalescer:
+    """Identical concurrent calls share one underlying awaitable"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        """Await factory() unless a call with the same key is already running"""
+        future = self._inflight.get(key)
+        coalesced = future is not None
+        if not coalesced:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one caller disconnecting doesn't cancel the call for the others
+        return await asyncio.shield(future), coalesced
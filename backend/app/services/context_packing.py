@@ -0,0 +1,116 @@
+"""Assemble retrieved documents into a compact prompt context.
+
+Chunks overlap (chunk_overlap in the splitter) and MMR often returns
+neighbours from the same chapter, so the raw top-k repeats a lot of text.
+Here chunks from the same chapter are merged by their start offsets, the
+result is ordered by chapter and cut to a token budget.
+"""
+import math
+import os
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CHARS_PER_TOKEN = 4  # Rough for English prose; good enough for budgeting
+MIN_FRAGMENT_TOKENS = 60  # Don't bother with a truncated passage shorter than this
+MERGE_GAP = 50  # Chunks this close (in characters) are joined into one passage
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class _Span:
+    __slots__ = ("doc", "start", "end", "text", "rank", "parts")
+
+    def __init__(self, doc: Document, rank: int):
+        self.doc = doc
+        self.start = doc.metadata["start_index"]
+        self.text = doc.page_content
+        self.end = self.start + len(self.text)
+        self.rank = rank
+        self.parts = 1
+
+    def absorb(self, other: "_Span", gap_text: str = ""):
+        if other.end > self.end:
+            overlap = self.end - other.start
+            self.text += gap_text + (other.text[overlap:] if overlap > 0 else other.text)
+            self.end = other.end
+        self.rank = min(self.rank, other.rank)
+        self.parts += other.parts
+
+
+def _merge_spans(spans: List[_Span]) -> List[_Span]:
+    """Merge overlapping or near-adjacent spans of one chapter"""
+    spans.sort(key=lambda s: s.start)
+    merged = [spans[0]]
+    for span in spans[1:]:
+        current = merged[-1]
+        if span.start <= current.end:
+            current.absorb(span)
+        elif span.start - current.end <= MERGE_GAP:
+            current.absorb(span, gap_text=" … ")
+        else:
+            merged.append(span)
+    return merged
+
+
+def _truncate(text: str, tokens: int) -> str:
+    cut = text[:tokens * CHARS_PER_TOKEN]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut) + " …"
+
+
+def pack_context(docs: List[Document], budget: Optional[int] = None,
+                 count_tokens: Callable[[str], int] = estimate_tokens) -> List[Document]:
+    """Deduplicated documents that fit in `budget` tokens.
+
+    Passages keep the retrieval rank of their best chunk for selection, but
+    are returned entities first, then in reading order.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+
+    spans: Dict[int, List[_Span]] = {}
+    others = []
+    seen_text = set()
+    for rank, doc in enumerate(docs):
+        metadata = doc.metadata
+        if metadata.get("type") == "chapter" and metadata.get("start_index") is not None and metadata.get("chapter_id"):
+            spans.setdefault(metadata["chapter_id"], []).append(_Span(doc, rank))
+        elif doc.page_content not in seen_text:
+            # Legacy chunks without offsets and non-chapter documents: exact duplicates only
+            seen_text.add(doc.page_content)
+            others.append((rank, doc))
+
+    candidates = list(others)
+    for chapter_spans in spans.values():
+        for span in _merge_spans(chapter_spans):
+            metadata = {**span.doc.metadata, "start_index": span.start}
+            if span.parts > 1:
+                metadata["merged_chunks"] = span.parts
+            candidates.append((span.rank, Document(page_content=span.text, metadata=metadata)))
+
+    # Spend the budget in retrieval order
+    selected = []
+    remaining = budget
+    for rank, doc in sorted(candidates, key=lambda c: c[0]):
+        tokens = count_tokens(doc.page_content)
+        if tokens > remaining:
+            if remaining < MIN_FRAGMENT_TOKENS:
+                continue
+            doc = Document(page_content=_truncate(doc.page_content, remaining), metadata=doc.metadata)
+            tokens = count_tokens(doc.page_content)
+        selected.append(doc)
+        remaining -= tokens
+
+    def reading_order(doc: Document):
+        metadata = doc.metadata
+        return (
+            metadata.get("type") != "entity",
+            metadata.get("chapter_number") or 0,
+            metadata.get("type") == "notes",
+            metadata.get("start_index") or 0,
+        )
+
+    return sorted(selected, key=reading_order)
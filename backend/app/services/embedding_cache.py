@@ -0,0 +1,190 @@
+"""Persistent embedding cache keyed by (embedding model, chunk text hash).
+
+Vectors live in one float32 memory-mapped file per model, with a SQLite
+index mapping text hashes to rows. The cache is shared by every project,
+so rebuilds and duplicated projects only pay for text that actually changed.
+"""
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_DIR = Path("./vector_db") / "embedding_cache"
+
+
+class EmbeddingCache:
+    """Append-only float32 matrix per model plus a (model, hash) -> row index"""
+
+    GROWTH_ROWS = 1024
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode; writers take BEGIN IMMEDIATE so worker processes append safely
+        self._db = sqlite3.connect(
+            str(self.cache_dir / "index.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS models (
+                model TEXT PRIMARY KEY, dim INTEGER NOT NULL, rows INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS vectors (
+                model TEXT NOT NULL, text_hash BLOB NOT NULL, row INTEGER NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID;
+        """)
+        self._matrices: Dict[str, np.memmap] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _matrix_path(self, model: str) -> Path:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in model)
+        return self.cache_dir / f"{safe}.f32"
+
+    def _matrix(self, model: str, dim: int, min_rows: int = 0) -> np.memmap:
+        """Open (and grow if needed) the model's memory-mapped matrix"""
+        matrix = self._matrices.get(model)
+        if matrix is not None and matrix.shape[0] >= min_rows:
+            return matrix
+        path = self._matrix_path(model)
+        capacity = path.stat().st_size // (4 * dim) if path.exists() else 0
+        if capacity < min_rows:
+            capacity = max(min_rows, capacity * 2, self.GROWTH_ROWS)
+            if matrix is not None:
+                matrix.flush()
+            with open(path, "ab") as f:
+                f.truncate(capacity * dim * 4)
+        matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        self._matrices[model] = matrix
+        return matrix
+
+    def get_many(self, model: str, texts: List[str]) -> List:
+        """Cached vectors for texts (None where missing)"""
+        hashes = [self.text_hash(t) for t in texts]
+        with self._lock:
+            info = self._db.execute("SELECT dim FROM models WHERE model = ?", (model,)).fetchone()
+            if info is None:
+                self.misses += len(texts)
+                return [None] * len(texts)
+            rows = {}
+            unique = list(set(hashes))
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(self._db.execute(
+                    f"SELECT text_hash, row FROM vectors WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch)
+                ).fetchall())
+            if not rows:
+                self.misses += len(texts)
+                return [None] * len(texts)
+            # Another process may have grown the file since we mapped it
+            matrix = self._matrix(model, info[0], max(rows.values()) + 1)
+            results = []
+            for h in hashes:
+                row = rows.get(h)
+                results.append(None if row is None else matrix[row].tolist())
+            found = sum(r is not None for r in results)
+            self.hits += found
+            self.misses += len(texts) - found
+            return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        if not texts:
+            return
+        dim = len(vectors[0])
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._append(model, dim, texts, vectors)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _append(self, model: str, dim: int, texts: List[str], vectors: List[List[float]]):
+        """Write new vectors; caller holds the write transaction"""
+        info = self._db.execute("SELECT dim, rows FROM models WHERE model = ?", (model,)).fetchone()
+        if info is None:
+            self._db.execute("INSERT INTO models (model, dim, rows) VALUES (?, ?, 0)", (model, dim))
+            info = (dim, 0)
+        if info[0] != dim:
+            raise ValueError(f"Embedding size changed for {model}: {info[0]} -> {dim}")
+
+        # Skip texts that are already stored (or repeated within this batch)
+        pending = {}
+        for text, vector in zip(texts, vectors):
+            pending.setdefault(self.text_hash(text), vector)
+        hashes = list(pending)
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            for (h,) in self._db.execute(
+                f"SELECT text_hash FROM vectors WHERE model = ? AND text_hash IN ({placeholders})",
+                (model, *batch)
+            ).fetchall():
+                pending.pop(h, None)
+        if not pending:
+            return
+
+        start = info[1]
+        matrix = self._matrix(model, dim, start + len(pending))
+        matrix[start:start + len(pending)] = np.asarray(list(pending.values()), dtype=np.float32)
+        matrix.flush()
+        self._db.executemany(
+            "INSERT INTO vectors (model, text_hash, row) VALUES (?, ?, ?)",
+            [(model, h, start + i) for i, h in enumerate(pending)]
+        )
+        self._db.execute("UPDATE models SET rows = ? WHERE model = ?", (start + len(pending), model))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT COALESCE(SUM(rows), 0) FROM models").fetchone()[0]
+        return {"vectors": rows, "hits": self.hits, "misses": self.misses}
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # Embed each distinct missing text once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            self.cache.put_many(self.model_name, unique_texts, [fresh[t] for t in unique_texts])
+            for i in missing:
+                vectors[i] = fresh[texts[i]]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries use a different input type on some providers; don't mix them with documents
+        return self.embeddings.embed_query(text)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache instance"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
@@ -2,6 +2,7 @@ import re
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from .. import models
+from .annotations import touch_chapters
 
 class EntityResolver:
     """Resolve and merge similar entities"""
@@ -27,18 +28,23 @@ class EntityResolver:
     @staticmethod
     def find_similar_entities(db: Session, project_id: int, name: str, entity_type: str, threshold: float = 0.8):
         """Find entities that might be the same person/place"""
-        from difflib import SequenceMatcher
-        
-        normalized = EntityResolver.normalize_name(name)
-        
         # Get all entities of same type in project
         existing = db.query(models.Entity).filter(
             models.Entity.project_id == project_id,
             models.Entity.entity_type == entity_type
         ).all()
         
+        return EntityResolver.rank_similar(name, existing, threshold)
+    
+    @staticmethod
+    def rank_similar(name: str, candidates: list, threshold: float = 0.8):
+        """Score already-loaded entities against a name, best match first"""
+        from difflib import SequenceMatcher
+        
+        normalized = EntityResolver.normalize_name(name)
+        
         similar = []
-        for entity in existing:
+        for entity in candidates:
             entity_normalized = EntityResolver.normalize_name(entity.name)
             
             # Check normalized name match
@@ -60,25 +66,35 @@ class EntityResolver:
     
     @staticmethod
     def merge_entities(db: Session, keep_entity_id: int, merge_entity_ids: list):
-        """Merge multiple entities into one"""
+        """Merge multiple entities into one; returns the kept entity's project id"""
+        merge_entity_ids = [i for i in merge_entity_ids if i != keep_entity_id]
+        if not merge_entity_ids:
+            return None
+        
+        # Chapters showing the merged entities get new annotations
+        touch_chapters(db, merge_entity_ids)
+        
         # Update all mentions to point to the kept entity
-        for entity_id in merge_entity_ids:
-            db.query(models.EntityMention).filter(
-                models.EntityMention.entity_id == entity_id
-            ).update({'entity_id': keep_entity_id})
-            
-            # Get the entity to merge
-            merge_entity = db.query(models.Entity).filter(models.Entity.id == entity_id).first()
-            if merge_entity:
+        db.query(models.EntityMention).filter(
+            models.EntityMention.entity_id.in_(merge_entity_ids)
+        ).update({'entity_id': keep_entity_id}, synchronize_session=False)
+        
+        keep_entity = db.query(models.Entity).filter(models.Entity.id == keep_entity_id).first()
+        merge_entities = db.query(models.Entity).filter(
+            models.Entity.id.in_(merge_entity_ids)
+        ).all()
+        
+        for merge_entity in merge_entities:
+            if keep_entity:
                 # Add aliases from merged entity
-                keep_entity = db.query(models.Entity).filter(models.Entity.id == keep_entity_id).first()
-                if keep_entity:
-                    existing_aliases = set(keep_entity.aliases or [])
-                    existing_aliases.add(merge_entity.name)
-                    existing_aliases.update(merge_entity.aliases or [])
-                    keep_entity.aliases = list(existing_aliases)
-                
-                # Delete the merged entity
-                db.delete(merge_entity)
+                existing_aliases = set(keep_entity.aliases or [])
+                existing_aliases.add(merge_entity.name)
+                existing_aliases.update(merge_entity.aliases or [])
+                keep_entity.aliases = list(existing_aliases)
+            
+            # Delete the merged entity
+            db.delete(merge_entity)
         
-        db.commit()
\ No newline at end of file
+        project_id = keep_entity.project_id if keep_entity else None
+        db.commit()
+        return project_id
@@ -0,0 +1,233 @@
+"""Entity-first retrieval: answer questions about named entities from their mentions.
+
+Known entity names and aliases are matched in the question with a token
+dictionary, then passages are cut from the chapters around the stored
+mention offsets. Vector search only fills whatever slots are left.
+"""
+import re
+import threading
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+
+_TOKEN = re.compile(r"\w+")
+
+# Single-word aliases that are too common to mean the entity
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "does", "for", "from",
+    "had", "has", "have", "he", "her", "him", "his", "how", "i", "in", "is", "it", "its",
+    "me", "my", "no", "not", "of", "on", "or", "our", "she", "so", "that", "the", "their",
+    "them", "they", "this", "to", "us", "was", "we", "what", "when", "where", "which",
+    "who", "why", "will", "with", "you", "your",
+}
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class EntityIndex:
+    """Longest-match dictionary of entity names and aliases over word tokens"""
+
+    def __init__(self, names: Dict[str, int]):
+        # first token -> [(token tuple, entity id)], longest phrases first
+        self._phrases: Dict[str, List[Tuple[Tuple[str, ...], int]]] = {}
+        for name, entity_id in names.items():
+            tokens = tuple(_tokens(name))
+            if not tokens or (len(tokens) == 1 and (len(tokens[0]) < 2 or tokens[0] in _STOPWORDS)):
+                continue
+            self._phrases.setdefault(tokens[0], []).append((tokens, entity_id))
+        for phrases in self._phrases.values():
+            phrases.sort(key=lambda p: -len(p[0]))
+
+    def __len__(self):
+        return sum(len(p) for p in self._phrases.values())
+
+    def match(self, text: str) -> List[int]:
+        """Entity ids named in text, in order of first appearance"""
+        tokens = _tokens(text)
+        found = []
+        i = 0
+        while i < len(tokens):
+            step = 1
+            for phrase, entity_id in self._phrases.get(tokens[i], ()):
+                if tuple(tokens[i:i + len(phrase)]) == phrase:
+                    if entity_id not in found:
+                        found.append(entity_id)
+                    step = len(phrase)
+                    break
+            i += step
+        return found
+
+
+class EntityRetriever:
+    """Passages around known entity mentions, plus the entities' own profiles"""
+
+    MAX_MENTIONS = 2000  # mentions considered per question, spread across chapters
+
+    def __init__(self, session_factory=SessionLocal, max_passages: int = 4, radius: int = 400):
+        self.session_factory = session_factory
+        self.max_passages = max_passages
+        self.radius = radius
+        self.project_id: Optional[int] = None
+        self._index = EntityIndex({})
+        self._profiles: Dict[int, Document] = {}
+        self._lock = threading.Lock()
+
+    def load(self, db: Session, project_id: int, profiles: Dict[int, Document]):
+        """Rebuild the name index; profiles are the entity documents keyed by entity id"""
+        entities = db.query(
+            models.Entity.id, models.Entity.name, models.Entity.aliases
+        ).filter(models.Entity.project_id == project_id).all()
+
+        names = {}
+        for entity_id, name, aliases in entities:
+            # The canonical name wins if an alias collides with another entity's name
+            for alias in aliases or []:
+                names.setdefault(alias, entity_id)
+        for entity_id, name, _ in entities:
+            names[name] = entity_id
+
+        index = EntityIndex(names)
+        with self._lock:
+            self.project_id = project_id
+            self._index = index
+            self._profiles = dict(profiles)
+
+    def match(self, question: str) -> List[int]:
+        return self._index.match(question)
+
+    def retrieve(self, question: str, limit: int) -> List[Document]:
+        """Up to `limit` documents: profiles of named entities, then mention passages"""
+        entity_ids = self.match(question)
+        if not entity_ids:
+            return []
+
+        docs = [self._profiles[i] for i in entity_ids if i in self._profiles][:limit]
+        slots = min(self.max_passages, limit - len(docs))
+        if slots > 0:
+            db = self.session_factory()
+            try:
+                docs.extend(self._passages(db, entity_ids, slots))
+            finally:
+                db.close()
+        return docs
+
+    def _passages(self, db: Session, entity_ids: List[int], limit: int) -> List[Document]:
+        # Number each chapter's mentions and take the first of every chapter before the
+        # second of any, so a main character's early chapters can't use up the limit
+        in_chapter = func.row_number().over(
+            partition_by=models.EntityMention.chapter_id,
+            order_by=models.EntityMention.start_pos
+        ).label("in_chapter")
+        numbered = db.query(
+            models.EntityMention.entity_id,
+            models.EntityMention.chapter_id,
+            models.EntityMention.start_pos,
+            models.EntityMention.end_pos,
+            models.Chapter.chapter_number,
+            in_chapter
+        ).join(models.Chapter, models.EntityMention.chapter_id == models.Chapter.id).filter(
+            models.EntityMention.entity_id.in_(entity_ids),
+            models.Chapter.project_id == self.project_id
+        ).subquery()
+        rows = db.query(
+            numbered.c.entity_id, numbered.c.chapter_id, numbered.c.start_pos, numbered.c.end_pos,
+            numbered.c.chapter_number
+        ).order_by(numbered.c.in_chapter, numbered.c.chapter_number).limit(self.MAX_MENTIONS).all()
+        mentions = [
+            (entity_id, chapter_id, start, end) for entity_id, chapter_id, start, end, _ in
+            sorted(rows, key=lambda row: (row.chapter_number, row.chapter_id, row.start_pos))
+        ]
+
+        # Merge nearby mentions into windows; windows naming more of the asked-about entities rank first
+        windows = []
+        for entity_id, chapter_id, start, end in mentions:
+            last = windows[-1] if windows else None
+            if (last and last["chapter_id"] == chapter_id
+                    and start - self.radius <= last["end"]
+                    and end + self.radius - last["start"] <= 3 * self.radius):
+                last["end"] = max(last["end"], end + self.radius)
+                last["entities"].add(entity_id)
+                last["mentions"] += 1
+            else:
+                windows.append({
+                    "chapter_id": chapter_id,
+                    "start": max(start - self.radius, 0),
+                    "end": end + self.radius,
+                    "entities": {entity_id},
+                    "mentions": 1,
+                })
+        if not windows:
+            return []
+
+        ranked = self._rank(windows, limit)
+        chapters = {
+            row.id: row for row in db.query(
+                models.Chapter.id, models.Chapter.chapter_number,
+                models.Chapter.title, models.Chapter.content
+            ).filter(models.Chapter.id.in_({w["chapter_id"] for w in ranked})).all()
+        }
+
+        passages = []
+        for window in ranked:
+            chapter = chapters.get(window["chapter_id"])
+            if chapter is None or not chapter.content:
+                continue
+            start, end = self._snap(chapter.content, window["start"], window["end"])
+            passages.append((chapter.chapter_number, start, Document(
+                page_content=chapter.content[start:end],
+                metadata={
+                    'type': 'chapter',
+                    'chapter_number': chapter.chapter_number,
+                    'chapter_title': chapter.title or f"Chapter {chapter.chapter_number}",
+                    'chapter_id': chapter.id,
+                    'source': f"Chapter {chapter.chapter_number}",
+                    'start_index': start,
+                    'retrieval': 'entity',
+                }
+            )))
+        # Reading order reads better in the prompt than rank order
+        passages.sort(key=lambda p: (p[0], p[1]))
+        return [doc for _, _, doc in passages]
+
+    @staticmethod
+    def _rank(windows: List[Dict], limit: int) -> List[Dict]:
+        """The `limit` best windows: naming more of the entities, then more mentions.
+
+        Ties take each chapter's first windows before its later ones and are
+        spread evenly over the story rather than taken from its beginning.
+        """
+        nth = {}
+        for window in windows:  # In reading order
+            window["nth"] = nth[window["chapter_id"]] = nth.get(window["chapter_id"], -1) + 1
+        score = lambda w: (-len(w["entities"]), -w["mentions"], w["nth"])
+        chosen = []
+        for _, tied in groupby(sorted(windows, key=score), key=score):  # Stable: ties stay in reading order
+            tied, slots = list(tied), limit - len(chosen)
+            if len(tied) > slots:
+                tied = [tied[i * len(tied) // slots] for i in range(slots)]
+            chosen.extend(tied)
+            if len(chosen) == limit:
+                break
+        return chosen
+
+    @staticmethod
+    def _snap(text: str, start: int, end: int) -> Tuple[int, int]:
+        """Trim a window so it starts and ends on word boundaries"""
+        end = min(end, len(text))
+        if start > 0:
+            space = text.find(" ", start)
+            if space != -1 and space < end:
+                start = space + 1
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            if space > start:
+                end = space
+        return start, end
@@ -0,0 +1,255 @@
+"""Background jobs with progress reporting, one active job per key.
+
+With several worker processes a job runs in the worker that accepted it,
+but its state is also written to a small JSON file under JOB_STATE_DIR, so
+a poll that lands on any worker sees it. A job can be asked to stop from
+any worker too; it stops at its next progress report. Finished jobs are
+forgotten after JOB_RETENTION_SECONDS.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Optional
+
+# Shared by the workers, next to the vector stores they also share
+JOB_STATE_DIR = Path(os.getenv("JOB_STATE_DIR", "./vector_db/.jobs"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+_HOST = socket.gethostname()
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised from Job.report in a job asked to stop"""
+
+
+class Job:
+    """State of one background job; `report` is safe to call from the worker"""
+
+    def __init__(self, key: Hashable, on_change: Optional[Callable[["Job"], None]] = None,
+                 should_stop: Optional[Callable[["Job"], bool]] = None):
+        self.key = key
+        self.state = "queued"  # queued -> running -> done | failed | cancelled
+        self.done = 0
+        self.total = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.host = _HOST
+        self.pid = os.getpid()
+        self.on_change = on_change
+        self.should_stop = should_stop
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("queued", "running")
+
+    def report(self, done: int, total: int):
+        """Record progress; raises JobCancelled if the job was asked to stop"""
+        self.done = done
+        self.total = total
+        if self.on_change:
+            self.on_change(self)
+        if self.should_stop and self.should_stop(self):
+            raise JobCancelled(f"Job {self.key} was cancelled")
+
+    def to_dict(self) -> Dict:
+        elapsed = None
+        if self.started_at:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            "state": self.state,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "elapsed_seconds": elapsed,
+        }
+
+    def to_record(self) -> Dict:
+        return {
+            "state": self.state, "done": self.done, "total": self.total, "error": self.error,
+            "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "host": self.host, "pid": self.pid,
+        }
+
+    @classmethod
+    def from_record(cls, key: Hashable, record: Dict) -> "Job":
+        """A job another worker runs (or ran), as last written to its state file"""
+        job = cls(key)
+        for name, value in record.items():
+            setattr(job, name, value)
+        if job.active and job.host == _HOST and not _alive(job.pid):
+            job.state = "failed"
+            job.error = "Worker exited while the job was running"
+        return job
+
+
+def _expired(job: Job) -> bool:
+    return not job.active and time.time() - (job.finished_at or job.created_at) > JOB_RETENTION_SECONDS
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists, owned by someone else
+    return True
+
+
+class JobRegistry:
+    """Runs jobs on a small thread pool and keeps the latest job per key.
+
+    Submitting a key that already has a queued or running job (here or,
+    with `shared`, in another worker) returns that job instead of starting
+    another one.
+    """
+
+    def __init__(self, max_workers: int, name: str = "jobs", shared: bool = True):
+        self.max_workers = max_workers
+        self.name = name
+        self.state_dir = JOB_STATE_DIR / name if shared else None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[Hashable, Job] = {}
+        self._cancelled = set()  # Keys asked to stop here; other workers see the .cancel file
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _state_path(self, key: Hashable) -> Path:
+        return self.state_dir / f"{key}.json"
+
+    def _cancel_path(self, key: Hashable) -> Path:
+        return self.state_dir / f"{key}.cancel"
+
+    def _save(self, job: Job):
+        if self.state_dir is None:
+            return
+        try:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            path = self._state_path(job.key)
+            temporary = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}")
+            temporary.write_text(json.dumps(job.to_record()))
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"⚠ Couldn't record job {self.name}:{job.key}: {e}")
+
+    def _load(self, key: Hashable) -> Optional[Job]:
+        if self.state_dir is None:
+            return None
+        try:
+            job = Job.from_record(key, json.loads(self._state_path(key).read_text()))
+        except (OSError, ValueError):
+            return None
+        return None if _expired(job) else job
+
+    def _prune(self):
+        """Forget jobs that finished more than JOB_RETENTION_SECONDS ago; caller holds the lock"""
+        for key in [key for key, job in self._jobs.items() if _expired(job)]:
+            del self._jobs[key]
+        if self.state_dir is None or not self.state_dir.exists():
+            return
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for path in self.state_dir.iterdir():
+            try:
+                if path.suffix == ".json":
+                    job = Job.from_record(path.stem, json.loads(path.read_text()))
+                    if not _expired(job):
+                        continue
+                elif path.stat().st_mtime >= cutoff:
+                    continue  # A cancel request or a temporary file still being written
+                path.unlink()
+            except (OSError, ValueError):
+                pass
+
+    def _stop_requested(self, job: Job) -> bool:
+        return job.key in self._cancelled or (self.state_dir is not None and self._cancel_path(job.key).exists())
+
+    def submit(self, key: Hashable, fn: Callable[[Job], None]) -> Job:
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key) or self._load(key)
+            if job is not None and job.active:
+                return job
+            self._cancelled.discard(key)
+            if self.state_dir is not None:
+                self._cancel_path(key).unlink(missing_ok=True)
+            job = self._jobs[key] = Job(key, on_change=self._save, should_stop=self._stop_requested)
+            self._save(job)
+            self._pool().submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], None]):
+        job.state = "running"
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            if self._stop_requested(job):
+                raise JobCancelled(f"Job {job.key} was cancelled")
+            fn(job)
+            job.state = "done"
+        except JobCancelled as e:
+            logger.info(f"Job {self.name}:{job.key} cancelled")
+            job.error = str(e)
+            job.state = "cancelled"
+        except Exception as e:
+            logger.exception(f"Job {self.name}:{job.key} failed")
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+
+    def get(self, key: Hashable) -> Optional[Job]:
+        """The latest job for the key, whichever worker runs it"""
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is not None and _expired(job):
+            job = None
+        shared = self._load(key)
+        if shared is not None and (job is None or shared.created_at > job.created_at):
+            return shared
+        return job
+
+    def cancel(self, key: Hashable, timeout: float) -> bool:
+        """Ask the key's active job to stop and wait up to `timeout` seconds; True once none runs"""
+        job = self.get(key)
+        if job is None or not job.active:
+            return True
+        with self._lock:
+            self._cancelled.add(key)
+        if self.state_dir is not None:
+            try:
+                self.state_dir.mkdir(parents=True, exist_ok=True)
+                self._cancel_path(key).touch()
+            except OSError as e:
+                logger.warning(f"⚠ Couldn't ask other workers to stop job {self.name}:{key}: {e}")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.get(key)
+            if job is None or not job.active:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def forget(self, key: Hashable):
+        """Drop a finished job's record (e.g. when its project is deleted)"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job.active:
+                del self._jobs[key]
+            shared = self._load(key)
+            if shared is not None and not shared.active:
+                self._state_path(key).unlink(missing_ok=True)
+                self._cancel_path(key).unlink(missing_ok=True)
@@ -0,0 +1,67 @@
+"""Entity mention rows and the text shown with them.
+
+A mention's context (the text around it) and mentioned_as (its exact
+text) are slices of the chapter. With MENTION_STORAGE=compact (default)
+rows keep only the entity, chapter and offsets, and the text is sliced
+from the chapter when mentions are read, one query for all the chapters
+involved. MENTION_STORAGE=full also stores the text on each row, as
+before. Rows written under the full layout keep their text either way.
+
+Offsets refer to the content NER last ran on (the chapter's ner_revision);
+every content change re-runs NER for the chapter, which rewrites its
+mentions. Until it has, compact rows of an edited chapter would slice the
+wrong text, so reads leave them out (see offsets_current).
+"""
+import os
+from typing import Dict, List, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from .. import models
+
+MENTION_STORAGE = os.getenv("MENTION_STORAGE", "compact").lower()
+CONTEXT_RADIUS = 50  # Characters of context on each side of a mention
+
+
+def mention_text(content: str, start: int, end: int) -> Tuple[str, str]:
+    """(context, mentioned_as) for the mention at [start, end)"""
+    return content[max(0, start - CONTEXT_RADIUS):end + CONTEXT_RADIUS], content[start:end]
+
+
+def offsets_current():
+    """SQL condition: the chapter's content is what its mentions' offsets were found in.
+
+    Chapters whose NER pass predates ner_revision count as current.
+    """
+    return or_(models.Chapter.ner_revision.is_(None), models.Chapter.ner_revision == models.Chapter.revision)
+
+
+def mention_row(entity_id: int, chapter_id: int, start: int, end: int, content: str) -> dict:
+    """Column values for an EntityMention insert, with the text only in the full layout"""
+    row = {"entity_id": entity_id, "chapter_id": chapter_id, "start_pos": start, "end_pos": end}
+    if MENTION_STORAGE == "full":
+        row["context"], row["mentioned_as"] = mention_text(content, start, end)
+    return row
+
+
+def fill_mention_text(db: Session, mentions: List[dict]) -> List[dict]:
+    """Fill missing context / mentioned_as on mention dicts (chapter_id, position, end_position)
+    from their chapters' content, loading each chapter involved once"""
+    chapter_ids = {m["chapter_id"] for m in mentions if m["context"] is None or m["mentioned_as"] is None}
+    if not chapter_ids:
+        return mentions
+
+    contents: Dict[int, str] = dict(
+        db.query(models.Chapter.id, models.Chapter.content).filter(models.Chapter.id.in_(chapter_ids)).all()
+    )
+    for m in mentions:
+        content = contents.get(m["chapter_id"])
+        if content is None or m["position"] is None or m["end_position"] is None:
+            continue
+        context, mentioned_as = mention_text(content, m["position"], m["end_position"])
+        if m["context"] is None:
+            m["context"] = context
+        if m["mentioned_as"] is None:
+            m["mentioned_as"] = mentioned_as
+    return mentions
@@ -0,0 +1,223 @@
+"""In-process metrics registry rendered in Prometheus text format"""
+import threading
+from bisect import bisect_left
+from typing import Dict, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        yield from super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        yield from super().render()
+        with self._lock:
+            items = list(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def render(self):
+        yield from super().render()
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            cumulative += state[len(self.buckets)]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# HTTP
+http_request_duration = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by handler",
+    ("method", "handler", "status")
+))
+http_requests_in_flight = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+))
+
+# Database
+db_queries_per_request = REGISTRY.register(Histogram(
+    "db_queries_per_request", "SQL statements issued per HTTP request",
+    ("handler",), buckets=COUNT_BUCKETS
+))
+db_query_time_per_request = REGISTRY.register(Histogram(
+    "db_query_time_per_request_seconds", "Total SQL time per HTTP request",
+    ("handler",)
+))
+
+# NER
+ner_job_duration = REGISTRY.register(Histogram(
+    "ner_job_duration_seconds", "NER processing time per chapter",
+    ("status",)
+))
+ner_queue_depth = REGISTRY.register(Gauge(
+    "ner_jobs_queued", "NER jobs scheduled but not yet started"
+))
+ner_jobs_running = REGISTRY.register(Gauge(
+    "ner_jobs_running", "NER jobs currently running"
+))
+
+# Assistant
+assistant_retrieval_duration = REGISTRY.register(Histogram(
+    "assistant_retrieval_seconds", "Assistant retrieval (entity lookup + vector search) time"
+))
+assistant_llm_duration = REGISTRY.register(Histogram(
+    "assistant_llm_seconds", "Assistant LLM generation time"
+))
+
+assistant_context_tokens = REGISTRY.register(Histogram(
+    "assistant_context_tokens", "Estimated tokens of retrieved context sent to the LLM",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+))
+assistant_requests_in_flight = REGISTRY.register(Gauge(
+    "assistant_requests_in_flight", "Assistant questions currently being answered"
+))
+assistant_coalesced_requests = REGISTRY.register(Counter(
+    "assistant_coalesced_requests_total", "Questions answered by joining an identical in-flight call"
+))
+
+assistant_retrieved_documents = REGISTRY.register(Counter(
+    "assistant_retrieved_documents_total", "Documents given to the LLM, by retrieval stage", ("source",)
+))
+assistant_cache_requests = REGISTRY.register(Counter(
+    "assistant_cache_requests_total", "Assistant cache lookups", ("result",)
+))
+assistant_cache_evictions = REGISTRY.register(Counter(
+    "assistant_cache_evictions_total", "Assistants evicted (LRU or idle)"
+))
+assistant_cache_size = REGISTRY.register(Gauge(
+    "assistant_cache_size", "Assistants currently cached"
+))
+assistant_build_duration = REGISTRY.register(Histogram(
+    "assistant_build_seconds", "Time to open and sync a project's knowledge base"
+))
+
+# Versions
+version_diff_cache_requests = REGISTRY.register(Counter(
+    "version_diff_cache_requests_total", "Version diff cache lookups", ("result",)
+))
+
+# Chapters
+chapter_annotation_cache_requests = REGISTRY.register(Counter(
+    "chapter_annotation_cache_requests_total", "Chapter annotation cache lookups", ("result",)
+))
+
+# Entities
+entity_timeline_cache_requests = REGISTRY.register(Counter(
+    "entity_timeline_cache_requests_total", "Entity timeline cache lookups", ("result",)
+))
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
@@ -1,50 +1,127 @@
-import spacy
+import logging
+import os
+import threading
+import time
+from fastapi import BackgroundTasks
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from .. import models
 from ..database import SessionLocal
 from .entity_resolver import EntityResolver
+from .chapter_analysis import save_analysis
+from .mentions import mention_row
+from . import metrics
+from .query_stats import track_queries
+
+logger = logging.getLogger(__name__)
 
 nlp_en = None
+_nlp_lock = threading.Lock()
+
+# Model name or path; unset tries en_core_web_trf, then en_core_web_sm
+SPACY_MODEL = os.getenv("SPACY_MODEL")
+
+# Chapters with a NER run queued but not started (chapter id -> when it was
+# queued); frequent saves (PATCH autosaves) queue one run, which reads whatever
+# text is current when it starts
+_pending_chapters = {}
+_pending_lock = threading.Lock()
+
+# A queued run older than this is taken to be lost (its request failed before
+# background tasks ran) and the next save queues another
+NER_PENDING_TIMEOUT = float(os.getenv("NER_PENDING_TIMEOUT_SECONDS", "600"))
 
 def get_nlp():
+    """The shared spaCy pipeline, loaded on first use (or before forking workers, see gunicorn.conf.py)"""
     global nlp_en
-    if nlp_en is None:
-        print("🔄 Loading spaCy model...", flush=True)
-        try:
-            nlp_en = spacy.load("en_core_web_trf")
-            print("✓ Loaded en_core_web_trf model", flush=True)
-        except:
+    with _nlp_lock:
+        if nlp_en is None:
+            logger.info("🔄 Loading spaCy model...")
+            import spacy  # Deferred: importing spaCy alone takes a noticeable part of startup
+            if SPACY_MODEL:
+                nlp_en = spacy.load(SPACY_MODEL)
+                logger.info(f"✓ Loaded {SPACY_MODEL} model")
+                return nlp_en
             try:
-                nlp_en = spacy.load("en_core_web_sm")
-                print("✓ Loaded en_core_web_sm model", flush=True)
-            except Exception as e:
-                print(f"✗ Failed to load spaCy model: {e}", flush=True)
-                raise
+                nlp_en = spacy.load("en_core_web_trf")
+                logger.info("✓ Loaded en_core_web_trf model")
+            except:
+                try:
+                    nlp_en = spacy.load("en_core_web_sm")
+                    logger.info("✓ Loaded en_core_web_sm model")
+                except Exception as e:
+                    logger.error(f"✗ Failed to load spaCy model: {e}")
+                    raise
     return nlp_en
 
+def schedule_chapter_ner(background_tasks: BackgroundTasks, chapter_id: int, language: str = 'en'):
+    """Queue NER for a chapter, tracking queue depth; no-op if a run is already queued.
+    
+    Call it once the change is committed: a request that fails afterwards
+    never runs its background tasks, and the run would be lost until it times out.
+    """
+    queued_at = time.monotonic()
+    with _pending_lock:
+        previous = _pending_chapters.get(chapter_id)
+        if previous is not None and queued_at - previous < NER_PENDING_TIMEOUT:
+            return
+        _pending_chapters[chapter_id] = queued_at
+    if previous is None:
+        metrics.ner_queue_depth.inc()  # A lost run is replaced, still one queued
+    background_tasks.add_task(_run_queued_ner, chapter_id, language, queued_at)
+
+def _run_queued_ner(chapter_id: int, language: str, queued_at: float):
+    with _pending_lock:
+        # A run taken for lost that starts after all leaves its replacement queued
+        current = _pending_chapters.get(chapter_id) == queued_at
+        if current:
+            del _pending_chapters[chapter_id]
+    if current:
+        metrics.ner_queue_depth.dec()
+    process_chapter_ner(chapter_id, language)
+
 def process_chapter_ner(chapter_id: int, language: str):
     """Extract entities from chapter and create Entity + EntityMention records"""
+    metrics.ner_jobs_running.inc()
+    start_time = time.perf_counter()
+    status = "error"
+    try:
+        with track_queries() as stats:
+            status = _process_chapter_ner(chapter_id, language)
+    finally:
+        duration = time.perf_counter() - start_time
+        metrics.ner_jobs_running.dec()
+        metrics.ner_job_duration.observe(duration, status=status)
+        logger.info(
+            f"NER job for chapter {chapter_id}: {status} in {duration:.2f}s "
+            f"({stats.count} queries, {stats.total_time:.2f}s in DB)"
+        )
+
+def _process_chapter_ner(chapter_id: int, language: str) -> str:
     db = SessionLocal()
     
     try:
         chapter = db.query(models.Chapter).filter(models.Chapter.id == chapter_id).first()
         if not chapter:
-            print(f"✗ Chapter {chapter_id} not found in database", flush=True)
-            return
+            logger.warning(f"✗ Chapter {chapter_id} not found in database")
+            return "not_found"
         
-        print(f"\n{'='*60}", flush=True)
-        print(f"🚀 NER PROCESSING: Chapter {chapter.chapter_number}", flush=True)
-        print(f"{'='*60}\n", flush=True)
+        logger.info(f"🚀 NER PROCESSING: Chapter {chapter.chapter_number}")
         
         # Clear existing mentions for this chapter
         deleted_count = db.query(models.EntityMention).filter(
             models.EntityMention.chapter_id == chapter_id
         ).delete()
         db.commit()
-        print(f"✓ Cleared {deleted_count} existing mentions", flush=True)
+        logger.info(f"✓ Cleared {deleted_count} existing mentions")
+        
+        # Read once up front; commits expire ORM attributes and would re-query them per entity
+        project_id = chapter.project_id
+        content = chapter.content
+        revision = chapter.revision or 0
         
         nlp = get_nlp()
-        doc = nlp(chapter.content)
+        doc = nlp(content)
         
         # Entity type mapping
         type_mapping = {
@@ -62,6 +139,13 @@ def process_chapter_ner(chapter_id: int, language: str):
         entities_created = 0
         entities_reused = 0
         mentions_created = 0
+        entity_spans = []  # (start, end, entity id) for the chapter analysis
+        mention_rows = []
+        
+        # Load the project's entities once and match against them in memory
+        entities_by_type = {}
+        for entity in db.query(models.Entity).filter(models.Entity.project_id == project_id).all():
+            entities_by_type.setdefault(entity.entity_type, []).append(entity)
         
         for ent in doc.ents:
             entity_type = type_mapping.get(ent.label_, None)
@@ -76,55 +160,56 @@ def process_chapter_ner(chapter_id: int, language: str):
                 continue
             
             # Find similar existing entities
-            similar = EntityResolver.find_similar_entities(
-                db, chapter.project_id, normalized_name, entity_type, threshold=0.85
+            similar = EntityResolver.rank_similar(
+                normalized_name, entities_by_type.get(entity_type, []), threshold=0.85
             )
             
             if similar and similar[0][1] >= 0.85:  # High confidence match
                 existing_entity = similar[0][0]
                 entities_reused += 1
-                print(f"   ↻ Matched '{ent.text}' → '{existing_entity.name}' ({similar[0][1]:.2f})", flush=True)
+                logger.debug(f"   ↻ Matched '{ent.text}' → '{existing_entity.name}' ({similar[0][1]:.2f})")
             else:
                 # Create new entity with normalized name
                 existing_entity = models.Entity(
-                    project_id=chapter.project_id,
+                    project_id=project_id,
                     name=normalized_name,
                     entity_type=entity_type,
                     aliases=[ent.text] if ent.text != normalized_name else []
                 )
                 db.add(existing_entity)
-                db.commit()
-                db.refresh(existing_entity)
+                db.flush()  # Assigns the id without ending the transaction
+                entities_by_type.setdefault(entity_type, []).append(existing_entity)
                 entities_created += 1
-                print(f"   ✓ Created: {normalized_name} ({entity_type})", flush=True)
+                logger.debug(f"   ✓ Created: {normalized_name} ({entity_type})")
             
-            # Create mention
-            context_start = max(0, ent.start_char - 50)
-            context_end = min(len(chapter.content), ent.end_char + 50)
-            context = chapter.content[context_start:context_end]
-            
-            mention = models.EntityMention(
-                entity_id=existing_entity.id,
-                chapter_id=chapter.id,
-                start_pos=ent.start_char,
-                end_pos=ent.end_char,
-                context=context,
-                mentioned_as=ent.text
-            )
-            db.add(mention)
+            # Rows are inserted together once the whole chapter has been matched
+            mention_rows.append(mention_row(existing_entity.id, chapter_id, ent.start_char, ent.end_char, content))
             mentions_created += 1
+            entity_spans.append((ent.start_char, ent.end_char, existing_entity.id))
         
+        if mention_rows:
+            db.execute(insert(models.EntityMention), mention_rows)
+        db.query(models.Chapter).filter(models.Chapter.id == chapter_id).update(
+            {
+                models.Chapter.mentions_revision: models.Chapter.mentions_revision + 1,
+                models.Chapter.ner_revision: revision
+            }, synchronize_session=False
+        )
+        
+        # Keep the parse for the knowledge base so it can chunk on sentences without re-running spaCy
+        save_analysis(db, chapter_id, content, doc, entity_spans)
         db.commit()
         
-        print(f"\n{'='*60}", flush=True)
-        print(f"✅ COMPLETE: {entities_created} new, {entities_reused} matched, {mentions_created} mentions", flush=True)
-        print(f"{'='*60}\n", flush=True)
+        logger.info(f"✅ COMPLETE: {entities_created} new, {entities_reused} matched, {mentions_created} mentions")
+        
+        # Re-embed just this chapter and the touched entities in the assistant's knowledge base
+        from .assistant_service import sync_project_knowledge_base
+        sync_project_knowledge_base(project_id)
+        return "ok"
         
     except Exception as e:
-        print(f"\n❌ ERROR: {e}\n", flush=True)
+        logger.exception(f"❌ ERROR: {e}")
         db.rollback()
-        import traceback
-        traceback.print_exc()
         raise
     finally:
         db.close()
\ No newline at end of file
@@ -0,0 +1,319 @@
+"""Brute-force vector store on a memory-mapped NumPy matrix.
+
+An alternative to one Chroma collection per project (VECTOR_STORE=numpy).
+Vectors are L2-normalized and stored as float16, or int8 with a per-row
+scale, in a single memory-mapped file; ids, texts and metadata live in a
+SQLite sidecar. Search is an exact blocked dot product over the matrix,
+which for a few thousand chunks is faster than an HNSW index and needs
+none of its memory.
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine / MMR search over a float16 or int8 memmap"""
+
+    GROWTH_ROWS = 1024
+    SEARCH_BLOCK_ROWS = 4096  # Rows scored per matmul when streaming from the memmap
+    # Stores up to this size also keep a float32 copy in RAM; converting the
+    # quantized rows on every query costs more than the dot product itself
+    RESIDENT_BYTES = int(os.getenv("VECTOR_RESIDENT_MB", "64")) * 2 ** 20
+
+    def __init__(self, directory: Path, embedding_function: Embeddings, quantization: str = "float16"):
+        if quantization not in DTYPES:
+            raise ValueError(f"Unknown quantization '{quantization}' (choose from {', '.join(DTYPES)})")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.embedding_function = embedding_function
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.directory / "chunks.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, text TEXT NOT NULL, metadata TEXT NOT NULL
+            );
+        """)
+        settings = dict(self._db.execute("SELECT key, value FROM settings").fetchall())
+        # An existing store keeps the format it was written with
+        self.quantization = settings.get("quantization", quantization)
+        self.dim = int(settings["dim"]) if "dim" in settings else None
+        self._dtype = DTYPES[self.quantization]
+        self._matrix: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._resident: Optional[np.ndarray] = None
+        self._load_rows()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    # Storage
+
+    def _load_rows(self):
+        self._row_of: Dict[str, int] = dict(self._db.execute("SELECT id, row FROM chunks").fetchall())
+        self._refresh_mask()
+        if self.dim is not None and self._row_of:
+            self._ensure_capacity(self._high_water)
+
+    def _refresh_mask(self):
+        """Rows in use, as a boolean mask over [0, high water mark)"""
+        rows = np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of))
+        self._high_water = int(rows.max()) + 1 if len(rows) else 0
+        alive = np.zeros(self._high_water, dtype=bool)
+        alive[rows] = True
+        self._alive = alive
+
+    def _ensure_capacity(self, rows: int):
+        """Map (and grow if needed) the vector file so it holds at least `rows` rows"""
+        if self._matrix is not None and self._matrix.shape[0] >= rows:
+            return
+        path = self.directory / f"vectors.{self.quantization}"
+        row_bytes = self.dim * np.dtype(self._dtype).itemsize
+        on_disk = path.stat().st_size // row_bytes if path.exists() else 0
+        capacity = on_disk if on_disk >= rows else max(rows, on_disk * 2, self.GROWTH_ROWS)
+        if self._matrix is not None:
+            self._matrix.flush()
+        if capacity > on_disk:
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            if self.quantization == "int8":
+                with open(self.directory / "scales.f32", "ab") as f:
+                    f.truncate(capacity * 4)
+        self._matrix = np.memmap(path, dtype=self._dtype, mode="r+", shape=(capacity, self.dim))
+        if self.quantization == "int8":
+            self._scales = np.memmap(self.directory / "scales.f32", dtype=np.float32, mode="r+", shape=(capacity,))
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.quantization == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        if self._resident is not None and len(rows) and rows.max() < self._resident.shape[0]:
+            return self._resident[rows]
+        vectors = self._matrix[rows].astype(np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        """Store precomputed vectors (upserting by id)"""
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", [
+                    ("dim", str(self.dim)), ("quantization", self.quantization)
+                ])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding size changed: {self.dim} -> {vectors.shape[1]}")
+
+            # Reuse the rows of replaced ids, then holes left by deletes, then append
+            free = iter(np.flatnonzero(~self._alive).tolist())
+            next_row = self._high_water
+            rows = []
+            for chunk_id in ids:
+                row = self._row_of.get(chunk_id)
+                if row is None:
+                    row = next(free, None)
+                    if row is None:
+                        row, next_row = next_row, next_row + 1
+                    self._row_of[chunk_id] = row
+                rows.append(row)
+
+            self._ensure_capacity(max(rows) + 1)
+            encoded, scales = self._encode(vectors)
+            self._matrix[rows] = encoded
+            if scales is not None:
+                self._scales[rows] = scales
+            self._matrix.flush()
+            self._resident = None
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunks (id, row, text, metadata) VALUES (?, ?, ?, ?)",
+                    [(i, r, t, json.dumps(m)) for i, r, t, m in zip(ids, rows, texts, metadatas)]
+                )
+            self._refresh_mask()
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, *,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding_function.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return None
+        with self._lock:
+            with self._db:
+                for i in range(0, len(ids), 500):
+                    batch = ids[i:i + 500]
+                    self._db.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            for chunk_id in ids:
+                self._row_of.pop(chunk_id, None)
+            self._refresh_mask()
+        return True
+
+    def reset_collection(self):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM chunks")
+            self._row_of = {}
+            self._refresh_mask()
+            self._resident = None
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None) -> Dict[str, list]:
+        """Chroma-style listing: ids plus the requested 'metadatas' / 'documents'"""
+        include = include or ["metadatas", "documents"]
+        query = "SELECT id, text, metadata FROM chunks"
+        params: list = []
+        if ids is not None:
+            query += f" WHERE id IN ({','.join('?' * len(ids))})"
+            params = list(ids)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        result = {"ids": [r[0] for r in rows]}
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(r[2]) for r in rows]
+        if "documents" in include:
+            result["documents"] = [r[1] for r in rows]
+        return result
+
+    def get_by_ids(self, ids, /) -> List[Document]:
+        listing = self.get(ids=list(ids))
+        return [
+            Document(id=i, page_content=t, metadata=m)
+            for i, t, m in zip(listing["ids"], listing["documents"], listing["metadatas"])
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            self._db.close()
+
+    # Search
+
+    def _resident_matrix(self, rows: int) -> Optional[np.ndarray]:
+        """Dequantized float32 copy of the first `rows` rows, if small enough to keep"""
+        resident = self._resident
+        if resident is not None and resident.shape[0] >= rows:
+            return resident
+        if rows * self.dim * 4 > self.RESIDENT_BYTES:
+            return None
+        with self._lock:
+            if self._resident is None or self._resident.shape[0] < rows:
+                self._resident = self._decode(np.arange(self._high_water))
+            return self._resident
+
+    def _top_rows(self, query: List[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k live rows by cosine similarity, best first"""
+        if self.dim is None or not self._row_of:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        alive = self._alive
+        resident = self._resident_matrix(len(alive))
+        if resident is not None:
+            scores = resident[:len(alive)] @ q
+        else:
+            matrix, scales = self._matrix, self._scales
+            scores = np.empty(len(alive), dtype=np.float32)
+            for start in range(0, len(alive), self.SEARCH_BLOCK_ROWS):
+                end = min(start + self.SEARCH_BLOCK_ROWS, len(alive))
+                block = matrix[start:end].astype(np.float32) @ q
+                if scales is not None:
+                    block *= scales[start:end]
+                scores[start:end] = block
+        scores[~alive] = -np.inf
+        k = min(k, int(alive.sum()))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def _documents(self, rows: np.ndarray) -> List[Document]:
+        if not len(rows):
+            return []
+        row_list = [int(r) for r in rows]
+        with self._lock:
+            found = {
+                row: (chunk_id, text, metadata) for chunk_id, row, text, metadata in self._db.execute(
+                    f"SELECT id, row, text, metadata FROM chunks WHERE row IN ({','.join('?' * len(row_list))})",
+                    row_list
+                ).fetchall()
+            }
+        return [
+            Document(id=found[r][0], page_content=found[r][1], metadata=json.loads(found[r][2]))
+            for r in row_list if r in found
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        rows, scores = self._top_rows(embedding, k)
+        return list(zip(self._documents(rows), scores.tolist()))
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2  # cosine [-1, 1] -> [0, 1]
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        rows, _ = self._top_rows(embedding, fetch_k)
+        if not len(rows):
+            return []
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32), self._decode(rows), lambda_mult=lambda_mult, k=k
+        )
+        return self._documents(rows[selected])
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult
+        )
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, *,
+                   ids: Optional[List[str]] = None, directory: Optional[Path] = None,
+                   **kwargs: Any) -> "NumpyVectorStore":
+        if directory is None:
+            raise ValueError("NumpyVectorStore.from_texts needs a directory")
+        store = cls(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
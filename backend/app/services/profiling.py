@@ -0,0 +1,158 @@
+"""Opt-in sampling profiler for single requests.
+
+Enabled per request with the `X-Profile-Token` header or `?profile=<token>`
+query flag, where the token must match PROFILING_TOKEN. When PROFILING_TOKEN
+is unset, profiling is off and the only cost is one env lookup at import.
+
+Stacks are sampled until the response body has been sent, so streamed
+responses (the assistant's SSE answers) are profiled through their last
+chunk; SQL is recorded while the handler runs.
+"""
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import Request
+from .query_stats import QueryStats
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "./profiles"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILING_INTERVAL_MS", "2")) / 1000
+
+APP_ROOT = str(Path(__file__).resolve().parent.parent)
+_PROFILE_ID_RE = re.compile(r"^[\w.-]+$")
+
+
+def is_requested(request: Request) -> bool:
+    if not PROFILING_TOKEN:
+        return False
+    token = request.headers.get("x-profile-token") or request.query_params.get("profile")
+    return token is not None and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+class _CallNode:
+    __slots__ = ("samples", "children")
+
+    def __init__(self):
+        self.samples = 0
+        self.children: Dict[str, "_CallNode"] = {}
+
+
+class RequestProfile:
+    """Samples thread stacks while a request runs and records its SQL"""
+
+    def __init__(self, label: str, interval: float = SAMPLE_INTERVAL):
+        self.label = label
+        self.interval = interval
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.queries = QueryStats(capture=True)
+        self.root = _CallNode()
+        self.sample_count = 0
+        self.duration = 0.0
+        self._stacks = defaultdict(list)  # thread id -> list of frame-label tuples
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._loop_thread = threading.get_ident()  # Started from the event loop: async handlers run here
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+        self._build_tree()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                in_app = False
+                while frame is not None:
+                    code = frame.f_code
+                    if code.co_filename.startswith(APP_ROOT):
+                        in_app = True
+                    stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                if in_app:
+                    self._stacks[thread_id].append(tuple(reversed(stack)))
+
+    def _build_tree(self):
+        # Threads that executed this request's SQL are known to be serving it; prefer them, plus
+        # the event loop, where async handlers and streamed bodies run (shared with other requests)
+        thread_ids = (self.queries.thread_ids | {self._loop_thread}) if self.queries.thread_ids else set(self._stacks)
+        for thread_id in thread_ids:
+            for stack in self._stacks.get(thread_id, []):
+                self.sample_count += 1
+                node = self.root
+                node.samples += 1
+                for filename, name, lineno in stack:
+                    key = f"{name} ({_short_path(filename)}:{lineno})"
+                    node = node.children.setdefault(key, _CallNode())
+                    node.samples += 1
+
+    def report(self, min_fraction: float = 0.01) -> str:
+        lines = [
+            f"Profile: {self.label}",
+            f"Wall time: {self.duration * 1000:.1f} ms, {self.sample_count} samples "
+            f"every {self.interval * 1000:.1f} ms",
+            "",
+            "== Call tree (samples, % of samples) ==",
+        ]
+        total = max(self.root.samples, 1)
+
+        def walk(node, depth):
+            for key, child in sorted(node.children.items(), key=lambda kv: -kv[1].samples):
+                if child.samples / total < min_fraction:
+                    continue
+                lines.append(f"{'  ' * depth}{child.samples:6d} {100 * child.samples / total:5.1f}%  {key}")
+                walk(child, depth + 1)
+
+        walk(self.root, 0)
+
+        lines += [
+            "",
+            f"== SQL: {self.queries.count} statements, {self.queries.total_time * 1000:.1f} ms ==",
+        ]
+        grouped = defaultdict(lambda: [0, 0.0])
+        for statement, duration in self.queries.statements:
+            entry = grouped[" ".join(statement.split())]
+            entry[0] += 1
+            entry[1] += duration
+        for statement, (count, duration) in sorted(grouped.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"{duration * 1000:9.2f} ms  x{count:<4d} {statement}")
+        return "\n".join(lines) + "\n"
+
+    def save(self) -> str:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        (PROFILE_DIR / f"{self.profile_id}.txt").write_text(self.report(), encoding="utf-8")
+        return self.profile_id
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(APP_ROOT):
+        return "app" + filename[len(APP_ROOT):]
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+def load_report(profile_id: str) -> Optional[str]:
+    if not _PROFILE_ID_RE.match(profile_id):
+        return None
+    path = PROFILE_DIR / f"{profile_id}.txt"
+    if not path.exists():
+        return None
+    return path.read_text(encoding="utf-8")
@@ -0,0 +1,51 @@
+"""Project deletion: one DELETE (the database cascades to chapters, versions,
+entities and mentions) plus the vector store files and caches kept outside
+the database. Projects above PROJECT_DELETE_BACKGROUND_WORDS are deleted by
+a background job whose progress can be polled.
+"""
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+from .assistant_service import drop_knowledge_base
+from .jobs import Job, JobRegistry
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_WORDS = int(os.getenv("PROJECT_DELETE_BACKGROUND_WORDS", "200000"))
+
+_delete_jobs = JobRegistry(max_workers=1, name="project-delete")
+
+
+def delete_project(db: Session, project_id: int) -> bool:
+    """Delete the project's rows and files (stopping its knowledge base build first); False if it didn't exist"""
+    deleted = db.query(models.Project).filter(
+        models.Project.id == project_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    drop_knowledge_base(project_id)
+    if deleted:
+        logger.info(f"🗑️ Deleted project {project_id}")
+    return bool(deleted)
+
+
+def start_project_delete(project_id: int) -> Job:
+    """Delete the project in the background; returns the running job if one is already deleting it"""
+    def run(job: Job):
+        job.report(0, 1)
+        db = SessionLocal()
+        try:
+            delete_project(db, project_id)
+        finally:
+            db.close()
+        job.report(1, 1)
+    
+    return _delete_jobs.submit(project_id, run)
+
+
+def project_delete_job(project_id: int) -> Optional[Job]:
+    return _delete_jobs.get(project_id)
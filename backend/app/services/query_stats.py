@@ -0,0 +1,78 @@
+"""Per-request / per-job SQL statement accounting via SQLAlchemy events"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+
+
+class QueryStats:
+    """Counts statements and time spent in the database for one unit of work"""
+
+    def __init__(self, capture: bool = False):
+        self.count = 0
+        self.total_time = 0.0
+        # With capture=True, keep (statement, duration) pairs and the threads that ran them
+        self.statements = [] if capture else None
+        self.thread_ids = set() if capture else None
+        self.parent: Optional["QueryStats"] = None
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.total_time += duration
+        if self.statements is not None:
+            self.statements.append((statement, duration))
+            self.thread_ids.add(threading.get_ident())
+        if self.parent is not None:
+            self.parent.record(statement, duration)
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+@contextmanager
+def track_queries(stats: Optional[QueryStats] = None):
+    """Attribute every statement executed in this context to `stats`"""
+    stats = stats or QueryStats()
+    # Nested trackers (e.g. a profiled request inside the metrics middleware) also feed the outer one
+    if stats.parent is None and _current_stats.get() is not stats:
+        stats.parent = _current_stats.get()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("query_start_time")
+    if not start_times:
+        return
+    duration = time.perf_counter() - start_times.pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute; keep the timing stack balanced
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def instrument_engine(engine):
+    """Install the statement listeners on an engine (idempotent)"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
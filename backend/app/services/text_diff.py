@@ -0,0 +1,123 @@
+"""Hierarchical text diff: paragraphs first, then finer units inside changed ones.
+
+Diffing a whole chapter word by word is slow (difflib is quadratic in the
+worst case) and most paragraphs are usually untouched. Matching paragraphs
+first, trimming the common head and tail at every level, keeps each
+SequenceMatcher run small. Chapter content may be plain text or the
+editor's HTML, so block-level closing tags end paragraphs as well as
+newlines.
+
+A chapter with few paragraph breaks still leaves one huge changed block,
+so `diff` takes an optional budget of token comparisons (the product of
+both sides' token counts, summed over matcher runs). A block that would
+overrun it is reported as replaced whole at the level reached so far.
+"""
+import difflib
+import re
+from typing import Callable, List, Optional, Tuple
+
+Span = Tuple[int, int]
+Opcode = Tuple[str, int, int, int, int]  # (equal|delete|insert|replace, a_start, a_end, b_start, b_end)
+Tokenizer = Callable[[str, int, int], List[Span]]
+
+_PARAGRAPH_END = re.compile(r"\n|</(?:p|h[1-6]|li|blockquote|div|pre)>|<br\s*/?>", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"[.!?\n]")
+_WORD = re.compile(r"<[^>]*>|\w+|\s+|[^\w\s]")  # Tags, words, whitespace runs, single punctuation
+
+
+def _split_after(pattern: re.Pattern) -> Tokenizer:
+    def split(text: str, start: int, end: int) -> List[Span]:
+        spans = []
+        for match in pattern.finditer(text, start, end):
+            if match.end() > start:
+                spans.append((start, match.end()))
+                start = match.end()
+        if start < end:
+            spans.append((start, end))
+        return spans
+    return split
+
+
+def _words(text: str, start: int, end: int) -> List[Span]:
+    return [match.span() for match in _WORD.finditer(text, start, end)]
+
+
+paragraphs = _split_after(_PARAGRAPH_END)
+sentences = _split_after(_SENTENCE_END)
+words = _words
+
+
+def _emit(out: List[Opcode], tag: str, a_start: int, a_end: int, b_start: int, b_end: int):
+    if a_start == a_end and b_start == b_end:
+        return
+    if out:
+        last = out[-1]
+        if last[0] == tag and last[2] == a_start and last[4] == b_start:
+            out[-1] = (tag, last[1], a_end, last[3], b_end)
+            return
+    out.append((tag, a_start, a_end, b_start, b_end))
+
+
+class Budget:
+    """Token comparisons left for SequenceMatcher runs; `exceeded` once any block was left coarse"""
+
+    def __init__(self, pairs: Optional[int]):
+        self.pairs = pairs
+        self.exceeded = False
+
+    def take(self, a_count: int, b_count: int) -> bool:
+        if self.pairs is None:
+            return True
+        cost = a_count * b_count
+        if cost > self.pairs:
+            self.exceeded = True
+            return False
+        self.pairs -= cost
+        return True
+
+
+def _diff(a: str, a_range: Span, b: str, b_range: Span, levels: List[Tokenizer], out: List[Opcode],
+          budget: Budget):
+    a_spans = levels[0](a, *a_range)
+    b_spans = levels[0](b, *b_range)
+    a_tokens = [a[s:e] for s, e in a_spans]
+    b_tokens = [b[s:e] for s, e in b_spans]
+
+    # Common head and tail don't need the matcher
+    head = 0
+    limit = min(len(a_tokens), len(b_tokens))
+    while head < limit and a_tokens[head] == b_tokens[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a_tokens[-1 - tail] == b_tokens[-1 - tail]:
+        tail += 1
+
+    def a_offset(i: int) -> int:
+        return a_spans[i][0] if i < len(a_spans) else a_range[1]
+
+    def b_offset(j: int) -> int:
+        return b_spans[j][0] if j < len(b_spans) else b_range[1]
+
+    _emit(out, "equal", a_range[0], a_offset(head), b_range[0], b_offset(head))
+    a_middle = a_tokens[head:len(a_tokens) - tail]
+    b_middle = b_tokens[head:len(b_tokens) - tail]
+    if a_middle and b_middle and not budget.take(len(a_middle), len(b_middle)):
+        opcodes = [("replace", 0, len(a_middle), 0, len(b_middle))]
+        levels = levels[:1]  # Too big to match: the whole block, no finer level
+    else:
+        opcodes = difflib.SequenceMatcher(None, a_middle, b_middle, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in opcodes:
+        a_start, a_end = a_offset(head + i1), a_offset(head + i2)
+        b_start, b_end = b_offset(head + j1), b_offset(head + j2)
+        if tag == "replace" and len(levels) > 1:
+            _diff(a, (a_start, a_end), b, (b_start, b_end), levels[1:], out, budget)
+        else:
+            _emit(out, tag, a_start, a_end, b_start, b_end)
+    _emit(out, "equal", a_offset(len(a_tokens) - tail), a_range[1], b_offset(len(b_tokens) - tail), b_range[1])
+
+
+def diff(a: str, b: str, levels: List[Tokenizer], budget: Optional[Budget] = None) -> List[Opcode]:
+    """Character-range opcodes turning `a` into `b`, refined level by level"""
+    out: List[Opcode] = []
+    _diff(a, (0, len(a)), b, (0, len(b)), levels, out, budget or Budget(None))
+    return out
@@ -0,0 +1,125 @@
+"""Entity x chapter mention counts for a project, cached per project revision.
+
+The full matrix comes from one grouped query and is kept as a NumPy
+array; the top-N and chapter-range filters are slices of the cached
+matrix, so every view of the dashboard shares one entry. A project's
+revision is read from its chapters (ids, numbers, titles and
+mentions_revision, which every change to mentions or their entities
+bumps), which is also the only query on a hit.
+"""
+import os
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from . import metrics
+from .lru_cache import LRUCache
+
+TIMELINE_CACHE_SIZE = int(os.getenv("ENTITY_TIMELINE_CACHE_SIZE", "32"))
+
+timeline_cache = LRUCache(TIMELINE_CACHE_SIZE)
+
+
+def build_matrix(db: Session, chapter_ids: list) -> Dict:
+    """Entities (most mentioned first) and their counts per chapter, columns in `chapter_ids` order"""
+    # Counted on ix_entity_mentions_chapter_entity alone, then joined to the few entities for names
+    counts = db.query(
+        models.EntityMention.chapter_id,
+        models.EntityMention.entity_id,
+        func.count().label("mentions")
+    ).filter(
+        models.EntityMention.chapter_id.in_(chapter_ids)
+    ).group_by(models.EntityMention.chapter_id, models.EntityMention.entity_id).subquery()
+    rows = db.query(
+        counts.c.entity_id,
+        models.Entity.name,
+        models.Entity.entity_type,
+        counts.c.chapter_id,
+        counts.c.mentions
+    ).join(models.Entity, models.Entity.id == counts.c.entity_id).all()
+
+    column_of = {chapter_id: column for column, chapter_id in enumerate(chapter_ids)}
+    entities, row_of = [], {}
+    cells = []
+    for entity_id, name, entity_type, chapter_id, count in rows:
+        row = row_of.get(entity_id)
+        if row is None:
+            row = row_of[entity_id] = len(entities)
+            entities.append({"id": entity_id, "name": name, "entity_type": entity_type})
+        cells.append((row, column_of[chapter_id], count))
+
+    counts = np.zeros((len(entities), len(chapter_ids)), dtype=np.int32)
+    if cells:
+        cell_rows, cell_columns, cell_counts = np.array(cells, dtype=np.int64).T
+        counts[cell_rows, cell_columns] = cell_counts
+
+    # Most mentioned first; ties by name so the order is stable between rebuilds
+    totals = counts.sum(axis=1)
+    order = sorted(range(len(entities)), key=lambda i: (-totals[i], entities[i]["name"] or ""))
+    return {"entities": [entities[i] for i in order], "counts": counts[order]}
+
+
+def entity_timeline(db: Session, project_id: int, top: Optional[int] = None,
+                    from_chapter: Optional[int] = None, to_chapter: Optional[int] = None,
+                    sparse: bool = False) -> Dict:
+    """Mention counts of the project's entities across chapters.
+
+    `from_chapter` / `to_chapter` are inclusive chapter numbers; `top` keeps
+    the entities most mentioned within that range. Dense results have one
+    row of counts per entity; sparse ones list the non-zero cells as
+    parallel `entity`, `chapter` and `counts` arrays of indexes and counts.
+    """
+    chapters = db.query(
+        models.Chapter.id,
+        models.Chapter.chapter_number,
+        models.Chapter.title,
+        models.Chapter.mentions_revision,
+        models.Chapter.created_at
+    ).filter(
+        models.Chapter.project_id == project_id
+    ).order_by(models.Chapter.chapter_number, models.Chapter.id).all()
+
+    key = (project_id, tuple((c.id, c.chapter_number, c.title, c.mentions_revision or 0, str(c.created_at))
+                             for c in chapters))
+    matrix = timeline_cache.get(key)
+    metrics.entity_timeline_cache_requests.inc(result=("hit" if matrix is not None else "miss"))
+    if matrix is None:
+        matrix = build_matrix(db, [c.id for c in chapters])
+        timeline_cache.put(key, matrix)
+
+    columns = [
+        i for i, c in enumerate(chapters)
+        if (from_chapter is None or c.chapter_number >= from_chapter)
+        and (to_chapter is None or c.chapter_number <= to_chapter)
+    ]
+    counts = matrix["counts"][:, columns]
+    totals = counts.sum(axis=1)
+    # Entities not mentioned in the range drop out; the cached order breaks ties
+    rows = np.flatnonzero(totals)
+    rows = rows[np.argsort(-totals[rows], kind="stable")]
+    if top is not None:
+        rows = rows[:top]
+    counts = counts[rows]
+
+    result = {
+        "project_id": project_id,
+        "chapters": [
+            {"id": chapters[i].id, "chapter_number": chapters[i].chapter_number, "title": chapters[i].title}
+            for i in columns
+        ],
+        "entities": [{**matrix["entities"][row], "total": int(totals[row])} for row in rows],
+    }
+    if sparse:
+        entity_index, chapter_index = np.nonzero(counts)
+        result.update({
+            "format": "sparse",
+            "entity": entity_index.tolist(),
+            "chapter": chapter_index.tolist(),
+            "counts": counts[entity_index, chapter_index].tolist(),
+        })
+    else:
+        result.update({"format": "dense", "counts": counts.tolist()})
+    return result
@@ -0,0 +1,123 @@
+"""Paragraph-then-word diffs between chapter versions, cached per version pair.
+
+Versions never change once written, so a diff computed for a pair is
+reused until it falls out of the LRU. Keys include each version's content
+hash (or creation time for old rows), so a reused row id never hits a
+stale entry.
+"""
+import os
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session, joinedload
+
+from .. import models
+from . import metrics, text_diff
+from .lru_cache import LRUCache
+from .version_store import version_content
+
+DIFF_CACHE_SIZE = int(os.getenv("VERSION_DIFF_CACHE_SIZE", "256"))
+DIFF_LEVELS = [text_diff.paragraphs, text_diff.words]
+# Token comparisons per diff (under a second at worst); beyond it changed blocks are shown whole
+DIFF_MAX_PAIRS = int(os.getenv("VERSION_DIFF_MAX_PAIRS", "10000000"))
+
+_TAGS = {"equal": "=", "delete": "-", "insert": "+"}
+
+
+def _fingerprint(version) -> str:
+    return version.content_hash or str(version.created_at)
+
+
+diff_cache = LRUCache(DIFF_CACHE_SIZE)
+
+
+def compute_diff(old: str, new: str) -> Dict:
+    """Compact ops (["=", text], ["-", text], ["+", text]) plus word counts.
+
+    `coarse` is true if some changed block was too large to diff word by
+    word within DIFF_MAX_PAIRS and is shown as removed and re-added whole.
+    """
+    ops: List[list] = []
+    budget = text_diff.Budget(DIFF_MAX_PAIRS)
+    for tag, old_start, old_end, new_start, new_end in text_diff.diff(old, new, DIFF_LEVELS, budget):
+        if tag == "replace":
+            pieces = [("-", old[old_start:old_end]), ("+", new[new_start:new_end])]
+        elif tag == "delete":
+            pieces = [("-", old[old_start:old_end])]
+        else:
+            pieces = [(_TAGS[tag], new[new_start:new_end])]
+        for op, text in pieces:
+            if not text:
+                continue
+            if ops and ops[-1][0] == op:
+                ops[-1][1] += text
+            else:
+                ops.append([op, text])
+    return {
+        "ops": ops,
+        "words_added": sum(len(text.split()) for op, text in ops if op == "+"),
+        "words_removed": sum(len(text.split()) for op, text in ops if op == "-"),
+        "coarse": budget.exceeded,
+    }
+
+
+def elide(ops: List[list], context: int) -> List[list]:
+    """Shorten unchanged runs to `context` characters either side of a change.
+
+    Omitted text becomes ["…", number of characters skipped].
+    """
+    result = []
+    for index, (op, text) in enumerate(ops):
+        if op != "=":
+            result.append([op, text])
+            continue
+        keep_head = context if index > 0 else 0
+        keep_tail = context if index < len(ops) - 1 else 0
+        if len(text) <= keep_head + keep_tail:
+            result.append([op, text])
+            continue
+        if keep_head:
+            result.append(["=", text[:keep_head]])
+        result.append(["…", len(text) - keep_head - keep_tail])
+        if keep_tail:
+            result.append(["=", text[len(text) - keep_tail:]])
+    return result
+
+
+def diff_versions(db: Session, chapter_id: int, from_id: int, to_id: int) -> Optional[Dict]:
+    """Diff between two versions of a chapter; None if either isn't one of its versions.
+
+    One query on a cache hit (version metadata only), two on a miss.
+    """
+    versions = {
+        v.id: v for v in db.query(
+            models.ChapterVersion.id,
+            models.ChapterVersion.version_number,
+            models.ChapterVersion.content_hash,
+            models.ChapterVersion.created_at
+        ).filter(
+            models.ChapterVersion.chapter_id == chapter_id,
+            models.ChapterVersion.id.in_([from_id, to_id])
+        ).all()
+    }
+    if from_id not in versions or to_id not in versions:
+        return None
+    old, new = versions[from_id], versions[to_id]
+
+    key = (from_id, _fingerprint(old), to_id, _fingerprint(new))
+    result = diff_cache.get(key)
+    metrics.version_diff_cache_requests.inc(result=("hit" if result is not None else "miss"))
+    if result is None:
+        contents = {
+            v.id: version_content(v) for v in db.query(models.ChapterVersion).options(
+                joinedload(models.ChapterVersion.keyframe)
+            ).filter(models.ChapterVersion.id.in_([from_id, to_id])).all()
+        }
+        result = compute_diff(contents[from_id], contents[to_id])
+        diff_cache.put(key, result)
+
+    return {
+        "chapter_id": chapter_id,
+        "from": {"id": old.id, "version_number": old.version_number},
+        "to": {"id": new.id, "version_number": new.version_number},
+        **result,
+    }
@@ -0,0 +1,109 @@
+"""Chapter version storage: periodic full keyframes plus compressed deltas.
+
+Every VERSION_KEYFRAME_INTERVAL versions (or after a rewrite too large to
+delta) a version stores the full text. The ones in between store a
+zlib-compressed edit script against that keyframe, so any version is one
+keyframe plus one delta away. A snapshot identical to the latest version
+(content and notes) is not stored again.
+"""
+import hashlib
+import json
+import os
+import zlib
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session, joinedload
+
+from .. import models
+from . import text_diff
+
+KEYFRAME_INTERVAL = int(os.getenv("VERSION_KEYFRAME_INTERVAL", "20"))
+MAX_DELTA_RATIO = 0.5  # Store a keyframe instead when the delta is at least this fraction of the text
+
+# Deltas are computed over paragraphs, then sentences within changed paragraphs
+DELTA_LEVELS = [text_diff.paragraphs, text_diff.sentences]
+
+
+def version_hash(content: str, notes: Optional[str]) -> str:
+    return hashlib.sha256(f"{content}\0{notes or ''}".encode("utf-8")).hexdigest()
+
+
+def make_delta(base: str, text: str) -> bytes:
+    """Edit script turning `base` into `text`: [start, end] copies from base, strings are inserted"""
+    ops = []
+    for tag, base_start, base_end, start, end in text_diff.diff(base, text, DELTA_LEVELS):
+        if tag == "equal":
+            ops.append([base_start, base_end])
+        elif end > start:
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += text[start:end]
+            else:
+                ops.append(text[start:end])
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def apply_delta(base: str, delta: bytes) -> str:
+    return "".join(
+        op if isinstance(op, str) else base[op[0]:op[1]]
+        for op in json.loads(zlib.decompress(delta))
+    )
+
+
+def version_content(version: models.ChapterVersion) -> str:
+    """Full text of a version; load `keyframe` with it (joinedload) to avoid a second query"""
+    if version.delta is None:
+        return version.content
+    return apply_delta(version.keyframe.content, version.delta)
+
+
+def get_version(db: Session, version_id: int) -> Optional[models.ChapterVersion]:
+    return db.query(models.ChapterVersion).options(
+        joinedload(models.ChapterVersion.keyframe)
+    ).filter(models.ChapterVersion.id == version_id).first()
+
+
+def latest_version(db: Session, chapter_id: int) -> Optional[models.ChapterVersion]:
+    return db.query(models.ChapterVersion).options(
+        joinedload(models.ChapterVersion.keyframe)
+    ).filter(
+        models.ChapterVersion.chapter_id == chapter_id
+    ).order_by(models.ChapterVersion.version_number.desc()).first()
+
+
+def add_version(db: Session, chapter: models.Chapter,
+                change_summary: Optional[str] = None) -> Tuple[models.ChapterVersion, bool]:
+    """Snapshot the chapter's current text; returns (version, created).
+
+    If the latest version already holds the same content and notes, that
+    version is returned and nothing is added. The caller commits.
+    """
+    content = chapter.content or ""
+    content_hash = version_hash(content, chapter.notes)
+    latest = latest_version(db, chapter.id)
+    if latest is not None:
+        latest_hash = latest.content_hash or version_hash(version_content(latest), latest.notes)
+        if latest_hash == content_hash:
+            return latest, False
+
+    version = models.ChapterVersion(
+        chapter_id=chapter.id,
+        version_number=latest.version_number + 1 if latest else 1,
+        notes=chapter.notes,
+        word_count=chapter.word_count,
+        change_summary=change_summary,
+        content_hash=content_hash
+    )
+
+    keyframe = None
+    if latest is not None:
+        keyframe = latest if latest.delta is None else latest.keyframe
+    if keyframe is not None and version.version_number - keyframe.version_number < KEYFRAME_INTERVAL:
+        delta = make_delta(keyframe.content, content)
+        if len(delta) < MAX_DELTA_RATIO * len(content.encode("utf-8")):
+            version.keyframe_id = keyframe.id
+            version.delta = delta
+    if version.delta is None:
+        version.content = content
+
+    db.add(version)
+    return version, True
@@ -0,0 +1,66 @@
+"""Benchmark API cold start: importing app.main, then startup to the first response.
+
+Usage: python bench_import.py [runs]
+
+Each run is a fresh interpreter against a throwaway SQLite database, so
+nothing is warm but the OS file cache (the first run, which warms it, is
+not counted). Reports import time, startup (schema upgrade) plus one
+request, and which heavy libraries were loaded by then; the assistant
+and NER stacks should only load on first use, which is timed separately.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+HEAVY = ["langchain_core", "langchain_chroma", "langchain_anthropic", "langchain_voyageai", "chromadb", "spacy"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:  # Runs the lifespan (schema upgrade)
+    assert client.get("/").status_code == 200
+served = time.perf_counter()
+loaded = [name for name in HEAVY if name in sys.modules]
+import app.services.ai_assistant
+assistant = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_response": served - start,
+    "loaded": loaded,
+    "assistant_import": assistant - served,
+}))
+"""
+
+
+def run_once(database_dir: str) -> dict:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database_dir}/bench.db", "LOG_LEVEL": "WARNING"}
+    output = subprocess.run(
+        [sys.executable, "-c", f"HEAVY = {HEAVY!r}\n{CHILD}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        run_once(tmp)  # Warm the file cache; the database now exists, as on a restart
+        results = [run_once(tmp) for _ in range(RUNS)]
+
+    print(f"API cold start ({RUNS} runs, median)")
+    print(f"   import app.main:              {median([r['import'] for r in results]) * 1000:7.0f} ms")
+    print(f"   startup + first response:     {median([r['first_response'] for r in results]) * 1000:7.0f} ms")
+    print(f"   heavy modules loaded by then: {', '.join(results[-1]['loaded']) or 'none'}")
+    print(f"   deferred assistant import:    {median([r['assistant_import'] for r in results]) * 1000:7.0f} ms (on first use)")
@@ -0,0 +1,163 @@
+"""Benchmark entity mention storage: compact rows (offsets only) vs full rows (context text copied).
+
+Usage: python bench_mentions.py [chapters] [words_per_chapter]
+
+Runs the NER job over synthetic chapters once per layout (MENTION_STORAGE
+full, then compact), with a blank spaCy pipeline and an entity ruler so the
+parse is cheap and the job is mostly matching and writing. Reports the
+mentions table size, NER job time, the mention write alone (replaying each
+chapter's delete + insert) and GET /entities/{id}/mentions latency for
+every entity. The compact layout's responses are checked against the full one's.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+
+import spacy
+from sqlalchemy import insert, text
+
+from app import models
+from app.database import Base, engine, SessionLocal
+from app.routers.entities import get_entity_mentions
+from app.services import assistant_service, mentions, ner_service
+
+CHAPTERS = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+WORDS = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+LAYOUTS = ["full", "compact"]
+
+PEOPLE = [f"{first} {last}" for first in ("Elena", "Tomas", "Mira", "Owen", "Ada", "Silas", "Nora", "Felix")
+          for last in ("Marsh", "Vale", "Crane", "Holt", "Reed")]
+PLACES = ["Greyharbor", "Saltmere", "Ashford", "Northwatch", "Kestrel Bay", "Old Quay"]
+VOCABULARY = (
+    "the of and a to in was he she it that his her with as for had on at by not "
+    "rain wind harbor ship letter door lamp road night morning river stone bell map "
+    "quietly slowly remembered watched carried opened whispered followed waited argued"
+).split()
+
+
+def sentence(rng):
+    words = rng.choices(VOCABULARY, k=rng.randint(6, 14))
+    words.insert(rng.randrange(len(words)), rng.choice(PEOPLE))
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), rng.choice(PLACES))
+    text = " ".join(words)
+    return text[0].upper() + text[1:] + "."
+
+
+def chapter_text(rng):
+    sentences, words = [], 0
+    while words < WORDS:
+        sentences.append(sentence(rng))
+        words += len(sentences[-1].split())
+    return " ".join(sentences)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95)] * 1000, samples[-1] * 1000)
+
+
+def table_bytes(db):
+    """Pages used by the mentions table and its indexes"""
+    return db.execute(text(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+        "(SELECT name FROM sqlite_master WHERE tbl_name = 'entity_mentions')"
+    )).scalar()
+
+
+def run(layout, project_id, chapter_ids):
+    mentions.MENTION_STORAGE = layout
+    job_times = []
+    for chapter_id in chapter_ids:
+        start = time.perf_counter()
+        ner_service.process_chapter_ner(chapter_id, "en")
+        job_times.append(time.perf_counter() - start)
+
+    db = SessionLocal()
+    # The write alone: what each job does with a chapter's mentions once entities are matched
+    spans = {}
+    for entity_id, chapter_id, start, end in db.query(
+        models.EntityMention.entity_id, models.EntityMention.chapter_id,
+        models.EntityMention.start_pos, models.EntityMention.end_pos
+    ):
+        spans.setdefault(chapter_id, []).append((entity_id, start, end))
+    contents = dict(db.query(models.Chapter.id, models.Chapter.content))
+    write_times = []
+    for chapter_id in chapter_ids:
+        start = time.perf_counter()
+        db.query(models.EntityMention).filter(models.EntityMention.chapter_id == chapter_id).delete()
+        db.execute(insert(models.EntityMention), [
+            mentions.mention_row(entity_id, chapter_id, s, e, contents[chapter_id])
+            for entity_id, s, e in spans[chapter_id]
+        ])
+        db.commit()
+        write_times.append(time.perf_counter() - start)
+    db.close()
+
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    db = SessionLocal()
+    size = table_bytes(db)
+    count = db.query(models.EntityMention).count()
+    entity_ids = [entity_id for entity_id, in db.query(models.Entity.id).filter(models.Entity.project_id == project_id)]
+    db.close()
+
+    db = SessionLocal()
+    get_entity_mentions(entity_ids[0], db)  # Warm up after the VACUUM
+    db.close()
+    read_times, responses = [], {}
+    for entity_id in entity_ids:
+        db = SessionLocal()
+        start = time.perf_counter()
+        responses[entity_id] = get_entity_mentions(entity_id, db)
+        read_times.append(time.perf_counter() - start)
+        db.close()
+    return count, size, job_times, write_times, read_times, responses
+
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine)
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": name} for name in PEOPLE]
+                       + [{"label": "GPE", "pattern": place} for place in PLACES])
+    ner_service.nlp_en = nlp
+    assistant_service.sync_project_knowledge_base = lambda project_id: None  # Not what is measured
+
+    rng = random.Random(42)
+    db = SessionLocal()
+    project = models.Project(title="Mentions")
+    db.add(project)
+    db.flush()
+    chapters = []
+    for number in range(1, CHAPTERS + 1):
+        content = chapter_text(rng)
+        chapter = models.Chapter(project_id=project.id, chapter_number=number, content=content,
+                                 word_count=len(content.split()))
+        db.add(chapter)
+        chapters.append(chapter)
+    db.commit()
+    project_id, chapter_ids = project.id, [c.id for c in chapters]
+    db.close()
+
+    results = {layout: run(layout, project_id, chapter_ids) for layout in LAYOUTS}
+    full_responses = results["full"][-1]
+    for entity_id, response in results["compact"][-1].items():
+        assert response == full_responses[entity_id], f"entity {entity_id}: compact mentions differ"
+
+    count = results["full"][0]
+    print(f"Entity mentions: {CHAPTERS} chapters x ~{WORDS} words, {count} mentions, {len(full_responses)} entities")
+    print(f"   {'layout':8s} {'table':>9s} {'NER job p50':>12s} {'write p50':>10s} {'write p95':>10s} "
+          f"{'read p50':>9s} {'read p95':>9s} {'read max':>9s}")
+    for layout in LAYOUTS:
+        _, size, job_times, write_times, read_times, _ = results[layout]
+        job_p50 = percentiles(job_times)[0]
+        write_p50, write_p95, _ = percentiles(write_times)
+        read_p50, read_p95, read_max = percentiles(read_times)
+        print(f"   {layout:8s} {size / 1e6:6.2f} MB {job_p50:9.1f} ms {write_p50:7.1f} ms {write_p95:7.1f} ms "
+              f"{read_p50:6.1f} ms {read_p95:6.1f} ms {read_max:6.1f} ms")
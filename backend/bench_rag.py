@@ -0,0 +1,222 @@
+"""Benchmark the assistant's RAG pipeline end to end on a synthetic book.
+
+Usage: python bench_rag.py [chapter_count] [words_per_chapter]
+
+Chapters are seeded with the analysis NER would store (sentences and entity
+spans), so chunking is timed both ways. Stages: chunking, embedding, indexing (knowledge base build), retrieval
+(entity-first vs vector only) and answering. Runs offline against a
+throwaway SQLite database and vector store, with the hashing embedder and
+stub LLM unless EMBEDDING_BACKEND / LLM_BACKEND say otherwise, e.g.
+EMBEDDING_BACKEND=local to time a real CPU embedding model.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("EMBEDDING_CACHE", "0")
+
+import asyncio
+from pathlib import Path
+
+from app import models
+from app.database import Base, engine, SessionLocal
+from app.services.ai_assistant import CHUNK_OVERLAP, CHUNK_SIZE, StoryAssistant, make_text_splitter
+from app.services.chapter_analysis import content_hash, paragraph_spans, sentence_chunks
+from app.services.context_packing import estimate_tokens, pack_context
+
+CHAPTER_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+WORDS_PER_CHAPTER = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+QUESTIONS = 50
+
+CHARACTERS = [
+    ("Elena Marsh", ["Elena"]), ("Tomas Reyes", ["Tomas"]), ("Ada Quill", ["Ada", "the archivist"]),
+    ("Brother Hollis", ["Hollis"]), ("Mira Okafor", ["Mira"]), ("Captain Varo", ["Varo"]),
+    ("Old Wren", ["Wren"]), ("Juniper Hale", ["June"]),
+]
+PLACES = [("Greyharbor", []), ("the Salt Archive", []), ("Kestrel Pass", []), ("Lowmarket", [])]
+VOCABULARY = (
+    "the of and a to in was he she it that his her with as for had on at by not "
+    "rain wind harbor ship letter door lamp road night morning river stone bell map "
+    "quietly slowly remembered watched carried opened whispered followed waited argued"
+).split()
+
+
+def chapter_text(rng):
+    """Sentences of filler with entity names dropped in; returns (text, [(entity, start, end)], sentences)"""
+    parts, mentions, sentences, length, words = [], [], [], 0, 0
+    while words < WORDS_PER_CHAPTER:
+        sentence = rng.choices(VOCABULARY, k=rng.randint(8, 18))
+        if rng.random() < 0.35:
+            name, _ = rng.choice(CHARACTERS + PLACES)
+            sentence.insert(rng.randrange(len(sentence)), name)
+        words += len(sentence)
+        sentence = " ".join(sentence) + "."
+        sentence = sentence[0].upper() + sentence[1:]
+        for name, _ in CHARACTERS + PLACES:
+            position = sentence.find(name)
+            if position != -1:
+                mentions.append((name, length + position, length + position + len(name)))
+        separator = "\n\n" if rng.random() < 0.1 else " "
+        sentences.append([length, length + len(sentence)])
+        parts.append(sentence + separator)
+        length += len(sentence) + len(separator)
+    return "".join(parts), mentions, sentences
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    db = SessionLocal()
+    project = models.Project(title="Benchmark Book")
+    db.add(project)
+    db.flush()
+
+    entities = {}
+    for name, aliases in CHARACTERS + PLACES:
+        entity = models.Entity(
+            project_id=project.id, name=name, aliases=aliases,
+            entity_type="character" if (name, aliases) in CHARACTERS else "location",
+            description=f"{name} appears throughout the book."
+        )
+        db.add(entity)
+        entities[name] = entity
+    db.flush()
+
+    for number in range(1, CHAPTER_COUNT + 1):
+        text, mentions, sentences = chapter_text(rng)
+        chapter = models.Chapter(
+            project_id=project.id, chapter_number=number, title=f"Chapter {number}",
+            content=text, word_count=len(text.split())
+        )
+        db.add(chapter)
+        db.flush()
+        db.add_all([
+            models.EntityMention(
+                entity_id=entities[name].id, chapter_id=chapter.id, start_pos=start, end_pos=end,
+                context=text[max(start - 50, 0):end + 50], mentioned_as=name
+            )
+            for name, start, end in mentions
+        ])
+        db.add(models.ChapterAnalysis(
+            chapter_id=chapter.id, content_hash=content_hash(text), sentences=sentences,
+            paragraphs=[list(span) for span in paragraph_spans(text)],
+            entity_spans=[[start, end, entities[name].id] for name, start, end in mentions],
+            fingerprint="bench"
+        ))
+    db.commit()
+    project_id = project.id
+    db.close()
+    return project_id
+
+
+def questions(rng):
+    named = [f"What happens between {a[0]} and {b[0]}?" for a, b in
+             (rng.sample(CHARACTERS, 2) for _ in range(QUESTIONS // 2))]
+    generic = [f"Why does the {rng.choice(VOCABULARY[20:])} matter at night?" for _ in range(QUESTIONS - len(named))]
+    return named, generic
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return p50 * 1000, p95 * 1000
+
+
+def context_tokens(docs):
+    return sum(estimate_tokens(doc.page_content) for doc in docs)
+
+
+def time_retrieval(assistant, batch):
+    samples, raw_tokens, packed_tokens = [], [], []
+    for question in batch:
+        start = time.perf_counter()
+        docs = assistant.retrieve(question)
+        samples.append(time.perf_counter() - start)
+        raw_tokens.append(context_tokens(docs))
+        packed_tokens.append(context_tokens(pack_context(docs)))
+    p50, p95 = percentiles(samples)
+    return p50, p95, sum(raw_tokens) / len(batch), sum(packed_tokens) / len(batch)
+
+
+if __name__ == "__main__":
+    project_id = seed()
+    db = SessionLocal()
+
+    assistant = StoryAssistant(project_id=project_id)
+    assistant.persist_dir = Path(_tmp) / "vector_db"
+    print(f"RAG pipeline: {CHAPTER_COUNT} chapters x ~{WORDS_PER_CHAPTER} words, "
+          f"embeddings={os.environ['EMBEDDING_BACKEND']} ({assistant.embedding_model}), llm={os.environ['LLM_BACKEND']}")
+
+    analyses = {}
+    sources = list(assistant._source_documents(db, project_id, analyses).values())
+    characters = sum(len(doc.page_content) for doc in sources)
+    splitter = make_text_splitter()
+
+    start = time.perf_counter()
+    chunks = splitter.split_documents(sources)
+    elapsed = time.perf_counter() - start
+    print(f"   chunking:  {len(chunks):6d} chunks   {elapsed * 1000:8.1f} ms   "
+          f"{characters / elapsed / 1e6:6.1f} MB/s  (character splitter)")
+
+    start = time.perf_counter()
+    chunks = []
+    for doc in sources:
+        analysis = analyses.get(doc.metadata.get('chapter_id')) if doc.metadata['type'] == 'chapter' else None
+        if analysis:
+            chunks.extend(sentence_chunks(doc, analysis, CHUNK_SIZE, CHUNK_OVERLAP, splitter))
+        else:
+            chunks.extend(splitter.split_documents([doc]))
+    elapsed = time.perf_counter() - start
+    tagged = sum(1 for chunk in chunks if chunk.metadata.get('entity_ids'))
+    print(f"   chunking:  {len(chunks):6d} chunks   {elapsed * 1000:8.1f} ms   "
+          f"{characters / elapsed / 1e6:6.1f} MB/s  (sentences from NER analysis, {tagged} with entity ids)")
+
+    texts = [chunk.page_content for chunk in chunks]
+    start = time.perf_counter()
+    assistant.embeddings.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    print(f"   embedding: {len(texts):6d} chunks   {elapsed * 1000:8.1f} ms   {len(texts) / elapsed:8.0f} chunks/s")
+
+    start = time.perf_counter()
+    indexed = assistant.build_knowledge_base(db, project_id)
+    elapsed = time.perf_counter() - start
+    print(f"   indexing:  {indexed:6d} chunks   {elapsed * 1000:8.1f} ms   {indexed / elapsed:8.0f} chunks/s "
+          f"(split + embed + store)")
+
+    start = time.perf_counter()
+    assistant.sync_knowledge_base(db, project_id)
+    print(f"   no-op sync:                {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    named, generic = questions(random.Random(7))
+    entity_retriever = assistant.entity_retriever
+    print(f"   retrieval ({QUESTIONS // 2} questions each)    p50 ms    p95 ms   context tokens (raw -> packed)")
+    for label, batch, use_entities in (
+        ("named, entity-first", named, True),
+        ("named, vector only", named, False),
+        ("generic", generic, True),
+    ):
+        assistant.entity_retriever = entity_retriever if use_entities else None
+        p50, p95, raw, packed = time_retrieval(assistant, batch)
+        print(f"      {label:24s}  {p50:8.2f}  {p95:8.2f}  {raw:8.0f} -> {packed:.0f}")
+    assistant.entity_retriever = entity_retriever
+
+    async def answer_all():
+        samples = []
+        for question in named + generic:
+            start = time.perf_counter()
+            await assistant.aask(question, "Benchmark Book")
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    p50, p95 = percentiles(asyncio.run(answer_all()))
+    print(f"   answering (retrieval + LLM)     p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+
+    assistant.close()
+    db.close()
@@ -0,0 +1,124 @@
+"""Benchmark list_entities: ORM __dict__ spreading vs column tuples + orjson.
+
+Usage: python bench_serialization.py [entity_count]
+Runs against a throwaway SQLite database, no Postgres needed.
+"""
+import os
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+
+from typing import List
+from fastapi import FastAPI, APIRouter, Depends
+from fastapi.testclient import TestClient
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.database import Base, engine, get_db, SessionLocal
+from app.routers import entities
+
+ENTITY_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+ROUNDS = 10
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    project = models.Project(title="Benchmark")
+    db.add(project)
+    db.flush()
+    chapters = [
+        models.Chapter(project_id=project.id, chapter_number=i, content="x", word_count=1)
+        for i in range(1, 21)
+    ]
+    db.add_all(chapters)
+    db.flush()
+    db.add_all([
+        models.Entity(
+            project_id=project.id,
+            name=f"Entity {i}",
+            entity_type="character",
+            description=f"Description for entity {i}",
+            aliases=[f"E{i}", f"Ent {i}"]
+        )
+        for i in range(ENTITY_COUNT)
+    ])
+    db.flush()
+    entity_ids = [e for (e,) in db.query(models.Entity.id).all()]
+    db.add_all([
+        models.EntityMention(
+            entity_id=entity_id,
+            chapter_id=chapters[(entity_id + k) % len(chapters)].id,
+            start_pos=k,
+            end_pos=k + 5,
+            context="context",
+            mentioned_as="Entity"
+        )
+        for entity_id in entity_ids
+        for k in range(3)
+    ])
+    db.commit()
+    project_id = project.id
+    db.close()
+    return project_id
+
+
+# The handler as it was before the fast path, kept here for comparison
+legacy_router = APIRouter()
+
+@legacy_router.get("/{project_id}", response_model=List[schemas.EntityResponse])
+def legacy_list_entities(project_id: int, db: Session = Depends(get_db)):
+    results = db.query(
+        models.Entity,
+        func.count(models.EntityMention.id).label('mention_count'),
+        func.min(models.Chapter.chapter_number).label('first_appearance'),
+        func.max(models.Chapter.chapter_number).label('last_appearance')
+    ).select_from(models.Entity).outerjoin(
+        models.EntityMention,
+        models.Entity.id == models.EntityMention.entity_id
+    ).outerjoin(
+        models.Chapter,
+        models.EntityMention.chapter_id == models.Chapter.id
+    ).filter(models.Entity.project_id == project_id).group_by(models.Entity.id).all()
+
+    return [
+        {
+            **entity.__dict__,
+            'mention_count': count or 0,
+            'first_appearance': first,
+            'last_appearance': last
+        }
+        for entity, count, first, last in results
+    ]
+
+
+def timed(client, url):
+    client.get(url)  # warm-up
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        response = client.get(url)
+    elapsed = (time.perf_counter() - start) / ROUNDS
+    return elapsed, response
+
+
+if __name__ == "__main__":
+    project_id = seed()
+
+    app = FastAPI()
+    app.include_router(legacy_router, prefix="/legacy")
+    app.include_router(entities.router, prefix="/fast")
+    client = TestClient(app)
+
+    legacy_time, legacy_response = timed(client, f"/legacy/{project_id}")
+    fast_time, fast_response = timed(client, f"/fast/{project_id}")
+
+    assert legacy_response.json() == fast_response.json(), "payloads differ"
+
+    print(f"list_entities with {ENTITY_COUNT} entities ({ROUNDS} rounds)")
+    print(f"   legacy (__dict__ + response_model): {legacy_time * 1000:8.1f} ms")
+    print(f"   fast (columns + orjson):            {fast_time * 1000:8.1f} ms")
+    print(f"   speedup: {legacy_time / fast_time:.2f}x")
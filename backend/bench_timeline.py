@@ -0,0 +1,93 @@
+"""Benchmark the entity x chapter timeline against one mentions call per entity.
+
+Usage: python bench_timeline.py [chapters] [entities] [mentions]
+
+Fills a project with synthetic compact mentions (a few main characters
+mentioned everywhere, a long tail mentioned rarely), then times what a
+heatmap dashboard costs: GET /entities/{id}/mentions for every entity,
+the timeline endpoint uncached (grouped query + NumPy matrix), cached,
+and cached with top-N and chapter-range filters. The matrix is checked
+against counts taken from the per-entity responses.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+
+from sqlalchemy import insert
+
+from app import models
+from app.database import Base, engine, SessionLocal
+from app.routers.entities import get_entity_mentions
+from app.services.timeline import entity_timeline, timeline_cache
+
+CHAPTERS = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+ENTITIES = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+MENTIONS = int(sys.argv[3]) if len(sys.argv) > 3 else 200000
+RUNS = 20
+
+
+def timed(function, runs=RUNS):
+    samples = []
+    for _ in range(runs):
+        db = SessionLocal()
+        start = time.perf_counter()
+        result = function(db)
+        samples.append(time.perf_counter() - start)
+        db.close()
+    samples.sort()
+    return result, samples[len(samples) // 2] * 1000
+
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    db = SessionLocal()
+    project = models.Project(title="Timeline")
+    db.add(project)
+    db.flush()
+    chapters = [models.Chapter(project_id=project.id, chapter_number=n, title=f"Chapter {n}", content="x" * 20000)
+                for n in range(1, CHAPTERS + 1)]
+    entities = [models.Entity(project_id=project.id, name=f"Entity {i}", entity_type="character")
+                for i in range(ENTITIES)]
+    db.add_all(chapters + entities)
+    db.flush()
+    # Zipf-like: entity i is mentioned in proportion to 1 / (i + 1)
+    weights = [1 / (i + 1) for i in range(ENTITIES)]
+    rows = []
+    for entity in rng.choices(entities, weights=weights, k=MENTIONS):
+        start = rng.randrange(19990)
+        rows.append({"entity_id": entity.id, "chapter_id": rng.choice(chapters).id,
+                     "start_pos": start, "end_pos": start + 8})
+    db.execute(insert(models.EntityMention), rows)
+    db.commit()
+    project_id, entity_ids = project.id, [e.id for e in entities]
+    db.close()
+
+    per_entity, per_entity_ms = timed(lambda db: {i: get_entity_mentions(i, db) for i in entity_ids}, runs=3)
+
+    def uncached(db):
+        timeline_cache.clear()
+        return entity_timeline(db, project_id)
+
+    timeline, uncached_ms = timed(uncached)
+    _, cached_ms = timed(lambda db: entity_timeline(db, project_id))
+    _, filtered_ms = timed(lambda db: entity_timeline(db, project_id, top=20, from_chapter=10,
+                                                        to_chapter=40, sparse=True))
+
+    column_of = {c["id"]: j for j, c in enumerate(timeline["chapters"])}
+    for i, entity in enumerate(timeline["entities"]):
+        expected = [0] * CHAPTERS
+        for mention in per_entity[entity["id"]]:
+            expected[column_of[mention["chapter_id"]]] += 1
+        assert timeline["counts"][i] == expected, f"entity {entity['id']}: counts differ"
+
+    print(f"Entity timeline: {CHAPTERS} chapters, {ENTITIES} entities, {MENTIONS} mentions (median)")
+    print(f"   mentions call per entity ({ENTITIES} calls): {per_entity_ms:8.1f} ms")
+    print(f"   timeline, uncached:                 {uncached_ms:8.1f} ms")
+    print(f"   timeline, cached:                   {cached_ms:8.1f} ms")
+    print(f"   timeline, cached, top 20 of ch. 10-40, sparse: {filtered_ms:.1f} ms")
@@ -0,0 +1,126 @@
+"""Benchmark the NumPy memmap vector store against Chroma.
+
+Usage: python bench_vectorstore.py [sizes] [dim]
+       python bench_vectorstore.py 1000,10000,100000 384
+
+For each size, every store is built in a fresh process, then reopened in
+another fresh process to measure resident memory and query latency
+(similarity top-6 and MMR 6-of-20, as the assistant uses). Vectors are
+synthetic clusters; Linux only for the RSS numbers.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BATCH = 5000
+QUERIES = 200
+STORES = ["chroma", "numpy-float16", "numpy-int8"]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((64, dim)).astype(np.float32)
+    data = centroids[rng.integers(0, 64, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def store_factory(kind: str, dim: int):
+    """Import the store's modules up front so they don't count towards its memory"""
+    from app.services.ai_backends import HashingEmbeddings
+    embeddings = HashingEmbeddings(dim)  # Unused for by-vector search; stores need one
+    if kind == "chroma":
+        from langchain_chroma import Chroma
+        return lambda directory: Chroma(
+            collection_name="bench", embedding_function=embeddings, persist_directory=str(directory)
+        )
+    from app.services.numpy_vectorstore import NumpyVectorStore
+    return lambda directory: NumpyVectorStore(directory, embeddings, quantization=kind.split("-")[1])
+
+
+def build(kind: str, directory: Path, n: int, dim: int) -> dict:
+    store = store_factory(kind, dim)(directory)
+    data = vectors(n, dim)
+    start = time.perf_counter()
+    for i in range(0, n, BATCH):
+        batch = data[i:i + BATCH]
+        ids = [f"c{j}" for j in range(i, i + len(batch))]
+        texts = [f"chunk {j}" for j in range(i, i + len(batch))]
+        metadatas = [{"chapter_number": j % 40} for j in range(i, i + len(batch))]
+        if kind == "chroma":
+            store._collection.add(ids=ids, embeddings=batch.tolist(), documents=texts, metadatas=metadatas)
+        else:
+            store.add_embeddings(texts, batch, metadatas, ids)
+    return {"build_s": time.perf_counter() - start}
+
+
+def query(kind: str, directory: Path, n: int, dim: int) -> dict:
+    open_store = store_factory(kind, dim)
+    probes = vectors(QUERIES, dim, seed=2)
+    before = rss_mb()
+    start = time.perf_counter()
+    store = open_store(directory)
+    store.similarity_search_by_vector(vectors(1, dim, seed=1)[0].tolist(), k=6)  # First query loads the index
+    open_s = time.perf_counter() - start
+
+    timings = {"similarity": [], "mmr": []}
+    for probe in probes:
+        start = time.perf_counter()
+        store.similarity_search_by_vector(probe.tolist(), k=6)
+        timings["similarity"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        store.max_marginal_relevance_search_by_vector(probe.tolist(), k=6, fetch_k=20, lambda_mult=0.7)
+        timings["mmr"].append(time.perf_counter() - start)
+
+    disk = sum(f.stat().st_size for f in directory.rglob("*") if f.is_file())
+    return {
+        "open_s": open_s,
+        "rss_mb": rss_mb() - before,
+        "disk_mb": disk / 1e6,
+        "similarity_ms": float(np.median(timings["similarity"]) * 1000),
+        "mmr_ms": float(np.median(timings["mmr"]) * 1000),
+    }
+
+
+def run_worker(*args) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", *map(str, args)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        phase, kind, directory, n, dim = sys.argv[2:7]
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        result = (build if phase == "build" else query)(kind, Path(directory), int(n), int(dim))
+        print(json.dumps(result))
+        sys.exit(0)
+
+    sizes = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1000, 10000, 100000]
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+
+    print(f"Vector stores, dim={dim}, {QUERIES} queries each (median latency)")
+    print(f"{'chunks':>8} {'store':15} {'build s':>8} {'open s':>7} {'RSS MB':>7} {'disk MB':>8} "
+          f"{'top-6 ms':>9} {'MMR ms':>8}")
+    for n in sizes:
+        for kind in STORES:
+            with tempfile.TemporaryDirectory() as tmp:
+                built = run_worker("build", kind, tmp, n, dim)
+                measured = run_worker("query", kind, tmp, n, dim)
+            print(f"{n:8d} {kind:15} {built['build_s']:8.2f} {measured['open_s']:7.2f} {measured['rss_mb']:7.1f} "
+                  f"{measured['disk_mb']:8.1f} {measured['similarity_ms']:9.2f} {measured['mmr_ms']:8.2f}")
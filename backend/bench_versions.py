@@ -0,0 +1,167 @@
+"""Benchmark chapter version storage: keyframes + deltas vs full copies.
+
+Usage: python bench_versions.py [words] [versions] [keyframe_interval]
+
+Revises one synthetic chapter `versions` times (a few sentences replaced,
+inserted or deleted per revision, with an occasional restore of an older
+version), snapshotting after each revision the way create-version and
+restore-version do. Reports stored bytes against one full copy per version,
+the latency of rebuilding each version as get_version_content does, and
+the diff endpoint's paragraph-then-word diff against a flat word diff.
+Every rebuilt version is checked against the text that was saved.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+if len(sys.argv) > 3:
+    os.environ["VERSION_KEYFRAME_INTERVAL"] = sys.argv[3]
+
+from sqlalchemy import func
+
+from app import models
+from app.database import Base, engine, SessionLocal
+from app.services import text_diff, version_diff, version_store
+
+WORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+VERSIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+VOCABULARY = (
+    "the of and a to in was he she it that his her with as for had on at by not "
+    "rain wind harbor ship letter door lamp road night morning river stone bell map "
+    "quietly slowly remembered watched carried opened whispered followed waited argued"
+).split()
+
+
+def sentence(rng):
+    words = rng.choices(VOCABULARY, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def paragraphs(rng):
+    result, words = [], 0
+    while words < WORDS:
+        paragraph = [sentence(rng) for _ in range(rng.randint(3, 8))]
+        words += sum(len(s.split()) for s in paragraph)
+        result.append(paragraph)
+    return result
+
+
+def revise(rng, chapter):
+    for _ in range(rng.randint(1, 4)):
+        paragraph = rng.choice(chapter)
+        action = rng.random()
+        if action < 0.5:
+            paragraph[rng.randrange(len(paragraph))] = sentence(rng)
+        elif action < 0.8 or len(paragraph) < 2:
+            paragraph.insert(rng.randrange(len(paragraph) + 1), sentence(rng))
+        else:
+            del paragraph[rng.randrange(len(paragraph))]
+
+
+def render(chapter):
+    return "\n\n".join(" ".join(paragraph) for paragraph in chapter)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95)] * 1000, samples[-1] * 1000)
+
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    db = SessionLocal()
+    project = models.Project(title="Versions")
+    db.add(project)
+    db.flush()
+    text_paragraphs = paragraphs(rng)
+    chapter = models.Chapter(project_id=project.id, chapter_number=1, content=render(text_paragraphs))
+    db.add(chapter)
+    db.commit()
+
+    saved = {}  # version id -> text
+    history = {}  # version id -> paragraphs, for restores
+    write_times = []
+    skipped = 0
+    full = 0  # What one full copy per snapshot would store
+    for number in range(VERSIONS):
+        if history and rng.random() < 0.05:
+            # Restore: back up the current text, then go back to an older version
+            version, created = version_store.add_version(db, chapter, "Auto-backup")
+            full += len(chapter.content.encode("utf-8"))
+            skipped += not created
+            db.commit()
+            saved[version.id] = chapter.content
+            text_paragraphs = [list(p) for p in history[rng.choice(list(history))]]
+            chapter.content = render(text_paragraphs)
+        else:
+            revise(rng, text_paragraphs)
+            chapter.content = render(text_paragraphs)
+        chapter.word_count = len(chapter.content.split())
+
+        start = time.perf_counter()
+        version, created = version_store.add_version(db, chapter, f"Revision {number}")
+        db.commit()
+        write_times.append(time.perf_counter() - start)
+        full += len(chapter.content.encode("utf-8"))
+        skipped += not created
+        saved[version.id] = chapter.content
+        history[version.id] = [list(p) for p in text_paragraphs]
+
+    version, created = version_store.add_version(db, chapter)  # Unchanged: must be skipped
+    assert not created
+    db.rollback()
+
+    stored, keyframes, count = db.query(
+        func.sum(func.coalesce(func.length(models.ChapterVersion.content), 0)
+                 + func.coalesce(func.length(models.ChapterVersion.delta), 0)),
+        func.count(models.ChapterVersion.content),
+        func.count(models.ChapterVersion.id)
+    ).one()
+    size = len(chapter.content.split())
+    db.close()
+
+    read_times = []
+    for version_id, text in saved.items():
+        db = SessionLocal()
+        start = time.perf_counter()
+        content = version_store.version_content(version_store.get_version(db, version_id))
+        read_times.append(time.perf_counter() - start)
+        db.close()
+        assert content == text, f"version {version_id} rebuilt incorrectly"
+
+    print(f"Chapter versions: ~{size} words, {count} versions stored "
+          f"({keyframes} keyframes, interval {version_store.KEYFRAME_INTERVAL}), {skipped} identical snapshots skipped")
+    print(f"   full copies:        {full / 1e6:8.2f} MB")
+    print(f"   keyframes + deltas: {stored / 1e6:8.2f} MB   ({full / stored:.1f}x smaller)")
+    p50, p95, worst = percentiles(write_times)
+    print(f"   snapshot (diff + insert)     p50 {p50:6.2f} ms   p95 {p95:6.2f} ms   max {worst:6.2f} ms")
+    p50, p95, worst = percentiles(read_times)
+    print(f"   get version (query + patch)  p50 {p50:6.2f} ms   p95 {p95:6.2f} ms   max {worst:6.2f} ms")
+
+    ids = sorted(saved)
+    pairs = [(ids[i], ids[i + step]) for step in (1, 10) for i in range(0, len(ids) - step, max(1, len(ids) // 20))]
+    # A flat word diff is quadratic on a whole chapter: time it on one pair only. With the
+    # endpoint's budget (what a chapter without paragraph breaks gets) it stops early instead
+    for label, levels, sample, budget in (
+        ("paragraph, then word", version_diff.DIFF_LEVELS, pairs, None),
+        ("word only", [text_diff.words], pairs[-1:], None),
+        ("word only, budgeted", [text_diff.words], pairs[-1:], version_diff.DIFF_MAX_PAIRS),
+    ):
+        times = []
+        for old, new in sample:
+            start = time.perf_counter()
+            text_diff.diff(saved[old], saved[new], levels, text_diff.Budget(budget))
+            times.append(time.perf_counter() - start)
+        p50, p95, worst = percentiles(times)
+        print(f"   diff, {label:22s} p50 {p50:6.2f} ms   p95 {p95:6.2f} ms   max {worst:6.2f} ms")
+    old, new = pairs[-1]
+    result = version_diff.compute_diff(saved[old], saved[new])
+    size = len(str(version_diff.elide(result["ops"], 80)).encode("utf-8"))
+    print(f"   diff payload, 10 versions apart: {size / 1000:.1f} kB with context=80 "
+          f"(two full copies: {(len(saved[old]) + len(saved[new])) / 1000:.1f} kB)")
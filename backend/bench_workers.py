@@ -0,0 +1,124 @@
+"""Benchmark memory of a multi-worker deployment: spaCy model preloaded before
+forking (shared copy-on-write) vs loaded in every worker.
+
+Usage: python bench_workers.py [worker_counts] [synthetic_model_mb]
+       e.g. python bench_workers.py 1,2,4 400
+
+Starts gunicorn with gunicorn.conf.py for each worker count and each of
+NLP_PRELOAD=master / worker, waits until the workers settle, then sums
+RSS and PSS over the master and its workers (Linux, /proc/<pid>/smaps_rollup).
+RSS counts shared pages once per process; PSS splits them between the
+processes sharing them, so its total is what the deployment really uses.
+
+Uses SPACY_MODEL if set, else en_core_web_trf / en_core_web_sm if installed,
+else a synthetic blank pipeline with a vectors table of the given size.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+WORKER_COUNTS = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else "1,2,4").split(",")]
+SYNTHETIC_MB = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+MODES = ["master", "worker"]
+
+
+def spacy_model(tmp: str) -> str:
+    if os.getenv("SPACY_MODEL"):
+        return os.environ["SPACY_MODEL"]
+    import spacy
+    for name in ("en_core_web_trf", "en_core_web_sm"):
+        if spacy.util.is_package(name):
+            return name
+    import numpy as np
+    nlp = spacy.blank("en")
+    rows = SYNTHETIC_MB * 1024 * 1024 // (300 * 4)
+    data = np.random.default_rng(0).random((rows, 300), dtype=np.float32)
+    nlp.vocab.vectors = spacy.vectors.Vectors(data=data, keys=list(range(rows)))
+    path = os.path.join(tmp, "synthetic_model")
+    nlp.to_disk(path)
+    return path
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int):
+    result = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        result.append(int(entry))
+            except (OSError, IndexError):
+                pass
+    return result
+
+
+def memory(pid: int):
+    """(RSS, PSS) in MB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1]) / 1024
+    return values["Rss:"], values["Pss:"]
+
+
+def measure(model: str, mode: str, workers: int, tmp: str):
+    port = free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+        "SPACY_MODEL": model,
+        "NLP_PRELOAD": mode,
+        "WEB_CONCURRENCY": str(workers),
+        "BIND": f"127.0.0.1:{port}",
+        "LOG_LEVEL": "WARNING",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 180
+        last = None
+        while time.time() < deadline:
+            time.sleep(1)
+            pids = children(server.pid)
+            if len(pids) < workers:
+                continue
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+            except OSError:
+                continue
+            # Settled once the totals stop growing (workers may still be loading the model)
+            totals = [sum(values) for values in zip(*(memory(pid) for pid in [server.pid] + pids))]
+            if last and abs(totals[0] - last[0]) < 0.01 * totals[0]:
+                per_worker = [memory(pid)[0] for pid in pids]
+                return totals, sum(per_worker) / len(per_worker)
+            last = totals
+        raise RuntimeError(f"gunicorn ({mode}, {workers} workers) did not settle")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        model = spacy_model(tmp)
+        print(f"Worker memory with spaCy model {os.path.basename(model)}")
+        print(f"   {'preload':8s} {'workers':>7s} {'total RSS':>10s} {'total PSS':>10s} {'RSS/worker':>11s}")
+        for workers in WORKER_COUNTS:
+            for mode in MODES:
+                (rss, pss), per_worker = measure(model, mode, workers, tmp)
+                print(f"   {mode:8s} {workers:7d} {rss:8.0f} MB {pss:8.0f} MB {per_worker:8.0f} MB")
@@ -0,0 +1,55 @@
+"""Gunicorn settings for running the API with several worker processes.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+NLP_PRELOAD chooses where the spaCy model is loaded:
+
+    master (default)  once, before forking: workers share its memory copy-on-write
+    worker            in each worker as it starts (no sharing, no first-NER delay)
+    off               on the first NER job in each worker, as under plain uvicorn
+
+The schema upgrade runs once in the master instead of in every worker.
+Knowledge base caches stay per worker and notice each other's syncs (see
+services/assistant_service). Background builds and deletions record their
+progress under JOB_STATE_DIR, so any worker can answer a poll for them.
+"""
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+
+NLP_PRELOAD = os.getenv("NLP_PRELOAD", "master").lower()
+preload_app = NLP_PRELOAD == "master"
+
+# Workers skip the upgrade in their lifespan; when_ready has done it
+os.environ.setdefault("AUTO_MIGRATE", "0")
+
+
+def when_ready(server):
+    from app.database import engine
+    from app.migrations import upgrade
+
+    upgrade(engine)
+    engine.dispose()  # Don't hand pooled connections to forked workers
+
+    if NLP_PRELOAD == "master":
+        from app.services.ner_service import get_nlp
+
+        try:
+            get_nlp()
+        except Exception as e:
+            server.log.warning(f"spaCy model not preloaded, workers will load it on first use: {e}")
+            return
+        # Keep the collector from touching (and so copying) every preloaded object in each worker
+        gc.freeze()
+        server.log.info("Preloaded spaCy model for copy-on-write sharing")
+
+
+def post_worker_init(worker):
+    if NLP_PRELOAD == "worker":
+        from app.services.ner_service import get_nlp
+
+        get_nlp()
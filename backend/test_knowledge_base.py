@@ -0,0 +1,321 @@
+"""Knowledge base sync and assistant lifecycle tests, fully offline.
+
+Runs against a throwaway SQLite database with the hashing embedder, the
+stub LLM and the NumPy vector store:  pytest test_knowledge_base.py
+"""
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/knowledge_base.db"
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from app.services import ai_assistant, assistant_service, chapter_analysis, jobs
+from app.services.ai_backends import HashingEmbeddings, StubChatModel
+from app.services.answer_cache import answer_cache
+from app.services.assistant_cache import AssistantCache
+from app.services.concurrency import ConcurrencyLimiter
+from app.services.entity_retrieval import EntityRetriever
+from app.services.jobs import JobRegistry
+
+
+class FlakyEmbeddings(HashingEmbeddings):
+    """Fails on the `fail_on`-th embed_documents call (1-based), like a rate limit mid-sync; counts query embeds"""
+
+    def __init__(self, fail_on=None):
+        super().__init__(dim=64)
+        self.fail_on = fail_on
+        self.calls = 0
+        self.embedded = 0
+        self.queries = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError("rate limited")
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/kb.db", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def project_id(session_factory):
+    db = session_factory()
+    project = models.Project(title="Sync Test")
+    db.add(project)
+    db.flush()
+    for number in range(1, 4):
+        sentence = f"In chapter {number} the harbor bell rang while Elena watched the ships. "
+        db.add(models.Chapter(project_id=project.id, chapter_number=number, content=sentence * 120))
+    db.commit()
+    project_id = project.id
+    db.close()
+    return project_id
+
+
+@pytest.fixture
+def make_assistant(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Vector stores go under ./vector_db
+    monkeypatch.setattr(ai_assistant, "VECTOR_STORE", "numpy")
+    monkeypatch.setattr(ai_assistant, "EMBED_BATCH_SIZE", 4)
+
+    def make(project_id, embeddings):
+        return ai_assistant.StoryAssistant(project_id, embeddings=embeddings, llm=StubChatModel(),
+                                           embedding_model="test")
+    return make
+
+
+def chunk_count(assistant):
+    return len(assistant.vectorstore.get()["ids"])
+
+
+def test_sync_failure_leaves_no_half_written_source(session_factory, project_id, make_assistant):
+    db = session_factory()
+    try:
+        complete = make_assistant(project_id, FlakyEmbeddings())
+        expected = complete.build_knowledge_base(db, project_id)
+        complete.vectorstore.reset_collection()
+        complete.close()
+
+        flaky = make_assistant(project_id, FlakyEmbeddings(fail_on=2))
+        with pytest.raises(RuntimeError):
+            flaky.build_knowledge_base(db, project_id)
+        assert chunk_count(flaky) == 0
+        assert flaky.kb_version is None
+
+        # The next sync sees every source as missing and embeds all of them
+        flaky.embeddings.fail_on = None
+        assert flaky.sync_knowledge_base(db, project_id) == expected
+        assert chunk_count(flaky) == expected
+        assert flaky.sync_knowledge_base(db, project_id) == 0
+    finally:
+        db.close()
+
+
+def test_eviction_waits_for_assistants_in_use():
+    closed = []
+    cache = AssistantCache(max_entries=1, idle_ttl=3600, on_evict=closed.append)
+    first = cache.get_or_build(1, lambda: "assistant 1")
+    assert cache.acquire(1) is first
+    assert cache.acquire(1) is first  # A second request for the same project
+
+    cache.get_or_build(2, lambda: "assistant 2")  # LRU evicts project 1
+    assert 1 not in cache and closed == []
+    cache.release(first)
+    assert closed == []
+    cache.release(first)
+    assert closed == [first]
+
+    cache.pop(2)  # Not in use: closed right away
+    assert closed == [first, "assistant 2"]
+
+
+class FakeAssistant:
+    def __init__(self, project_id, kb_version):
+        self.project_id = project_id
+        self.kb_version = kb_version
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_stale_assistant_stays_open_while_in_use(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(assistant_service, "_assistant_cache", AssistantCache(
+        max_entries=4, idle_ttl=3600, on_evict=lambda assistant: assistant.close()))
+    stale = FakeAssistant(7, "v1")
+    assistant_service._publish_kb_version(stale)
+    assistant_service._assistant_cache.get_or_build(7, lambda: stale)
+    assert assistant_service.ready_assistant(7) is stale  # A request answering from it
+
+    # Another worker syncs the store; the next request here sees the new version
+    assistant_service._publish_kb_version(FakeAssistant(7, "v2"))
+    assert assistant_service.ready_assistant(7) is None
+    assert 7 not in assistant_service._assistant_cache and not stale.closed
+    assistant_service.release_assistant(stale)
+    assert stale.closed
+
+
+def test_paragraphs_of_editor_html():
+    html = "<p>The bell rang. Elena ran down to the harbor to watch the ships.</p><p></p><h2>Two</h2><p>Ships <em>left</em> at dawn.<br>Rain fell.</p>"
+    spans = chapter_analysis.paragraph_spans(html)
+    assert [html[start:end] for start, end in spans] == [
+        "The bell rang. Elena ran down to the harbor to watch the ships.", "Two", "Ships <em>left</em> at dawn.", "Rain fell."
+    ]
+
+    # Sentences here start on the tags before a paragraph's text; chunks still end at its break
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    sentences = [match.span() for match in re.finditer(r"[^.]+\.(?:</p>)?", html)]
+    analysis = models.ChapterAnalysis(sentences=sentences, paragraphs=spans, entity_spans=[])
+    chunks = chapter_analysis.sentence_chunks(Document(page_content=html), analysis, chunk_size=120,
+                                              chunk_overlap=0, splitter=RecursiveCharacterTextSplitter())
+    assert [chunk.page_content for chunk in chunks] == [html[:sentences[1][1]], html[sentences[1][1]:]]
+
+
+def test_streams_wait_for_the_ask_limits(session_factory, project_id, make_assistant, monkeypatch):
+    limiter = ConcurrencyLimiter(global_limit=1, per_key_limit=1)
+    monkeypatch.setattr(assistant_service, "_ask_limiter", limiter)
+    assistant = make_assistant(project_id, HashingEmbeddings(dim=64))
+    db = session_factory()
+    try:
+        assistant.build_knowledge_base(db, project_id)
+    finally:
+        db.close()
+
+    async def collect():
+        return [chunk async for chunk in assistant_service.stream_answer(assistant, "Who rang the bell?", "T")]
+
+    async def main():
+        async with limiter.limit(project_id):  # An /ask holding the only slot
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(collect(), timeout=0.2)
+        return await collect()
+
+    chunks = asyncio.run(main())
+    assert "sources" in chunks[0]
+    assert "".join(chunk["token"] for chunk in chunks[1:]).startswith('Stub answer to "Who rang the bell?"')
+    assistant.close()
+
+
+def test_stream_embeds_the_question_once(session_factory, project_id, make_assistant, monkeypatch):
+    monkeypatch.setattr(answer_cache, "similarity_threshold", 0.99)
+    assistant = make_assistant(project_id, FlakyEmbeddings())
+    db = session_factory()
+    try:
+        assistant.build_knowledge_base(db, project_id)
+    finally:
+        db.close()
+
+    async def collect():
+        return [chunk async for chunk in assistant_service.stream_answer(assistant, "Where are the ships?", "T")]
+
+    # The embedding looked up in the answer cache also drives retrieval
+    chunks = asyncio.run(collect())
+    assert "sources" in chunks[0] and assistant.embeddings.queries == 1
+    assistant.close()
+
+
+def test_job_status_is_seen_by_every_worker(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jobs, "JOB_STATE_DIR", tmp_path / "jobs")
+    monkeypatch.setattr(assistant_service, "_assistant_cache", AssistantCache(max_entries=4, idle_ttl=3600))
+    building, finish = threading.Event(), threading.Event()
+
+    def build(job):
+        job.report(1, 4)
+        building.set()
+        finish.wait(5)
+
+    worker = JobRegistry(max_workers=1, name="kb-build")
+    worker.submit(9, build)
+    assert building.wait(5)
+
+    # Polls answered by a worker that didn't start the build
+    monkeypatch.setattr(assistant_service, "_build_jobs", JobRegistry(max_workers=1, name="kb-build"))
+    status = assistant_service.knowledge_base_status(9)
+    assert status["status"] == "building" and status["build"]["done"] == 1
+    assert assistant_service._build_jobs.submit(9, lambda job: pytest.fail("built twice")).active
+
+    assistant_service._publish_kb_version(FakeAssistant(9, "v1"))
+    finish.set()
+    worker._executor.shutdown(wait=True)
+    status = assistant_service.knowledge_base_status(9)
+    assert (status["status"], status["kb_version"], status["build"]["state"]) == ("ready", "v1", "done")
+
+    deleting = JobRegistry(max_workers=1, name="project-delete")
+    deleting.submit(9, lambda job: job.report(1, 1))
+    deleting._executor.shutdown(wait=True)
+    assert JobRegistry(max_workers=1, name="project-delete").get(9).state == "done"
+    assert JobRegistry(max_workers=1, name="project-delete").get(10) is None
+
+
+def test_project_delete_stops_its_knowledge_base_build(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jobs, "JOB_STATE_DIR", tmp_path / "jobs")
+    monkeypatch.setattr(assistant_service, "_assistant_cache", AssistantCache(max_entries=4, idle_ttl=3600))
+    building = threading.Event()
+
+    def build(job):
+        # Writes the store batch by batch until told to stop
+        for done in range(1, 1000):
+            assistant_service.project_vector_dir(9).mkdir(parents=True, exist_ok=True)
+            building.set()
+            job.report(done, 1000)
+            time.sleep(0.01)
+
+    worker = JobRegistry(max_workers=1, name="kb-build")
+    worker.submit(9, build)
+    assert building.wait(5)
+
+    # Deleted through another worker
+    monkeypatch.setattr(assistant_service, "_build_jobs", JobRegistry(max_workers=1, name="kb-build"))
+    assistant_service.drop_knowledge_base(9)
+    assert worker.get(9).state == "cancelled"
+    assert not assistant_service.project_vector_dir(9).exists()
+
+    # A later build of a project with the same id is not cancelled
+    assert worker.submit(9, lambda job: job.report(1, 1)).active
+    worker._executor.shutdown(wait=True)
+    assert worker.get(9).state == "done"
+
+
+def test_finished_jobs_expire(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STATE_DIR", tmp_path / "jobs")
+    registry = JobRegistry(max_workers=1, name="kb-build")
+    registry.submit(9, lambda job: job.report(1, 1))
+    registry._executor.shutdown(wait=True)
+    assert JobRegistry(max_workers=1, name="kb-build").get(9).state == "done"
+
+    monkeypatch.setattr(jobs, "JOB_RETENTION_SECONDS", 0)
+    assert JobRegistry(max_workers=1, name="kb-build").get(9) is None
+    registry = JobRegistry(max_workers=1, name="kb-build")
+    registry.submit(10, lambda job: None)
+    registry._executor.shutdown(wait=True)
+    assert not (tmp_path / "jobs" / "kb-build" / "9.json").exists()
+
+def test_entity_passages_cover_the_whole_story(session_factory, monkeypatch):
+    monkeypatch.setattr(EntityRetriever, "MAX_MENTIONS", 40)
+    db = session_factory()
+    project = models.Project(title="Long Story")
+    db.add(project)
+    db.flush()
+    elena = models.Entity(project_id=project.id, name="Elena", entity_type="character")
+    db.add(elena)
+    paragraph = "Elena walked along the harbor wall. " + "The tide came in over the stones. " * 60
+    for number in range(1, 11):
+        chapter = models.Chapter(project_id=project.id, chapter_number=number, content=paragraph * 20)
+        db.add(chapter)
+        db.flush()
+        db.add_all([models.EntityMention(entity_id=elena.id, chapter_id=chapter.id,
+                                         start_pos=i * len(paragraph), end_pos=i * len(paragraph) + 5)
+                    for i in range(20)])
+    db.commit()
+
+    retriever = EntityRetriever(session_factory=session_factory, max_passages=4)
+    retriever.load(db, project.id, {})
+    db.close()
+    # Every chapter mentions her 20 times; the first 40 mentions alone are chapters 1 and 2
+    chapters = [doc.metadata["chapter_number"] for doc in retriever.retrieve("What does Elena do?", limit=4)]
+    assert len(set(chapters)) == 4 and max(chapters) > 5
@@ -0,0 +1,368 @@
+"""Query-count budgets for every API endpoint (N+1 regression tests).
+
+Runs against a throwaway SQLite database:  pytest test_query_budgets.py
+
+Each endpoint is exercised on a small and a larger project. Its statement
+count (from the X-Query-Count debug header) must stay within the budget on
+both, so a query issued per row shows up as a failure on the larger one.
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/query_budgets.db"
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models, main
+from app.database import Base, get_db
+from app.routers import chapters as chapters_router
+from app.services import project_delete, version_diff
+from app.services.annotations import annotation_cache
+from app.services.timeline import timeline_cache
+from app.services.query_stats import instrument_engine
+
+SIZES = {"small": (2, 3), "large": (6, 12)}  # (chapters, entities)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path}/budget.db",
+        connect_args={"check_same_thread": False}
+    )
+    instrument_engine(engine)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def client(session_factory, monkeypatch):
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    monkeypatch.setattr(main, "DEBUG_QUERY_HEADERS", True)
+    # NER has its own job-level accounting; keep it out of request budgets
+    monkeypatch.setattr(chapters_router, "schedule_chapter_ner", lambda *args, **kwargs: None)
+    # Test project ids would match real projects' vector store directories
+    monkeypatch.setattr(project_delete, "drop_knowledge_base", lambda project_id: None)
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    monkeypatch.delenv("VOYAGE_API_KEY", raising=False)
+    main.app.dependency_overrides[get_db] = override_get_db
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture(params=list(SIZES))
+def project(request, session_factory):
+    chapter_count, entity_count = SIZES[request.param]
+    db = session_factory()
+    project = models.Project(title="Budget Test", description="A test project")
+    db.add(project)
+    db.flush()
+
+    chapters = []
+    for number in range(1, chapter_count + 1):
+        chapter = models.Chapter(
+            project_id=project.id,
+            chapter_number=number,
+            title=f"Chapter {number}",
+            content=f"Harry met Hermione in chapter {number}. " * 20,
+            word_count=120
+        )
+        db.add(chapter)
+        chapters.append(chapter)
+    db.flush()
+
+    for chapter in chapters:
+        for version_number in (1, 2):
+            db.add(models.ChapterVersion(
+                chapter_id=chapter.id,
+                version_number=version_number,
+                content=chapter.content,
+                word_count=chapter.word_count
+            ))
+
+    entities = []
+    for i in range(entity_count):
+        entity = models.Entity(
+            project_id=project.id,
+            name=f"Harry {i}" if i % 2 else f"Hermione {i}",
+            entity_type="character",
+            aliases=[f"H{i}"]
+        )
+        db.add(entity)
+        entities.append(entity)
+    db.flush()
+
+    for entity in entities:
+        for chapter in chapters:
+            db.add(models.EntityMention(
+                entity_id=entity.id,
+                chapter_id=chapter.id,
+                start_pos=0,
+                end_pos=5,
+                context="Harry met Hermione",
+                mentioned_as="Harry"
+            ))
+    db.commit()
+
+    ids = {
+        "project": project.id,
+        "chapter": chapters[0].id,
+        "chapters": [c.id for c in chapters],
+        "entity": entities[0].id,
+        "entities": [e.id for e in entities],
+        "versions": [v.id for v in db.query(models.ChapterVersion.id).filter(
+            models.ChapterVersion.chapter_id == chapters[0].id
+        ).order_by(models.ChapterVersion.id)],
+    }
+    ids["version"] = ids["versions"][0]
+    db.close()
+    return ids
+
+
+def assert_budget(response, budget, status=200):
+    assert response.status_code == status, response.text
+    count = int(response.headers["X-Query-Count"])
+    assert count <= budget, f"{count} queries, budget is {budget}"
+
+
+# Projects
+
+def test_create_project(client):
+    assert_budget(client.post("/api/projects/", json={"title": "New"}), 2)
+
+
+def test_list_projects(client, project):
+    assert_budget(client.get("/api/projects/"), 1)
+
+
+def test_get_project(client, project):
+    assert_budget(client.get(f"/api/projects/{project['project']}"), 1)
+
+
+def test_delete_project(client, project, session_factory):
+    # Size check, then one DELETE; the database cascades to everything else
+    assert_budget(client.delete(f"/api/projects/{project['project']}"), 2)
+    db = session_factory()
+    try:
+        for model in (models.Chapter, models.ChapterVersion, models.Entity, models.EntityMention):
+            assert db.query(model).count() == 0
+    finally:
+        db.close()
+
+
+# Chapters
+
+def test_create_chapter(client, project):
+    response = client.post(
+        f"/api/chapters/{project['project']}",
+        json={"chapter_number": 99, "content": "Some new text"}
+    )
+    assert_budget(response, 3)
+
+
+def test_list_chapters(client, project):
+    assert_budget(client.get(f"/api/chapters/{project['project']}"), 1)
+
+
+def test_get_chapter(client, project):
+    assert_budget(client.get(f"/api/chapters/single/{project['chapter']}"), 1)
+
+
+def test_update_chapter(client, project):
+    response = client.put(f"/api/chapters/{project['chapter']}", json={"content": "Rewritten"})
+    assert_budget(response, 3)
+
+
+def test_patch_chapter(client, project):
+    # Read content and revision, then a conditional UPDATE
+    response = client.patch(f"/api/chapters/{project['chapter']}", json={
+        "base_revision": 0,
+        "edits": [{"offset": 0, "delete": 0, "insert": "Edited. "}]
+    })
+    assert_budget(response, 2)
+    assert response.json()["revision"] == 1
+
+
+def test_patch_chapter_stale_revision(client, project):
+    edit = {"offset": 0, "delete": 0, "insert": "Edited. "}
+    client.patch(f"/api/chapters/{project['chapter']}", json={"base_revision": 0, "edits": [edit]})
+    response = client.patch(f"/api/chapters/{project['chapter']}", json={"base_revision": 0, "edits": [edit]})
+    assert_budget(response, 1, status=409)
+    assert response.json()["detail"]["revision"] == 1
+
+
+def test_patch_chapter_edit_out_of_range(client, project):
+    response = client.patch(f"/api/chapters/{project['chapter']}", json={
+        "base_revision": 0,
+        "edits": [{"offset": 10000, "delete": 1, "insert": ""}]
+    })
+    assert_budget(response, 1, status=422)
+    assert client.get(f"/api/chapters/single/{project['chapter']}").json()["revision"] == 0
+
+
+def test_delete_chapter(client, project):
+    # Versions, mentions and analysis go with it (ON DELETE CASCADE)
+    assert_budget(client.delete(f"/api/chapters/{project['chapter']}"), 2)
+
+
+def test_chapter_versions(client, project):
+    assert_budget(client.get(f"/api/chapters/{project['chapter']}/versions"), 1)
+
+
+def test_version_content(client, project):
+    assert_budget(client.get(f"/api/chapters/version/{project['version']}"), 1)
+
+
+def test_version_diff(client, project):
+    first, second = project["versions"]
+    url = f"/api/chapters/{project['chapter']}/diff?from={first}&to={second}"
+    assert_budget(client.get(url), 2)
+    assert_budget(client.get(url), 1)  # Cached: version metadata only
+
+
+def test_version_diff_budget(monkeypatch):
+    # One long paragraph: past the budget the changed block is shown whole instead of word by word
+    old = " ".join(f"word{i}" for i in range(1000))
+    new = old.replace("word500", "changed", 1) + " the end"
+    assert not version_diff.compute_diff(old, new)["coarse"]
+    monkeypatch.setattr(version_diff, "DIFF_MAX_PAIRS", 1000)
+    result = version_diff.compute_diff(old, new)
+    assert result["coarse"]
+    assert "".join(text for op, text in result["ops"] if op != "-") == new
+    assert "".join(text for op, text in result["ops"] if op != "+") == old
+
+
+def test_chapter_annotations(client, project):
+    annotation_cache.clear()  # Chapter ids and revisions repeat across test databases
+    url = f"/api/chapters/{project['chapter']}/annotations"
+    assert_budget(client.get(url), 2)
+    response = client.get(url)
+    assert_budget(response, 1)  # Cached: the chapter's revisions only
+    annotations = response.json()
+    assert len(annotations["starts"]) == len(annotations["ends"]) == len(project["entities"])
+    assert sorted(e["id"] for e in annotations["entities"]) == sorted(project["entities"])
+
+
+def test_create_version(client, project):
+    response = client.post(f"/api/chapters/{project['chapter']}/create-version")
+    assert_budget(response, 4)
+
+
+def test_restore_version(client, project):
+    response = client.post(
+        f"/api/chapters/{project['chapter']}/restore-version/{project['version']}"
+    )
+    assert_budget(response, 5)
+
+
+# Entities
+
+def test_list_entities(client, project):
+    assert_budget(client.get(f"/api/entities/{project['project']}"), 1)
+
+
+def test_entity_mentions(client, project):
+    assert_budget(client.get(f"/api/entities/{project['entity']}/mentions"), 1)
+
+
+def test_entity_mentions_compact(client, project, session_factory):
+    db = session_factory()
+    db.query(models.EntityMention).update({"context": None, "mentioned_as": None})
+    db.commit()
+    db.close()
+    # One more query loads the content of every chapter involved, however many mentions
+    response = client.get(f"/api/entities/{project['entity']}/mentions")
+    assert_budget(response, 2)
+    assert {(m["mentioned_as"], m["context"][:9]) for m in response.json()} == {("Harry", "Harry met")}
+
+
+def test_entity_mentions_after_edit(client, project, session_factory):
+    db = session_factory()
+    db.query(models.EntityMention).update({"context": None, "mentioned_as": None})
+    db.commit()
+    db.close()
+    client.put(f"/api/chapters/{project['chapter']}", json={"content": "Rewritten without anyone in it"})
+    # Until NER runs again the edited chapter's offsets point into text that is gone
+    response = client.get(f"/api/entities/{project['entity']}/mentions")
+    assert_budget(response, 2)
+    assert project["chapter"] not in {m["chapter_id"] for m in response.json()}
+    assert {m["mentioned_as"] for m in response.json()} == {"Harry"}
+    annotation_cache.clear()
+    assert client.get(f"/api/chapters/{project['chapter']}/annotations").json()["starts"] == []
+
+
+def test_entity_timeline(client, project):
+    timeline_cache.clear()  # Project and chapter ids repeat across test databases
+    url = f"/api/entities/{project['project']}/timeline"
+    response = client.get(url)
+    assert_budget(response, 2)
+    timeline = response.json()
+    assert timeline["counts"] == [[1] * len(project["chapters"])] * len(project["entities"])
+    # Filters slice the cached matrix: chapter list only
+    response = client.get(url, params={"top": 2, "from_chapter": 2, "to_chapter": 2, "format": "sparse"})
+    assert_budget(response, 1)
+    timeline = response.json()
+    assert [c["chapter_number"] for c in timeline["chapters"]] == [2]
+    assert (timeline["entity"], timeline["chapter"], timeline["counts"]) == ([0, 1], [0, 0], [1, 1])
+
+
+def test_update_entity(client, project):
+    response = client.put(f"/api/entities/{project['entity']}", json={"description": "Wizard"})
+    assert_budget(response, 4)
+
+
+def test_delete_entity(client, project):
+    # Its chapters' mentions_revision is bumped (annotation caches), then one DELETE
+    assert_budget(client.delete(f"/api/entities/{project['entity']}"), 3)
+
+
+def test_merge_entities(client, project):
+    keep, *merge = project["entities"][:3]
+    response = client.post("/api/entities/merge", params={"keep_id": keep}, json=merge)
+    assert_budget(response, 7)
+
+
+def test_find_duplicates(client, project):
+    assert_budget(client.get(f"/api/entities/duplicates/{project['project']}"), 1)
+
+
+def test_relationships(client, project):
+    assert_budget(client.get(f"/api/entities/{project['project']}/relationships"), 1)
+
+
+@pytest.mark.parametrize("export_format", ["json", "markdown"])
+def test_export(client, project, export_format):
+    response = client.get(f"/api/entities/{project['project']}/export", params={"format": export_format})
+    assert_budget(response, 3)
+
+
+def test_search(client, project):
+    response = client.get(f"/api/entities/{project['project']}/search", params={"query": "Harry"})
+    assert_budget(response, 2)
+
+
+# Assistant (no API keys here, so only the pre-flight work is measured)
+
+def test_ask_without_keys(client, project):
+    response = client.post(f"/api/assistant/{project['project']}/ask", json={"question": "Who is Harry?"})
+    assert_budget(response, 1, status=400)
+
+
+def test_rebuild_kb_without_keys(client, project):
+    response = client.post(f"/api/assistant/{project['project']}/rebuild-kb")
+    assert_budget(response, 1, status=400)
+
+
+def test_assistant_status(client, project):
+    assert_budget(client.get(f"/api/assistant/{project['project']}/status"), 1)
@@ -22,7 +22,9 @@ export default function AIAssistant({ projectId }) {
   });
 
   const rebuildMutation = useMutation({
-    mutationFn: () => api.rebuildKnowledgeBase(projectId),
+    // The rebuild runs in the background; resolve once it has finished
+    mutationFn: () => api.rebuildKnowledgeBase(projectId)
+      .then(() => api.waitForKnowledgeBase(projectId)),
     onSuccess: () => {
       alert('Knowledge base rebuilt! The assistant now has the latest information.');
     }
@@ -7,6 +7,21 @@ import AIAssistant from './AIAssistant';
 import RichTextEditor from './RichTextEditor';
 import VersionHistory from './VersionHistory';
 
+// One range edit (in code points, as the server counts) turning oldText into newText
+function diffEdit(oldText, newText) {
+  const a = Array.from(oldText);
+  const b = Array.from(newText);
+  let start = 0;
+  while (start < a.length && start < b.length && a[start] === b[start]) start++;
+  let end = 0;
+  while (end < a.length - start && end < b.length - start && a[a.length - 1 - end] === b[b.length - 1 - end]) end++;
+  return {
+    offset: start,
+    delete: a.length - start - end,
+    insert: b.slice(start, b.length - end).join('')
+  };
+}
+
 export default function ChapterEditor() {
   const { projectId } = useParams();
   const queryClient = useQueryClient();
@@ -63,11 +78,22 @@ export default function ChapterEditor() {
   });
 
   const updateChapterMutation = useMutation({
-    mutationFn: ({ chapterId, data }) => api.updateChapter(chapterId, data),
-    onSuccess: async () => {
-      queryClient.invalidateQueries(['chapter', selectedChapter]);
+    // Content-only changes send just the changed range; anything else sends the full chapter
+    mutationFn: ({ chapterId, data, edit, baseRevision }) => edit
+      ? api.patchChapter(chapterId, baseRevision, [edit])
+      : api.updateChapter(chapterId, { ...data, base_revision: baseRevision }),
+    onSuccess: (res, { chapterId, data, edit }) => {
+      // PUT returns the chapter; PATCH only its new revision, so fill in the text we sent
+      // (no refetch: that would download the whole chapter again after every save)
+      queryClient.setQueryData(['chapter', chapterId], (chapter) => edit
+        ? { ...chapter, content: data.content, revision: res.data.revision, word_count: res.data.word_count }
+        : res.data);
       queryClient.invalidateQueries(['chapters', projectId]);
-
+    },
+    onError: (error) => {
+      if (error.response?.status === 409) {
+        alert('This chapter was changed somewhere else since you opened it. Copy your changes and reload it before saving.');
+      }
     }
   });
 
@@ -80,10 +106,13 @@ export default function ChapterEditor() {
   });
 
   const handleSave = () => {
-    if (selectedChapter) {
+    if (selectedChapter && chapterDetail) {
+      const contentOnly = notes === (chapterDetail.notes || '');
       updateChapterMutation.mutate({
         chapterId: selectedChapter,
-        data: { content, notes }
+        data: { content, notes },
+        edit: contentOnly ? diffEdit(chapterDetail.content || '', content) : null,
+        baseRevision: chapterDetail.revision
       });
     }
   };
@@ -31,7 +31,19 @@ export default function ProjectList() {
   });
 
   const deleteMutation = useMutation({
-    mutationFn: api.deleteProject,
+    // Large projects are deleted in the background (202): wait for the job to finish
+    mutationFn: async (projectId) => {
+      const res = await api.deleteProject(projectId);
+      let deletion = res.data.deletion;
+      while (res.status === 202 && deletion && (deletion.state === 'queued' || deletion.state === 'running')) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        deletion = (await api.getProjectDeletion(projectId)).data;
+      }
+      if (deletion?.state === 'failed') {
+        throw new Error(deletion.error);
+      }
+      return res;
+    },
     onSuccess: () => {
       queryClient.invalidateQueries(['projects']);
     }
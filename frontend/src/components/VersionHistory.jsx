@@ -2,10 +2,22 @@ import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { api } from '../services/api';
 import { useState } from 'react';
 
+// Diff text may contain editor HTML; show it as plain text with paragraph breaks
+const diffText = (text) => text
+  .replace(/<\/(p|h[1-6]|li|blockquote|div|pre)>|<br\s*\/?>/gi, '\n')
+  .replace(/<[^>]*>/g, '');
+
+const DIFF_STYLES = {
+  '=': { color: '#555' },
+  '-': { backgroundColor: '#fdecea', color: '#b71c1c', textDecoration: 'line-through' },
+  '+': { backgroundColor: '#e8f5e9', color: '#1b5e20' },
+};
+
 export default function VersionHistory({ chapterId }) {
   const queryClient = useQueryClient();
   const [selectedVersion, setSelectedVersion] = useState(null);
   const [isOpen, setIsOpen] = useState(false);
+  const [showChanges, setShowChanges] = useState(false);
 
   const { data: versions } = useQuery({
     queryKey: ['versions', chapterId],
@@ -25,6 +37,20 @@ export default function VersionHistory({ chapterId }) {
     enabled: !!selectedVersion
   });
 
+  // Versions are listed newest first, so the previous version is the next entry
+  const selectedIndex = versions?.findIndex((v) => v.id === selectedVersion) ?? -1;
+  const previousVersion = selectedIndex >= 0 ? versions[selectedIndex + 1] : null;
+
+  const { data: versionDiff, isLoading: diffLoading } = useQuery({
+    queryKey: ['version-diff', chapterId, previousVersion?.id, selectedVersion],
+    queryFn: async () => {
+      const res = await api.getVersionDiff(chapterId, previousVersion.id, selectedVersion);
+      return res.data;
+    },
+    enabled: showChanges && !!previousVersion,
+    staleTime: Infinity  // Versions never change
+  });
+
   const createVersionMutation = useMutation({
     mutationFn: ({ summary }) => api.createChapterVersion(chapterId, summary),
     onSuccess: () => {
@@ -150,7 +176,7 @@ export default function VersionHistory({ chapterId }) {
                   cursor: 'pointer',
                   transition: 'all 0.2s'
                 }}
-                onClick={() => setSelectedVersion(version.id)}
+                onClick={() => { setSelectedVersion(version.id); setShowChanges(false); }}
                 onMouseEnter={(e) => e.target.style.backgroundColor = '#f9f9f9'}
                 onMouseLeave={(e) => e.target.style.backgroundColor = 'white'}
               >
@@ -232,6 +258,23 @@ export default function VersionHistory({ chapterId }) {
                   {restoreMutation.isLoading ? 'Restoring...' : '↶ Restore This Version'}
                 </button>
 
+                {previousVersion && (
+                  <button
+                    onClick={() => setShowChanges(!showChanges)}
+                    style={{
+                      width: '100%',
+                      padding: '8px',
+                      marginBottom: '15px',
+                      backgroundColor: '#f0f0f0',
+                      border: '1px solid #ddd',
+                      borderRadius: '4px',
+                      cursor: 'pointer'
+                    }}
+                  >
+                    {showChanges ? 'Show full text' : `Show changes since version ${previousVersion.version_number}`}
+                  </button>
+                )}
+
                 <div style={{
                   padding: '15px',
                   border: '1px solid #ddd',
@@ -243,7 +286,29 @@ export default function VersionHistory({ chapterId }) {
                   lineHeight: '1.6',
                   fontFamily: 'Georgia, serif'
                 }}>
-                  <div dangerouslySetInnerHTML={{ __html: versionContent.content }} />
+                  {showChanges ? (
+                    diffLoading || !versionDiff ? (
+                      <p style={{ color: '#666' }}>Comparing versions...</p>
+                    ) : (
+                      <>
+                        <div style={{ fontSize: '12px', color: '#666', marginBottom: '10px' }}>
+                          +{versionDiff.words_added} / -{versionDiff.words_removed} words
+                          {versionDiff.coarse && ' (some long passages are too large to compare word by word)'}
+                        </div>
+                        <div style={{ whiteSpace: 'pre-wrap' }}>
+                          {versionDiff.ops.map(([op, value], i) => op === '…' ? (
+                            <div key={i} style={{ color: '#999', textAlign: 'center', margin: '8px 0' }}>
+                              ⋯ {value} unchanged characters ⋯
+                            </div>
+                          ) : (
+                            <span key={i} style={DIFF_STYLES[op]}>{diffText(value)}</span>
+                          ))}
+                        </div>
+                      </>
+                    )
+                  ) : (
+                    <div dangerouslySetInnerHTML={{ __html: versionContent.content }} />
+                  )}
                 </div>
 
                 {versionContent.notes && (
@@ -8,13 +8,19 @@ export const api = {
   createProject: (data) => axios.post(`${API_BASE}/projects/`, data),
   getProject: (id) => axios.get(`${API_BASE}/projects/${id}`),
   deleteProject: (id) => axios.delete(`${API_BASE}/projects/${id}`),
+  getProjectDeletion: (id) => axios.get(`${API_BASE}/projects/${id}/deletion`),
 
   // Chapters
   getChapters: (projectId) => axios.get(`${API_BASE}/chapters/${projectId}`),
   createChapter: (projectId, data) => axios.post(`${API_BASE}/chapters/${projectId}`, data),
   getChapter: (chapterId) => axios.get(`${API_BASE}/chapters/single/${chapterId}`),
   updateChapter: (chapterId, data) => axios.put(`${API_BASE}/chapters/${chapterId}`, data),
+  patchChapter: (chapterId, baseRevision, edits) => axios.patch(`${API_BASE}/chapters/${chapterId}`, {
+    base_revision: baseRevision,
+    edits
+  }),
   deleteChapter: (chapterId) => axios.delete(`${API_BASE}/chapters/${chapterId}`),
+  getChapterAnnotations: (chapterId) => axios.get(`${API_BASE}/chapters/${chapterId}/annotations`),
 
   // Entities
   getEntities: (projectId, entityType) => {
@@ -22,6 +28,8 @@ export const api = {
     return axios.get(`${API_BASE}/entities/${projectId}${params}`);
   },
   getEntityMentions: (entityId) => axios.get(`${API_BASE}/entities/${entityId}/mentions`),
+  getEntityTimeline: (projectId, params = {}) =>
+    axios.get(`${API_BASE}/entities/${projectId}/timeline`, { params }),
   updateEntity: (entityId, data) => axios.put(`${API_BASE}/entities/${entityId}`, data),
   deleteEntity: (entityId) => axios.delete(`${API_BASE}/entities/${entityId}`),
   findDuplicates: (projectId) => axios.get(`${API_BASE}/entities/duplicates/${projectId}`),
@@ -30,17 +38,73 @@ export const api = {
   }),
 
   // AI Assistant
-  askAssistant: (projectId, question, rebuildKb = false) => 
-    axios.post(`${API_BASE}/assistant/${projectId}/ask`, { 
+  // A 202 means the knowledge base is still building; wait for it, then ask again
+  askAssistant: async (projectId, question, rebuildKb = false) => {
+    const response = await axios.post(`${API_BASE}/assistant/${projectId}/ask`, { 
       question, 
       rebuild_kb: rebuildKb 
-    }),
+    });
+    if (response.status !== 202) return response;
+    await api.waitForKnowledgeBase(projectId);
+    return api.askAssistant(projectId, question);
+  },
+  getAssistantStatus: (projectId) => axios.get(`${API_BASE}/assistant/${projectId}/status`),
+  waitForKnowledgeBase: async (projectId, intervalMs = 1000) => {
+    for (;;) {
+      const { data } = await api.getAssistantStatus(projectId);
+      if (data.status === 'ready') return data;
+      if (data.status !== 'building') {
+        throw new Error(data.error || `Knowledge base is ${data.status}`);
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  },
+  // Streams server-sent events: onSources(sources) once, then onToken(text) per chunk
+  askAssistantStream: async (projectId, question, { onSources, onToken } = {}) => {
+    const response = await fetch(`${API_BASE}/assistant/${projectId}/ask/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ question }),
+    });
+    if (response.status === 202) {
+      await api.waitForKnowledgeBase(projectId);
+      return api.askAssistantStream(projectId, question, { onSources, onToken });
+    }
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({}));
+      throw new Error(error.detail || `Request failed (${response.status})`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const message = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = message.match(/^event: (.*)$/m)?.[1];
+        const data = JSON.parse(message.match(/^data: (.*)$/m)?.[1] || '{}');
+        if (event === 'sources') onSources?.(data);
+        else if (event === 'token') { answer += data.text; onToken?.(data.text); }
+        else if (event === 'error') throw new Error(data.detail);
+      }
+    }
+    return answer;
+  },
   rebuildKnowledgeBase: (projectId) => 
     axios.post(`${API_BASE}/assistant/${projectId}/rebuild-kb`),
 
   // Version Control
   getChapterVersions: (chapterId) => axios.get(`${API_BASE}/chapters/${chapterId}/versions`),
   getVersionContent: (versionId) => axios.get(`${API_BASE}/chapters/version/${versionId}`),
+  getVersionDiff: (chapterId, fromVersionId, toVersionId, context = 200) =>
+    axios.get(`${API_BASE}/chapters/${chapterId}/diff`, {
+      params: { from: fromVersionId, to: toVersionId, context }
+    }),
   createChapterVersion: (chapterId, summary) => 
     axios.post(`${API_BASE}/chapters/${chapterId}/create-version`, null, {
       params: { change_summary: summary }